@@ -0,0 +1,117 @@
+import re
+
+from typing import List, Optional
+from dataclasses import dataclass, field
+
+# pylint: disable-next=unused-import
+import app.storage.sql.shard
+from app.storage import sql
+
+from . import chunkstore
+from . import compress
+
+from .share import CloudFile
+
+
+FULL = "full"
+CHAIN = "chain"
+DEDUP = "dedup"
+
+# NOTE: <dbid>_<utc time>_[<chain number>_]<database file name>[.manifest][.xz|.gz]
+FILENAME_RE = re.compile(r"^(?P<dbid>[0-9A-F]{6})_(?P<time>\d{4}(?:_\d{2}){5})_(?:(?P<number>\d{4})_)?(?P<name>.+)$")
+SHARD_RE = re.compile(rf"^(?P<stem>.+){re.escape(sql.shard.FILE_INFIX)}(?P<shard>\d+)(?P<suffix>\.[^.]*)?$")
+
+
+@dataclass
+class Backup:
+    dbid: str
+    time: str
+    name: str # database file name
+    kind: str
+    files: List[CloudFile] = field(default_factory=list) # in restore order, shards before root, deltas after full backup
+
+    @property
+    def id(self) -> str:
+        return f"{self.dbid}_{self.time}"
+
+    @property
+    def size(self) -> int:
+        return sum(cloud_file.size for cloud_file in self.files)
+
+
+@dataclass
+class BackupFile:
+    dbid: str
+    time: str
+    name: str # database file name, shard file name for shards
+    kind: str
+    number: int # chain number, shard index or -1 for root file of full backup
+    codec: Optional[str]
+
+
+def parse_filename(filename) -> Optional[BackupFile]:
+    """
+    None for chunks and files not uploaded by application
+    """
+    codec = compress.get_codec(filename)
+    name = filename if codec is None else filename.removesuffix(compress.SUFFIXES[codec])
+    match = FILENAME_RE.match(name)
+    if match is None:
+        return None
+    name, kind, number = match["name"], FULL, -1
+    if match["number"] is not None:
+        kind, number = CHAIN, int(match["number"])
+    elif name.endswith(chunkstore.MANIFEST_SUFFIX):
+        kind, name = DEDUP, name.removesuffix(chunkstore.MANIFEST_SUFFIX)
+    elif (shard_match := SHARD_RE.match(name)) is not None:
+        number = int(shard_match["shard"])
+    return BackupFile(match["dbid"], match["time"], name, kind, number, codec)
+
+
+def get_root_name(backup_file: BackupFile) -> str:
+    if backup_file.kind != FULL or backup_file.number < 0:
+        return backup_file.name
+    shard_match = SHARD_RE.match(backup_file.name)
+    return f"{shard_match['stem']}{shard_match['suffix'] or ''}"
+
+
+def group_backups(cloud_files: List[CloudFile]) -> List[Backup]:
+    """
+    Backups sorted by time, chain is one backup that restores to its last delta
+    """
+    backups = {}
+    for cloud_file in cloud_files:
+        backup_file = parse_filename(cloud_file.name)
+        if backup_file is None:
+            continue
+        key = (backup_file.dbid, backup_file.time, get_root_name(backup_file), backup_file.kind)
+        backup = backups.setdefault(key, Backup(backup_file.dbid, backup_file.time, key[2], backup_file.kind))
+        backup.files.append(cloud_file)
+    for backup in backups.values():
+        backup.files.sort(key=_get_restore_order)
+    return sorted(backups.values(), key=lambda backup: (backup.time, backup.dbid, backup.name))
+
+
+def find_backups(backups: List[Backup], prefix: str) -> List[Backup]:
+    """
+    Prefix of dbid or of backup id (dbid_time)
+    """
+    prefix = prefix.upper()
+    return [backup for backup in backups if backup.id.upper().startswith(prefix)]
+
+
+def get_local_name(cloud_file: CloudFile) -> str:
+    """
+    Name of downloaded file after decompression: files of full backup get database file names, so shards are found next to root,
+    chain files and manifests keep cloud name for chain order
+    """
+    backup_file = parse_filename(cloud_file.name)
+    if backup_file.kind == FULL:
+        return backup_file.name
+    return cloud_file.name if backup_file.codec is None else cloud_file.name.removesuffix(compress.SUFFIXES[backup_file.codec])
+
+
+def _get_restore_order(cloud_file: CloudFile):
+    # NOTE: root file of full backup has number -1 and goes after shards
+    number = parse_filename(cloud_file.name).number
+    return (number < 0, number, cloud_file.name)
@@ -0,0 +1,274 @@
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+import datetime
+
+from typing import Iterable, List, Optional, Set, Tuple
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.encoding import compress_bytes, decompress_bytes
+
+from . import compress
+
+from .share import CloudError, CloudConflictError
+
+
+CHUNK_PREFIX = "chunk_"
+MANIFEST_SUFFIX = ".manifest"
+MANIFEST_VERSION = 1
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024 # average, chunks are from 1/4 to 4 times of it, scattered row updates dirty whole chunks
+CHUNK_SIZE_SPREAD = 4
+DEFAULT_UNIT_SIZE = 4096
+UPLOAD_WORKERS = 4 # chunks uploaded at once, every one waits in its own temp file
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+@dataclass
+class Chunk:
+    digest: str
+    data: bytes
+
+
+@dataclass(frozen=True)
+class ChunkOptions:
+    """
+    How files are cut into chunks, chunks are compressed by codec with level (None - not compressed) and uploaded by workers
+    """
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    compression: Optional[str] = None
+    level: Optional[int] = None
+    workers: int = UPLOAD_WORKERS
+
+
+@dataclass
+class BackupResult:
+    manifest: str
+    size: int
+    chunks: int
+    uploaded: int
+    uploaded_bytes: int
+
+
+class _ChunkUploads:
+    """
+    Chunks are uploaded on thread pool while next ones are read, at most 2 * workers chunks wait in temp files
+    Only chunks of finished uploads are added to present, uploads left on error are cancelled
+    """
+
+    def __init__(self, store, directory, present: Set[str], result: BackupResult, workers: int):
+        self.store = store
+        self.directory = directory
+        self.present = present
+        self.result = result
+        self.limit = 2 * max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.uploads = {} # future -> (chunk filename, uploaded size)
+        self.queued = set() # chunk filenames submitted by this backup
+
+    def submit(self, chunk_filename, data: bytes):
+        chunk_path = Path(self.directory, chunk_filename)
+        chunk_path.write_bytes(data)
+        self.uploads[self.executor.submit(self._upload, chunk_path, chunk_filename)] = (chunk_filename, len(data))
+        self.queued.add(chunk_filename)
+        self.wait(self.limit)
+
+    def submit_file(self, path, filename, options: ChunkOptions) -> dict:
+        """
+        Chunks of file missing at store are submitted, returns manifest entry of file
+        """
+        file_hasher, chunks = hashlib.sha256(), []
+        for chunk in iterate_chunks(path, chunk_size=options.chunk_size):
+            file_hasher.update(chunk.data)
+            chunks.append([chunk.digest, len(chunk.data)])
+            self.result.size += len(chunk.data)
+            chunk_filename = get_chunk_filename(chunk.digest, options.compression)
+            if chunk_filename not in self.present and chunk_filename not in self.queued:
+                data = chunk.data if options.compression is None else compress_bytes(chunk.data, compress.create_compressor(options.compression, options.level))
+                self.submit(chunk_filename, data)
+        self.result.chunks += len(chunks)
+        return {"name": filename, "sha256": file_hasher.hexdigest(), "chunks": chunks}
+
+    def wait(self, limit=0):
+        while len(self.uploads) > limit:
+            done, _ = wait(self.uploads, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_filename, size = self.uploads.pop(future)
+                if future.result():
+                    self.result.uploaded += 1
+                    self.result.uploaded_bytes += size
+                self.present.add(chunk_filename)
+
+    def _upload(self, chunk_path, chunk_filename) -> bool:
+        """
+        False if chunk is already at store
+        """
+        try:
+            self.store.upload_file(chunk_path, chunk_filename)
+            return True
+        except CloudConflictError:
+            return False # NOTE: uploaded by other machine or before local index was lost
+        finally:
+            chunk_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.present.update(
+                chunk_filename for future, (chunk_filename, _) in self.uploads.items() if not future.cancelled() and future.exception() is None
+            )
+
+
+def get_unit_size(path) -> int:
+    """
+    Page size of sqlite file, chunk boundaries never split a page
+    """
+    with open(path, "rb") as fd:
+        header = fd.read(100)
+    if len(header) < 100 or not header.startswith(SQLITE_HEADER):
+        return DEFAULT_UNIT_SIZE
+    page_size = int.from_bytes(header[16:18], "big")
+    return 65536 if page_size == 1 else page_size
+
+
+def iterate_chunks(path, *, chunk_size=DEFAULT_CHUNK_SIZE) -> Iterable[Chunk]:
+    """
+    Content defined chunking at page granularity: chunk ends after page whose hash has low bits set,
+    so boundaries depend on page content, not on page position, and survive pages moved by vacuum
+    """
+    unit = get_unit_size(path)
+    average_units = max(1, chunk_size // unit)
+    min_units = max(1, average_units // CHUNK_SIZE_SPREAD)
+    max_units = average_units * CHUNK_SIZE_SPREAD
+    mask = (1 << max(0, (average_units - min_units).bit_length() - 1)) - 1
+    with open(path, "rb") as fd:
+        pages = []
+        while page := fd.read(unit):
+            pages.append(page)
+            if len(pages) >= max_units or (len(pages) >= min_units and zlib.crc32(page) & mask == mask):
+                yield _make_chunk(pages)
+                pages = []
+        if pages:
+            yield _make_chunk(pages)
+
+
+def get_chunk_filename(digest, compression: Optional[str] = None) -> str:
+    """
+    Compressed chunks carry codec suffix, so plain and compressed copies of a chunk never mix
+    """
+    filename = f"{CHUNK_PREFIX}{digest}"
+    return filename if compression is None else compress.get_compressed_filename(filename, compression)
+
+
+def backup(store, files: List[Tuple[Path, str]], index_path, manifest_name, *, options: ChunkOptions = None) -> BackupResult:
+    """
+    Upload chunks of files missing at store, then manifest listing chunks of every file in order
+    Manifest goes last, so every manifest at store refers to uploaded chunks only
+    store provides destination, list_files() of cloud files and upload_file(local_path, filename), called from worker threads
+    """
+    options = ChunkOptions() if options is None else options
+    present = read_index_file(index_path, store.destination)
+    if present is None:
+        # NOTE: no local index for this destination, chunks at store are the index
+        present = {cloud_file.name for cloud_file in store.list_files() if cloud_file.name.startswith(CHUNK_PREFIX)}
+    manifest = {"version": MANIFEST_VERSION, "created": _get_time_str(), "chunk_size": options.chunk_size, "compression": options.compression, "files": []}
+    result = BackupResult(manifest_name, 0, 0, 0, 0)
+    try:
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=Path(index_path).parent) as temp_directory:
+            with _ChunkUploads(store, temp_directory, present, result, options.workers) as uploads:
+                for path, filename in files:
+                    manifest["files"].append(uploads.submit_file(path, filename, options))
+            manifest_path = Path(temp_directory, "upload")
+            manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+            store.upload_file(manifest_path, manifest_name)
+    except OSError as e:
+        raise CloudError("Cannot prepare chunks", original_exception=e) from e
+    finally:
+        write_index_file(index_path, store.destination, present)
+    return result
+
+
+def read_manifest(path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            manifest = json.load(fd)
+    except (OSError, json.JSONDecodeError) as e:
+        raise CloudError(f"Cannot read manifest {path}", original_exception=e) from e
+    if not isinstance(manifest, dict) or manifest.get("version", None) != MANIFEST_VERSION:
+        raise CloudError(f"Not supported manifest {path}")
+    return manifest
+
+
+def restore_file(file_entry: dict, chunk_directory, dst_path, *, compression=None):
+    """
+    Every chunk and whole file are checked against manifest digests, file is moved into place only when complete
+    """
+    tmp_path = Path(f"{dst_path}.restore")
+    file_hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as fd:
+            for digest, size in file_entry["chunks"]:
+                data = Path(chunk_directory, get_chunk_filename(digest, compression)).read_bytes()
+                if compression is not None:
+                    try:
+                        data = decompress_bytes(data, compress.create_decompressor(compression))
+                    except (ValueError, *compress.CODEC_ERRORS) as e:
+                        raise CloudError(f"Chunk {digest} is corrupted", original_exception=e) from e
+                if len(data) != size or hashlib.sha256(data).hexdigest() != digest:
+                    raise CloudError(f"Chunk {digest} is corrupted")
+                file_hasher.update(data)
+                fd.write(data)
+        if file_hasher.hexdigest() != file_entry["sha256"]:
+            raise CloudError(f"Restored file {file_entry['name']} does not match manifest")
+        os.replace(tmp_path, dst_path)
+    except OSError as e:
+        raise CloudError(f"Cannot restore file {file_entry['name']}", original_exception=e) from e
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def read_index_file(index_path, destination) -> Optional[Set[str]]:
+    """
+    Filenames of chunks present at destination, None if index is missing or belongs to other destination
+    """
+    try:
+        with open(index_path, "r", encoding="utf-8") as fd:
+            index = json.load(fd)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        raise CloudError(f"Cannot read chunk index {index_path}", original_exception=e) from e
+    if index.get("destination", None) != destination:
+        return None
+    return set(index.get("chunks", []))
+
+
+def write_index_file(index_path, destination, chunk_filenames):
+    tmp_path = Path(f"{index_path}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fd:
+            json.dump({"destination": destination, "chunks": sorted(chunk_filenames)}, fd)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        raise CloudError(f"Cannot write chunk index {index_path}", original_exception=e) from e
+
+
+def _make_chunk(pages) -> Chunk:
+    data = b"".join(pages)
+    return Chunk(hashlib.sha256(data).hexdigest(), data)
+
+
+def _get_time_str() -> str:
+    return datetime.datetime.now(datetime.timezone(datetime.timedelta(0))).strftime("%Y_%m_%d_%H_%M_%S")
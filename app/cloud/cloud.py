@@ -1,19 +1,37 @@
+import os
+import shutil
+import hashlib
+import tempfile
 import datetime
 
+from typing import List, Optional, Tuple
+from pathlib import Path
 from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from app import config
 
 from app.storage import sql
 # pylint: disable-next=unused-import
+import app.storage.sql.increment
+# pylint: disable-next=unused-import
 import app.storage.sql.manifest
 # pylint: disable-next=unused-import
 import app.storage.sql.raw
+# pylint: disable-next=unused-import
+import app.storage.sql.shard
 
+from . import backups
+from . import chunkstore
+from . import compress
 from . import dropbox
 from . import yandex_disk
+from . import share
+
+from .share import CloudError, CloudConflictError, CloudFile, DownloadOptions, DOWNLOAD_WORKERS
 
-from .share import CloudError
+
+CHUNK_INDEX_PREFIX = "chunk_index_"
 
 
 def _check_service(service):
@@ -37,10 +55,26 @@ def init_cloud(service):
         return DropboxCloud()
     if service == "yandex_disk":
         return YandexDiskCloud()
+    if service == "local":
+        return LocalCloud()
     assert False, "Unreacheable code"
 
 
-# pylint: disable-next=too-few-public-methods
+def get_configured_services():
+    """
+    Supported services with valid config entry, default service is the first
+    """
+    services = []
+    default_service = config.curconfig.cloud.service
+    for service in sorted(config.SUPPORTED_CLOUD_SERVICES, key=lambda s: s != default_service):
+        try:
+            _check_service(service)
+        except CloudError:
+            continue
+        services.append(service)
+    return services
+
+
 class DropboxCloud:
 
     def __init__(self):
@@ -48,15 +82,31 @@ class DropboxCloud:
         with open(refresh_token_path, "r", encoding="utf-8") as fd:
             refresh_token = fd.read().rstrip(" \r\n")
         self.cloud_directory = config.curconfig.cloud.dropbox.upload_directory
-        self.dropbox = dropbox.Dropbox(refresh_token, update_access_token=True)
+        self.destination = f"dropbox:{self.cloud_directory}"
+        self.session = share.create_session()
+        base_url = config.curconfig.get_entry("cloud.dropbox.base_url")
+        self.dropbox = dropbox.Dropbox(refresh_token, update_access_token=True, session=self.session, base_url=base_url)
+
+    def upload_database(self, path, *, filename=None):
+        for local_path, cloud_filename in _gen_cloud_filenames(path, filename):
+            cloud_path = f"{self.cloud_directory}{cloud_filename}"
+            self.dropbox.upload_file(cloud_path, local_path)
+
+    def upload_file(self, local_path, cloud_filename):
+        self.dropbox.upload_file(f"{self.cloud_directory}{cloud_filename}", local_path)
 
-    def upload_database(self, path):
-        cloud_filename = _gen_cloud_filename(path)
-        cloud_path = f"{self.cloud_directory}{cloud_filename}"
-        self.dropbox.upload_file(cloud_path, path)
+    def list_files(self) -> List[CloudFile]:
+        return self.dropbox.list_folder(self.cloud_directory)
+
+    def download_file(self, cloud_file: CloudFile, local_path, *, workers=DOWNLOAD_WORKERS):
+        cloud_path = f"{self.cloud_directory}{cloud_file.name}"
+        self.dropbox.download_file(cloud_path, local_path, DownloadOptions(cloud_file.size, cloud_file.content_hash, workers=workers))
+
+    @staticmethod
+    def create_hasher():
+        return dropbox.DropboxContentHasher()
 
 
-# pylint: disable-next=too-few-public-methods
 class YandexDiskCloud:
 
     def __init__(self):
@@ -64,20 +114,222 @@ class YandexDiskCloud:
         with open(access_token_path, "r", encoding="utf-8") as fd:
             access_token = fd.read().rstrip(" \r\n")
         self.cloud_directory = config.curconfig.cloud.yandex_disk.upload_directory
-        self.yandex_disk = yandex_disk.YandexDisk(access_token)
+        self.destination = f"yandex_disk:{self.cloud_directory}"
+        self.session = share.create_session()
+        base_url = config.curconfig.get_entry("cloud.yandex_disk.base_url")
+        self.yandex_disk = yandex_disk.YandexDisk(access_token, session=self.session, base_url=base_url)
+
+    def upload_database(self, path, *, filename=None):
+        for local_path, cloud_filename in _gen_cloud_filenames(path, filename):
+            cloud_path = f"{self.cloud_directory}{cloud_filename}"
+            self.yandex_disk.upload_file(cloud_path, local_path)
+
+    def upload_file(self, local_path, cloud_filename):
+        self.yandex_disk.upload_file(f"{self.cloud_directory}{cloud_filename}", local_path)
+
+    def list_files(self) -> List[CloudFile]:
+        return self.yandex_disk.list_folder(self.cloud_directory)
+
+    def download_file(self, cloud_file: CloudFile, local_path, *, workers=DOWNLOAD_WORKERS):
+        cloud_path = f"{self.cloud_directory}{cloud_file.name}"
+        self.yandex_disk.download_file(cloud_path, local_path, DownloadOptions(cloud_file.size, cloud_file.content_hash, workers=workers))
+
+    @staticmethod
+    def create_hasher():
+        return hashlib.sha256()
+
+
+class LocalCloud:
+    """
+    Directory on local or mounted disk used as upload destination
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        self.directory = Path(config.curconfig.cloud.local.directory if directory is None else directory)
+        self.destination = f"local:{self.directory}"
+
+    def upload_database(self, path, *, filename=None):
+        for local_path, cloud_filename in _gen_cloud_filenames(path, filename):
+            self.upload_file(local_path, cloud_filename)
+
+    def upload_file(self, local_path, cloud_filename):
+        path = Path(self.directory, cloud_filename)
+        if path.exists():
+            raise CloudConflictError(f"File {cloud_filename} already exists")
+        tmp_path = Path(f"{path}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(local_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            raise CloudError(f"Cannot copy file to {self.directory}", original_exception=e) from e
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def list_files(self) -> List[CloudFile]:
+        try:
+            return [CloudFile(path.name, path.stat().st_size) for path in self.directory.iterdir() if path.is_file()]
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            raise CloudError(f"Cannot list directory {self.directory}", original_exception=e) from e
+
+    def download_file(self, cloud_file: CloudFile, local_path, *, workers=DOWNLOAD_WORKERS): # pylint: disable=unused-argument
+        try:
+            shutil.copyfile(Path(self.directory, cloud_file.name), local_path)
+        except OSError as e:
+            raise CloudError(f"Cannot copy file from {self.directory}", original_exception=e) from e
+
+    @staticmethod
+    def create_hasher():
+        return hashlib.sha256()
 
-    def upload_database(self, path):
-        cloud_filename = _gen_cloud_filename(path)
-        cloud_path = f"{self.cloud_directory}{cloud_filename}"
-        self.yandex_disk.upload_file(cloud_path, path)
 
+def upload_compressed(cloud_instance, local_path, cloud_filename, compression, *, level=None) -> int:
+    """
+    File is stream-compressed next to local file and uploaded with codec suffix, plain file is uploaded as is
+    Returns bytes sent
+    """
+    if compression is None:
+        cloud_instance.upload_file(local_path, cloud_filename)
+        return os.stat(local_path).st_size
+    compressed_path = Path(compress.get_compressed_filename(str(local_path), compression))
+    try:
+        result = compress.compress_file(local_path, compressed_path, compression, level=level)
+        cloud_instance.upload_file(compressed_path, compress.get_compressed_filename(cloud_filename, compression))
+    finally:
+        compressed_path.unlink(missing_ok=True)
+    return result.compressed_size
+
+
+def upload_database_compressed(cloud_instance, path, compression, *, filename=None, level=None) -> int:
+    return sum(
+        upload_compressed(cloud_instance, local_path, cloud_filename, compression, level=level)
+        for local_path, cloud_filename in _gen_cloud_filenames(path, filename)
+    )
+
+
+def upload_database_chunks(cloud_instance, path, index_path, *, filename=None, options: chunkstore.ChunkOptions = None) -> chunkstore.BackupResult:
+    """
+    Deduplicated upload: chunks of database and shard files not yet present at destination and manifest of snapshot
+    """
+    files = _gen_cloud_filenames(path, filename)
+    manifest_name = f"{files[-1][1]}{chunkstore.MANIFEST_SUFFIX}"
+    return chunkstore.backup(cloud_instance, files, index_path, manifest_name, options=options)
+
+
+def get_chunk_index_path(directory, path, key) -> Path:
+    """
+    Chunk index of destination is kept at <directory>/<dbid>/chunk_index_<key>.json
+    """
+    dbid, _ = get_database_files(path)
+    return Path(directory, dbid, f"{CHUNK_INDEX_PREFIX}{key}.json")
+
+
+def restore_database_chunks(manifest_path, dst_path, *, chunk_directory=None):
+    """
+    Chunks are read from manifest directory by default, shard files are restored before root file
+    """
+    manifest_path = Path(manifest_path)
+    manifest = chunkstore.read_manifest(manifest_path)
+    files = manifest["files"]
+    chunk_directory = manifest_path.parent if chunk_directory is None else chunk_directory
+    dst_paths = sql.shard.get_shard_paths(Path(dst_path), len(files) - 1) + [Path(dst_path)]
+    for file_entry, path in zip(files, dst_paths):
+        chunkstore.restore_file(file_entry, chunk_directory, path, compression=manifest.get("compression", None))
+
+
+def list_backups(cloud_instance, prefix="") -> List[backups.Backup]:
+    return backups.find_backups(backups.group_backups(cloud_instance.list_files()), prefix)
 
-def _gen_cloud_filename(local_path):
-    with closing(sql.raw.db_connect(local_path)) as connection:
+
+def restore_backup(cloud_instance, backup: backups.Backup, dst_path, *, workers=DOWNLOAD_WORKERS):
+    """
+    Files are downloaded, checked and unpacked in temporary directory next to dst_path,
+    database replaces dst_path only when it is complete, shard files are moved before root file
+    """
+    dst_path = Path(dst_path)
+    try:
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_context = tempfile.TemporaryDirectory(dir=dst_path.parent, prefix=".cloudrestore_")
+    except OSError as e:
+        raise CloudError(f"Cannot create restore directory next to {dst_path}", original_exception=e) from e
+    with temp_context as temp_directory:
+        if backup.kind == backups.DEDUP:
+            _restore_dedup(cloud_instance, backup, dst_path, temp_directory, workers)
+            return
+        paths = [_download_backup_file(cloud_instance, cloud_file, temp_directory, workers) for cloud_file in backup.files]
+        if backup.kind == backups.CHAIN:
+            sql.increment.restore_chain(paths, dst_path)
+            return
+        dbid, local_paths = get_database_files(paths[-1])
+        if dbid != backup.dbid or local_paths != paths:
+            raise CloudError(f"Backup {backup.id} is incomplete or belongs to other database")
+        dst_paths = sql.shard.get_shard_paths(dst_path, len(paths) - 1) + [dst_path]
+        try:
+            for path, restored_path in zip(paths, dst_paths):
+                os.replace(path, restored_path)
+        except OSError as e:
+            raise CloudError(f"Cannot move restored database to {dst_path}", original_exception=e) from e
+
+
+def _restore_dedup(cloud_instance, backup, dst_path, directory, workers):
+    manifest_path = _download_backup_file(cloud_instance, backup.files[0], directory, workers)
+    chunk_files = _get_chunk_files(cloud_instance, backup, chunkstore.read_manifest(manifest_path))
+    # NOTE: chunks are small, they are fetched concurrently as whole files
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(cloud_instance.download_file, cloud_file, Path(directory, cloud_file.name), workers=1) for cloud_file in chunk_files]
+        for future in as_completed(futures):
+            future.result()
+    restore_database_chunks(manifest_path, dst_path, chunk_directory=directory)
+
+
+def _get_chunk_files(cloud_instance, backup, manifest) -> List[CloudFile]:
+    compression = manifest.get("compression", None)
+    digests = {digest for file_entry in manifest["files"] for digest, _ in file_entry["chunks"]}
+    cloud_files = {cloud_file.name: cloud_file for cloud_file in cloud_instance.list_files()}
+    chunk_files = []
+    for digest in digests:
+        cloud_file = cloud_files.get(chunkstore.get_chunk_filename(digest, compression), None)
+        if cloud_file is None:
+            raise CloudError(f"Chunk {digest} of backup {backup.id} is missing")
+        chunk_files.append(cloud_file)
+    return chunk_files
+
+
+def _download_backup_file(cloud_instance, cloud_file, directory, workers) -> Path:
+    path = Path(directory, cloud_file.name)
+    cloud_instance.download_file(cloud_file, path, workers=workers)
+    local_path = Path(directory, backups.get_local_name(cloud_file))
+    codec = compress.get_codec(path)
+    if codec is not None:
+        compress.decompress_file(path, local_path, codec)
+        path.unlink()
+    elif path != local_path:
+        path.rename(local_path)
+    return local_path
+
+
+def get_database_files(path) -> Tuple[str, List[Path]]:
+    """
+    dbid and paths of shard files and root file, root file is the last
+    """
+    path = Path(path)
+    with closing(sql.raw.db_connect(path, read_only=True)) as connection:
         if not sql.manifest.is_db_created_by_app(connection):
             raise CloudError("File is not created by application")
         dbid = sql.manifest.get_dbid(connection)
-    filename = local_path.name
+        shard_count = sql.manifest.get_shard_count(connection)
+    return dbid, sql.shard.get_shard_paths(path, shard_count) + [path]
+
+
+def _gen_cloud_filenames(local_path, filename=None):
+    """
+    (local path, cloud filename) of shard files and root file, root file is the last
+    """
+    dbid, local_paths = get_database_files(local_path)
+    filename = local_path.name if filename is None else filename
     current_time_z = datetime.datetime.now(datetime.timezone(datetime.timedelta(0)))
     time_str = current_time_z.strftime("%Y_%m_%d_%H_%M_%S")
-    return f"{dbid}_{time_str}_{filename}"
+    filenames = sql.shard.get_shard_paths(Path(filename), len(local_paths) - 1) + [Path(filename)]
+    return [(path, f"{dbid}_{time_str}_{name.name}") for path, name in zip(local_paths, filenames)]
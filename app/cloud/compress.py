@@ -0,0 +1,96 @@
+import lzma
+import zlib
+
+from typing import Optional
+from pathlib import Path
+from dataclasses import dataclass
+
+from .share import CloudError
+
+
+READ_SIZE = 1024 * 1024
+
+# NOTE: standard xz and gzip containers, downloaded backups open with usual tools
+SUFFIXES = {
+    "lzma": ".xz",
+    "zlib": ".gz"
+}
+
+DEFAULT_LEVELS = {
+    "lzma": 6,
+    "zlib": 6
+}
+
+GZIP_WBITS = 31
+
+CODEC_ERRORS = (lzma.LZMAError, zlib.error)
+
+
+@dataclass
+class CompressResult:
+    size: int
+    compressed_size: int
+
+
+def get_compressed_filename(filename: str, codec: str) -> str:
+    return f"{filename}{SUFFIXES[codec]}"
+
+
+def get_codec(path) -> Optional[str]:
+    """
+    Codec of compressed backup by file suffix, None for plain file
+    """
+    suffix = Path(path).suffix
+    for codec, codec_suffix in SUFFIXES.items():
+        if suffix == codec_suffix:
+            return codec
+    return None
+
+
+def create_compressor(codec: str, level: Optional[int] = None):
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "lzma":
+        return lzma.LZMACompressor(lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=level)
+    if codec == "zlib":
+        return zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    raise CloudError(f"Not supported compression '{codec}'")
+
+
+def create_decompressor(codec: str):
+    if codec == "lzma":
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+    if codec == "zlib":
+        return zlib.decompressobj(GZIP_WBITS)
+    raise CloudError(f"Not supported compression '{codec}'")
+
+
+def compress_file(src_path, dst_path, codec: str, *, level: Optional[int] = None) -> CompressResult:
+    """
+    Stream compression, memory use does not depend on file size
+    """
+    compressor = create_compressor(codec, level)
+    result = CompressResult(0, 0)
+    try:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            while data := src.read(READ_SIZE):
+                result.size += len(data)
+                result.compressed_size += dst.write(compressor.compress(data))
+            result.compressed_size += dst.write(compressor.flush())
+    except OSError as e:
+        raise CloudError(f"Cannot compress {src_path}", original_exception=e) from e
+    return result
+
+
+def decompress_file(src_path, dst_path, codec: Optional[str] = None):
+    codec = get_codec(src_path) if codec is None else codec
+    decompressor = create_decompressor(codec)
+    try:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            while data := src.read(READ_SIZE):
+                dst.write(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise CloudError(f"Compressed file {src_path} is truncated")
+    except CODEC_ERRORS as e:
+        raise CloudError(f"Compressed file {src_path} is corrupted", original_exception=e) from e
+    except OSError as e:
+        raise CloudError(f"Cannot decompress {src_path}", original_exception=e) from e
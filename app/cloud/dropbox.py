@@ -2,19 +2,36 @@ import json
 import os
 import hashlib
 
+from typing import List
+
 from utils.path import make_existing_file_path
 
-from .share import CloudError, make_request, make_json, get_json_field
+from .share import CloudError, CloudConflictError, CloudFile, make_request, make_request_with_retry, make_json, get_json_field, download_ranges, wait_before_retry
+from .share import DownloadOptions
 
 
 CLIENT_ID = "70lb3xbyjwf04ly"
 
+CONTENT_URL = "https://content.dropboxapi.com/2/files"
+API_URL = "https://api.dropboxapi.com/2/files"
+TOKEN_URL = "https://api.dropboxapi.com/oauth2/token"
+
+BLOCK_SIZE = 4 * 1024 * 1024 # content hash block, upload chunks are aligned to it
+UPLOAD_CHUNK_SIZE = 2 * BLOCK_SIZE
+MAX_CHUNK_ATTEMPTS = 3
+LIST_FOLDER_LIMIT = 2000
+
 
 class Dropbox:
 
-    def __init__(self, refresh_token, *, update_access_token=False):
+    def __init__(self, refresh_token, *, update_access_token=False, session=None, base_url=None):
+        """
+        base_url replaces both dropbox hosts, e.g. with local stand-in server
+        """
         self.refresh_token = refresh_token
         self.access_token = None
+        self.session = session
+        self.api_url, self.content_url, self.token_url = get_urls(base_url)
         if update_access_token:
             self.update_access_token()
 
@@ -24,52 +41,245 @@ class Dropbox:
             "client_id": CLIENT_ID,
             "grant_type": "refresh_token"
         }
-        response = make_request("POST", "https://api.dropboxapi.com/oauth2/token", params=params)
+        response = make_request("POST", self.token_url, params=params, session=self.session)
         if response.status_code != 200:
             raise CloudError(f"Cannot update access token, dropbox return {response.status_code}", "Try to update your refresh token")
         self.access_token = get_json_field(make_json(response.text), "access_token", required=True)
 
-    def upload_file(self, cloud_path, local_path):
+    def upload_file(self, cloud_path, local_path, *, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Stream file in chunks, files larger than one chunk go through upload session
+        """
+        assert chunk_size > 0 and chunk_size % BLOCK_SIZE == 0, "Chunk size should be multiple of 4 MiB"
         if self.access_token is None:
             raise CloudError("Access token not set")
         local_path = make_existing_file_path(local_path)
-        if os.stat(local_path).st_size >= 150 * 10 ** 6:
-            raise CloudError("File is too large for upload (150 MB limit)")
-        with open(local_path, "rb") as f:
-            content = f.read()
-        params = {
+        size = os.stat(local_path).st_size
+        commit = {
             "path": cloud_path,
             "mode": "add",
             "autorename": False,
             "strict_conflict": True,
-            "content_hash": Dropbox.calculate_dropbox_hash(content),
             "mute": True
         }
+        with open(local_path, "rb") as fd:
+            if size <= chunk_size:
+                content = fd.read()
+                commit["content_hash"] = Dropbox.calculate_dropbox_hash(content)
+                response = self._content_request("upload", commit, content)
+                if response.status_code != 200:
+                    raise _make_upload_error(response)
+                return
+            self._upload_session(fd, size, chunk_size, commit)
+
+    def _upload_session(self, fd, size, chunk_size, commit):
+        data = fd.read(chunk_size)
+        session_id = self._start_session(data)
+        hasher = DropboxContentHasher()
+        hasher.update(data)
+        offset, attempts = len(data), 0
+        while True:
+            fd.seek(offset)
+            data = fd.read(chunk_size)
+            finish = offset + len(data) >= size
+            file_commit = None
+            if finish:
+                file_hasher = hasher.copy()
+                file_hasher.update(data)
+                file_commit = {**commit, "content_hash": file_hasher.hexdigest()}
+            response = self._send_session_data({"session_id": session_id, "offset": offset}, data, file_commit)
+            if response is not None and response.status_code == 200:
+                if finish:
+                    return
+                hasher.update(data)
+                offset, attempts = offset + len(data), 0
+                continue
+            correct_offset = None if response is None else _get_correct_offset(response)
+            if correct_offset is not None and offset < correct_offset <= size:
+                # NOTE: previous request reached dropbox but its response was lost, skip acknowledged data
+                fd.seek(offset)
+                _hash_file_range(fd, hasher, correct_offset - offset)
+                offset = correct_offset
+                continue
+            attempts += 1
+            if (response is not None and not _is_retryable(response)) or attempts >= MAX_CHUNK_ATTEMPTS:
+                raise CloudError("Upload session failed") if response is None else _make_upload_error(response)
+            wait_before_retry(attempts - 1, response)
+
+    def _send_session_data(self, cursor, data, commit=None):
+        """
+        Data is appended at cursor, session is finished when commit of file is given, None if request failed
+        """
+        if commit is None:
+            endpoint, arg = "upload_session/append_v2", {"cursor": cursor, "close": False}
+        else:
+            endpoint, arg = "upload_session/finish", {"cursor": cursor, "commit": commit}
+        return _try_request(lambda: self._content_request(endpoint, arg, data))
+
+    def _start_session(self, data) -> str:
+        response = None
+        for attempt in range(MAX_CHUNK_ATTEMPTS):
+            if attempt > 0:
+                wait_before_retry(attempt - 1, response)
+            response = _try_request(lambda: self._content_request("upload_session/start", {"close": False}, data))
+            if response is not None and response.status_code == 200:
+                return get_json_field(make_json(response.text), "session_id", required=True)
+            if response is not None and not _is_retryable(response):
+                break
+        raise CloudError("Cannot start upload session") if response is None else _make_upload_error(response)
+
+    def list_folder(self, cloud_path) -> List[CloudFile]:
+        """
+        Files of folder with dropbox content hashes, missing folder is empty
+        """
+        if self.access_token is None:
+            raise CloudError("Access token not set")
+        # NOTE: dropbox names root folder by empty path
+        endpoint, arg = "list_folder", {"path": cloud_path.rstrip("/"), "limit": LIST_FOLDER_LIMIT}
+        files = []
+        while True:
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            # NOTE: listing does not change folder, so lost responses are simply repeated
+            response = make_request_with_retry("POST", f"{self.api_url}/{endpoint}", json=arg, headers=headers, session=self.session)
+            if response.status_code == 409 and "not_found" in _get_error_summary(response):
+                return []
+            if response.status_code != 200:
+                raise CloudError(f"Cannot list folder, dropbox return {response.status_code} {_get_error_summary(response)}")
+            js = make_json(response.text)
+            entries = get_json_field(js, "entries", ftype=list, required=True)
+            files.extend(
+                CloudFile(entry["name"], entry.get("size", 0), entry.get("content_hash", None))
+                for entry in entries if isinstance(entry, dict) and entry.get(".tag", None) == "file"
+            )
+            if not get_json_field(js, "has_more", ftype=bool, default=False):
+                return files
+            endpoint, arg = "list_folder/continue", {"cursor": get_json_field(js, "cursor", required=True)}
+
+    def download_file(self, cloud_path, local_path, options: DownloadOptions):
+        """
+        Parallel ranged download, content is checked against dropbox content hash while parts arrive
+        """
+        if self.access_token is None:
+            raise CloudError("Access token not set")
+        assert options.part_size % BLOCK_SIZE == 0, "Part size should be multiple of 4 MiB"
+
+        def fetch(start, end):
+            headers = {
+                "Authorization": f"Bearer {self.access_token}",
+                "Dropbox-API-Arg": json.dumps({"path": cloud_path}),
+                "Range": f"bytes={start}-{end}"
+            }
+            return make_request("POST", f"{self.content_url}/download", headers=headers, stream=True, session=self.session)
+
+        download_ranges(fetch, local_path, options, hasher=DropboxContentHasher())
+
+    def _content_request(self, endpoint, arg: dict, data: bytes):
         headers = {
             "Authorization": f"Bearer {self.access_token}",
-            "Dropbox-API-Arg": json.dumps(params),
+            "Dropbox-API-Arg": json.dumps(arg),
             "Content-Type": "application/octet-stream"
         }
-        response = make_request("POST", "https://content.dropboxapi.com/2/files/upload", data=content, headers=headers)
-        if response.status_code != 200:
-            error = get_json_field(make_json(response.text), "error_summary", default="")
-            raise CloudError(f"Cannot upload file, dropbox return {response.status_code} {error}")
+        return make_request("POST", f"{self.content_url}/{endpoint}", data=data, headers=headers, session=self.session)
 
     @staticmethod
     def calculate_dropbox_hash(file_content: bytes) -> str:
-        """
-        Split content for 4 MiB blocks
-        Calc SHA256 of each block and concatenate all hashes
-        Calc SHA256 of concatenated hashes
-        Encode it to hexadecimal
-        """
-        # pylint: disable-next=invalid-name
-        BLOCK_SIZE = 4 * 1024 * 1024
-        blocks_count = len(file_content) // BLOCK_SIZE + (1 if len(file_content) % BLOCK_SIZE else 0)
-        blocks_hash = []
-        for i in range(blocks_count):
-            begin = i * BLOCK_SIZE
-            end = min((i + 1) * BLOCK_SIZE, len(file_content))
-            blocks_hash.append(hashlib.sha256(file_content[begin:end]).digest())
-        concatenated = b"".join(blocks_hash)
-        return hashlib.sha256(concatenated).digest().hex()
+        hasher = DropboxContentHasher()
+        hasher.update(file_content)
+        return hasher.hexdigest()
+
+
+class DropboxContentHasher:
+    """
+    Split content for 4 MiB blocks
+    Calc SHA256 of each block and concatenate all hashes
+    Calc SHA256 of concatenated hashes
+    Encode it to hexadecimal
+    Content may come in parts of any size
+    """
+
+    def __init__(self):
+        self.overall = hashlib.sha256()
+        self.block = hashlib.sha256()
+        self.block_size = 0
+
+    def update(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            part = view[:BLOCK_SIZE - self.block_size]
+            self.block.update(part)
+            self.block_size += len(part)
+            view = view[len(part):]
+            if self.block_size == BLOCK_SIZE:
+                self.overall.update(self.block.digest())
+                self.block = hashlib.sha256()
+                self.block_size = 0
+
+    def copy(self) -> "DropboxContentHasher":
+        result = DropboxContentHasher()
+        result.overall, result.block, result.block_size = self.overall.copy(), self.block.copy(), self.block_size
+        return result
+
+    def hexdigest(self) -> str:
+        overall = self.overall.copy()
+        if self.block_size:
+            overall.update(self.block.digest())
+        return overall.hexdigest()
+
+
+def get_urls(base_url=None):
+    """
+    (api url, content url, token url)
+    """
+    if base_url is None:
+        return API_URL, CONTENT_URL, TOKEN_URL
+    base_url = base_url.rstrip("/")
+    return f"{base_url}/2/files", f"{base_url}/2/files", f"{base_url}/oauth2/token"
+
+
+def _try_request(request):
+    """
+    Response or None on connection error
+    """
+    try:
+        return request()
+    except CloudError:
+        return None
+
+
+def _is_retryable(response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _get_correct_offset(response):
+    if response.status_code != 409:
+        return None
+    error = get_json_field(make_json(response.text), "error", ftype=dict, default={})
+    while isinstance(error, dict):
+        tag = error.get(".tag", None)
+        if tag == "incorrect_offset":
+            return error.get("correct_offset", None)
+        error = error.get(tag, None)
+    return None
+
+
+def _hash_file_range(fd, hasher, size):
+    while size > 0:
+        data = fd.read(min(size, BLOCK_SIZE))
+        if not data:
+            raise CloudError("File changed during upload")
+        hasher.update(data)
+        size -= len(data)
+
+
+def _get_error_summary(response) -> str:
+    try:
+        return get_json_field(json.loads(response.text), "error_summary", default="")
+    except json.JSONDecodeError:
+        return response.text[:200]
+
+
+def _make_upload_error(response) -> CloudError:
+    error = _get_error_summary(response)
+    if response.status_code == 409 and "conflict" in error:
+        return CloudConflictError(f"File already exists, dropbox return {error}")
+    return CloudError(f"Cannot upload file, dropbox return {response.status_code} {error}")
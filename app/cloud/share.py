@@ -1,4 +1,11 @@
 import json
+import time
+import random
+
+from typing import Optional
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 
@@ -9,16 +16,195 @@ class CloudError(SmartException):
     pass
 
 
-def make_request(method, url, *, timeout=None, **kwargs) -> requests.Response:
+class CloudConflictError(CloudError):
+    """
+    File already exists at cloud path, uploads never replace files
+    """
+
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5 # seconds
+RETRY_MAX_DELAY = 30
+
+SESSION_POOL_SIZE = 8 # kept alive connections per host
+
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024 # multiple of dropbox hash block, so parts are hashed independently of others
+DOWNLOAD_READ_SIZE = 1024 * 1024
+PART_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class DownloadOptions:
+    """
+    Expected size and content hash of downloaded file, content_hash None - not checked
+    """
+    size: int
+    content_hash: Optional[str] = None
+    workers: int = DOWNLOAD_WORKERS
+    part_size: int = DOWNLOAD_PART_SIZE
+
+
+@dataclass
+class CloudFile:
+    name: str
+    size: int
+    content_hash: Optional[str] = None # in format of service, None if service does not report it
+
+
+def create_session(*, pool_size=SESSION_POOL_SIZE) -> requests.Session:
+    """
+    Session reuses TCP/TLS connections between requests, one session per cloud service
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def make_request(method, url, *, timeout=None, session=None, **kwargs) -> requests.Response:
     if timeout is None:
         timeout = 30
     try:
-        response = requests.request(method, url, timeout=timeout, **kwargs)
+        response = (session or requests).request(method, url, timeout=timeout, **kwargs)
     except requests.RequestException as e:
         raise CloudError(original_exception=e) from e
     return response
 
 
+def make_request_with_retry(method, url, *, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, rewind=None, **kwargs) -> requests.Response:
+    """
+    Repeat request on connection errors, timeouts, 429 and 5xx with exponential backoff and full jitter
+    rewind is called before every repeated attempt, e.g. to seek streamed body back to start
+    Last response is returned as is, even transient one
+    """
+    assert attempts > 0
+    for attempt in range(attempts):
+        if attempt > 0 and rewind is not None:
+            rewind()
+        response = None
+        try:
+            response = make_request(method, url, **kwargs)
+        except CloudError as e:
+            if attempt + 1 == attempts or not is_transient_error(e):
+                raise
+        if response is not None and (attempt + 1 == attempts or not is_transient_status(response.status_code)):
+            return response
+        wait_before_retry(attempt, response, base_delay=base_delay, max_delay=max_delay)
+    raise CloudError("Request attempts exhausted")
+
+
+def wait_before_retry(attempt: int, response=None, *, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Exponential backoff with full jitter after failed attempt (counted from 0), Retry-After of response is respected
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    time.sleep(max(delay, _get_retry_after(response, max_delay)))
+
+
+def download_ranges(fetch, local_path, options: DownloadOptions, *, hasher=None):
+    """
+    Parts of file are fetched concurrently by HTTP range requests and written in place, only one read block per part is in memory
+    Written prefix is hashed in order while later parts are still downloading, file is removed on any failure
+    fetch(start, end) returns streamed response with bytes start..end inclusive
+    """
+    parts = [(start, min(start + options.part_size, options.size) - 1) for start in range(0, options.size, options.part_size)]
+    local_path = Path(local_path)
+    try:
+        with open(local_path, "wb") as fd:
+            fd.truncate(options.size)
+        # NOTE: unbuffered reader, buffered one would keep stale bytes of parts written after its read
+        with open(local_path, "rb", buffering=0) as reader, ThreadPoolExecutor(max_workers=max(1, min(options.workers, len(parts)))) as executor:
+            futures = {
+                executor.submit(_download_part, fetch, local_path, start, end, whole=len(parts) == 1): index
+                for index, (start, end) in enumerate(parts)
+            }
+            done, next_part = set(), 0
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    done.add(futures[future])
+                    while next_part in done:
+                        if hasher is not None:
+                            _hash_range(reader, hasher, *parts[next_part])
+                        next_part += 1
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        if options.content_hash is not None and hasher is not None and hasher.hexdigest() != options.content_hash:
+            raise CloudError(f"Downloaded {local_path.name} does not match content hash")
+    except OSError as e:
+        local_path.unlink(missing_ok=True)
+        raise CloudError(f"Cannot write {local_path}", original_exception=e) from e
+    except BaseException:
+        local_path.unlink(missing_ok=True)
+        raise
+
+
+def _download_part(fetch, path, start, end, *, whole):
+    """
+    Part is fetched again from its start on connection errors, transient statuses and short bodies
+    """
+    for attempt in range(PART_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+        last_attempt = attempt + 1 == PART_ATTEMPTS
+        try:
+            response = fetch(start, end)
+        except CloudError as e:
+            if last_attempt or not is_transient_error(e):
+                raise
+            continue
+        try:
+            # NOTE: server may ignore range of whole file request
+            if response.status_code == 206 or (whole and response.status_code == 200):
+                if _write_part(response, path, start, end):
+                    return
+            elif last_attempt or not is_transient_status(response.status_code):
+                raise CloudError(f"Cannot download part {start}-{end}, service return {response.status_code}")
+        except requests.RequestException as e:
+            if last_attempt:
+                raise CloudError(f"Download of part {start}-{end} interrupted", original_exception=e) from e
+        finally:
+            response.close()
+    raise CloudError(f"Cannot download part {start}-{end}, attempts exhausted")
+
+
+def _write_part(response, path, start, end) -> bool:
+    """
+    False if body is shorter than part
+    """
+    size, written = end - start + 1, 0
+    with open(path, "r+b") as fd:
+        fd.seek(start)
+        for data in response.iter_content(DOWNLOAD_READ_SIZE):
+            if written + len(data) > size:
+                raise CloudError(f"Service sent more than part {start}-{end}")
+            fd.write(data)
+            written += len(data)
+    return written == size
+
+
+def _hash_range(fd, hasher, start, end):
+    fd.seek(start)
+    size = end - start + 1
+    while size > 0:
+        data = fd.read(min(size, DOWNLOAD_READ_SIZE))
+        if not data:
+            raise CloudError("Downloaded file is shorter than expected")
+        hasher.update(data)
+        size -= len(data)
+
+
+def is_transient_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def is_transient_error(error: CloudError) -> bool:
+    return isinstance(error.original_exception, (requests.ConnectionError, requests.Timeout))
+
+
 def get_json_field(js: dict, name: False, *, ftype=str, required=False, default=None):
     assert required or default is not None
     value = js.get(name, None)
@@ -38,3 +224,12 @@ def make_json(response_text):
         return json.loads(response_text)
     except json.JSONDecodeError as e:
         raise CloudError(f"Cloud service send invalid json, {e}") from e
+
+
+def _get_retry_after(response, max_delay) -> float:
+    if response is None:
+        return 0
+    try:
+        return min(max_delay, float(response.headers.get("Retry-After", 0)))
+    except ValueError:
+        return 0
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+
+from typing import Callable, List, Optional, Tuple
+from pathlib import Path
+from dataclasses import dataclass
+
+
+DEFAULT_DELAY = 10 # seconds
+DEFAULT_EXIT_WAIT = 60 # seconds
+
+
+@dataclass
+class UploadJob:
+    path: Path
+    service: str
+    due: float = 0 # time.monotonic() of start
+
+    @property
+    def key(self):
+        return (self.path, self.service)
+
+
+class UploadQueue:
+    """
+    Uploads run one by one on background thread, each job starts delay seconds after enqueue
+    Enqueuing the same (path, service) again moves the start back,
+    so a series of changes ends with one upload of the latest state
+    Failed and unfinished jobs are kept in queue file until resume() retries them
+    """
+
+    def __init__(self, upload: Callable, queue_path, *, delay=DEFAULT_DELAY, notify: Callable = None):
+        self.upload = upload # upload(path, service), raises on failure
+        self.queue_path = Path(queue_path)
+        self.delay = delay
+        self.notify = notify # notify(job, error), called on background thread
+        self.jobs = {} # key -> UploadJob
+        self.active: Optional[UploadJob] = None
+        self.closing = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def enqueue(self, path, service, *, delay=None):
+        delay = self.delay if delay is None else delay
+        job = UploadJob(Path(path), service, time.monotonic() + delay)
+        with self.condition:
+            self.jobs.pop(job.key, None)
+            self.jobs[job.key] = job
+            if self.thread is None:
+                self._start_thread()
+            self.condition.notify_all()
+
+    def resume(self) -> int:
+        """
+        Enqueue jobs saved in queue file, they start at once
+        """
+        saved = read_queue_file(self.queue_path)
+        for path, service in saved:
+            self.enqueue(path, service, delay=0)
+        return len(saved)
+
+    def pending(self) -> int:
+        with self.condition:
+            return len(self.jobs) + (self.active is not None)
+
+    def close(self, timeout=DEFAULT_EXIT_WAIT) -> int:
+        """
+        Start waiting jobs at once and wait for them up to timeout
+        Jobs left unfinished are saved to queue file, their count is returned
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        deadline = time.monotonic() + timeout
+        thread = None
+        while True:
+            # NOTE: thread broken by notify is replaced, replacement is waited too
+            with self.condition:
+                if self.thread is None or self.thread is thread:
+                    break
+                thread = self.thread
+            thread.join(max(0, deadline - time.monotonic()))
+        with self.condition:
+            left = list(self.jobs.values()) + ([self.active] if self.active is not None else [])
+            self._update_queue_file(add=[job.key for job in left])
+            return len(left)
+
+    def _start_thread(self):
+        self.thread = threading.Thread(target=self._run, name="upload-queue", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self.condition:
+                    job = self._wait_job()
+                    if job is None:
+                        self.thread = None
+                        return
+                    del self.jobs[job.key]
+                    self.active = job
+                self._run_job(job)
+        finally:
+            with self.condition:
+                if self.thread is threading.current_thread():
+                    # NOTE: thread is broken by notify, jobs enqueued meanwhile get new thread
+                    self.active = None
+                    self.thread = None
+                    if self.jobs:
+                        self._start_thread()
+
+    def _run_job(self, job: UploadJob):
+        error = None
+        try:
+            self.upload(job.path, job.service)
+        # NOTE: not only SmartException and OSError, unexpected error must not stop the queue, job is kept for retry
+        except Exception as e: # pylint: disable=broad-exception-caught
+            error = e
+        with self.condition:
+            self.active = None
+            if error is None:
+                self._update_queue_file(remove=[job.key])
+            else:
+                self._update_queue_file(add=[job.key])
+        if self.notify is not None:
+            self.notify(job, error)
+
+    def _wait_job(self) -> Optional[UploadJob]:
+        while True:
+            if not self.jobs:
+                if self.closing:
+                    return None
+                self.condition.wait()
+                continue
+            job = min(self.jobs.values(), key=lambda j: j.due)
+            timeout = job.due - time.monotonic()
+            if timeout <= 0 or self.closing:
+                return job
+            self.condition.wait(timeout)
+
+    def _update_queue_file(self, *, add=(), remove=()):
+        saved = read_queue_file(self.queue_path)
+        updated = [key for key in saved if key not in remove]
+        updated += [key for key in add if key not in updated]
+        if updated == saved:
+            return
+        try:
+            write_queue_file(self.queue_path, updated)
+        except OSError:
+            # NOTE: job is lost for retry on next start, upload itself is not affected
+            pass
+
+
+def read_queue_file(path) -> List[Tuple[Path, str]]:
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            js = json.load(fd)
+        return [(Path(item["path"]), item["service"]) for item in js]
+    except (OSError, ValueError, TypeError, KeyError):
+        return []
+
+
+def write_queue_file(path, jobs: List[Tuple[Path, str]]):
+    path = Path(path)
+    if not jobs:
+        path.unlink(missing_ok=True)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as fd:
+        json.dump([{"path": str(job_path), "service": service} for job_path, service in jobs], fd, indent=4)
+    os.replace(temp_path, path)
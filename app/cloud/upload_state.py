@@ -0,0 +1,104 @@
+import os
+import json
+import tempfile
+import datetime
+
+from typing import List, Optional
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+
+from .share import CloudError
+
+
+STATE_PREFIX = "upload_state_"
+HISTORY_LIMIT = 100
+READ_SIZE = 1024 * 1024
+
+
+@dataclass
+class UploadRecord:
+    time: str
+    size: int # bytes of database files
+    mtime: float # of uploaded database file
+    hash: str # content hash in format of destination service
+    uploaded: int # bytes sent, less than size for deltas, chunks and compressed files
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second
+        """
+        return self.uploaded / self.seconds if self.seconds > 0 else 0
+
+
+@dataclass
+class UploadState:
+    destination: str
+    history: List[UploadRecord] = field(default_factory=list)
+
+    def is_uploaded(self, size: int, content_hash: str) -> bool:
+        """
+        Last successful upload to this destination has the same content
+        """
+        return bool(self.history) and (self.history[-1].size, self.history[-1].hash) == (size, content_hash)
+
+
+def get_state_path(directory, dbid: str, key: str) -> Path:
+    return Path(directory, dbid, f"{STATE_PREFIX}{key}.json")
+
+
+def iterate_state_paths(directory, dbid: str):
+    yield from sorted(Path(directory, dbid).glob(f"{STATE_PREFIX}*.json"))
+
+
+def get_state_key(path) -> str:
+    return Path(path).stem.removeprefix(STATE_PREFIX)
+
+
+def read_state(path, destination: Optional[str] = None) -> UploadState:
+    """
+    State of other destination (upload directory changed) is started anew, None destination accepts any
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            js = json.load(fd)
+        state = UploadState(js["destination"], [UploadRecord(**record) for record in js["history"]])
+    except FileNotFoundError:
+        return UploadState(destination)
+    except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+        raise CloudError(f"Cannot read upload state {path}", original_exception=e) from e
+    if destination is not None and state.destination != destination:
+        return UploadState(destination)
+    return state
+
+
+def record_upload(path, state: UploadState, record: UploadRecord):
+    state.history = (state.history + [record])[-HISTORY_LIMIT:]
+    path = Path(path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # NOTE: concurrent uploads of database copies share dbid, temp file name is unique
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, suffix=".tmp", delete=False) as fd:
+            json.dump(asdict(state), fd, indent=4)
+        os.replace(fd.name, path)
+    except OSError as e:
+        raise CloudError(f"Cannot write upload state {path}", original_exception=e) from e
+
+
+def calculate_hash(paths, hasher) -> str:
+    """
+    Streaming hash of files content in order, hasher has update and hexdigest
+    """
+    try:
+        for path in paths:
+            with open(path, "rb") as fd:
+                while data := fd.read(READ_SIZE):
+                    hasher.update(data)
+    except OSError as e:
+        raise CloudError("Cannot hash database files", original_exception=e) from e
+    return hasher.hexdigest()
+
+
+def get_time_str() -> str:
+    return datetime.datetime.now(datetime.timezone(datetime.timedelta(0))).strftime("%Y-%m-%d %H:%M:%S")
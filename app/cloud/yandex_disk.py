@@ -1,49 +1,125 @@
 import os
+import json
+import hashlib
+
+from typing import List
 
 from utils.path import make_existing_file_path
 
-from .share import CloudError, make_request, get_json_field, make_json
+from .share import CloudError, CloudConflictError, CloudFile, make_request_with_retry, get_json_field, make_json, download_ranges
+from .share import DownloadOptions
 
 
 CLIENT_ID = "4eb86ca86ee841c3ade52e269bb4dc3d"
 
+API_URL = "https://cloud-api.yandex.net/v1/disk"
+
+LIST_LIMIT = 1000
+
 
-# pylint: disable-next=too-few-public-methods
 class YandexDisk:
 
-    def __init__(self, access_token):
+    def __init__(self, access_token, *, session=None, base_url=None):
+        """
+        base_url replaces yandex api host, e.g. with local stand-in server, upload and download links come from api
+        """
         self.access_token = access_token
+        self.session = session
+        self.api_url = API_URL if base_url is None else f"{base_url.rstrip('/')}/v1/disk"
         self.default_headers = {
             "Accept": "application/json",
             "Authorization": f"OAuth {self.access_token}",
         }
 
     def upload_file(self, cloud_path, local_path):
+        """
+        Body is streamed from file, transient failures are retried from file start with the same link:
+        yandex upload links do not accept ranged (Content-Range) resumption
+        File size limit depends on account, yandex answers 413 to larger files
+        """
         local_path = make_existing_file_path(local_path)
-        if os.stat(local_path).st_size >= 9 * 10 ** 8:
-            raise CloudError("File is too large")
-        link = self._get_upload_link(cloud_path)
-        with open(local_path, "rb") as f:
-            content = f.read()
         headers = {
             **self.default_headers,
             "Content-Type": "application/octet-stream"
         }
-        response = make_request("PUT", link, data=content, headers=headers)
-        if response.status_code not in (200, 201, 202):
-            error = get_json_field(make_json(response.text), "error", default="")
-            raise CloudError(f"Cannot upload file, yandex return {response.status_code} {error}")
+        with open(local_path, "rb") as fd:
+            for _ in range(2):
+                link = self._get_upload_link(cloud_path)
+                fd.seek(0)
+                response = make_request_with_retry("PUT", link, data=fd, headers=headers, rewind=lambda: fd.seek(0), session=self.session)
+                if response.status_code in (200, 201, 202):
+                    return
+                # NOTE: expired or unknown link, request new one once
+                if response.status_code not in (404, 410):
+                    break
+        if response.status_code == 413:
+            raise CloudError(f"File is too large for yandex disk account ({os.stat(local_path).st_size} bytes)")
+        raise CloudError(f"Cannot upload file, yandex return {response.status_code} {_get_error(response)}")
+
+    def list_folder(self, cloud_path) -> List[CloudFile]:
+        """
+        Files of folder with sha256 hashes, missing folder is empty
+        """
+        files, offset = [], 0
+        while True:
+            params = {
+                "path": cloud_path,
+                "limit": LIST_LIMIT,
+                "offset": offset,
+                "fields": "_embedded.items.name,_embedded.items.type,_embedded.items.size,_embedded.items.sha256,_embedded.total"
+            }
+            response = make_request_with_retry("GET", f"{self.api_url}/resources", headers=self.default_headers, params=params, session=self.session)
+            if response.status_code == 404:
+                return []
+            if response.status_code != 200:
+                raise CloudError(f"Cannot list folder, yandex return {response.status_code} {_get_error(response)}")
+            embedded = get_json_field(make_json(response.text), "_embedded", ftype=dict, required=True)
+            items = get_json_field(embedded, "items", ftype=list, required=True)
+            files.extend(
+                CloudFile(item["name"], item.get("size", 0), item.get("sha256", None))
+                for item in items if isinstance(item, dict) and item.get("type", None) == "file"
+            )
+            # NOTE: offset counts folders too
+            offset += len(items)
+            if not items or offset >= get_json_field(embedded, "total", ftype=int, default=0):
+                return files
+
+    def download_file(self, cloud_path, local_path, options: DownloadOptions):
+        """
+        Parallel ranged download from one download link, content is checked against sha256 while parts arrive
+        """
+        params = {"path": cloud_path}
+        response = make_request_with_retry("GET", f"{self.api_url}/resources/download", headers=self.default_headers, params=params, session=self.session)
+        if response.status_code != 200:
+            raise CloudError(f"Cannot get link for file download, yandex return {response.status_code} {_get_error(response)}")
+        link = get_json_field(make_json(response.text), "href", required=True)
+
+        # NOTE: link is on download host and does not need token, parts are retried by download_ranges
+        def fetch(start, end):
+            headers = {"Range": f"bytes={start}-{end}"}
+            return make_request_with_retry("GET", link, attempts=1, headers=headers, stream=True, session=self.session)
+
+        download_ranges(fetch, local_path, options, hasher=hashlib.sha256())
 
-    def _get_upload_link(self, cloud_path, overwrite=False):
+    def _get_upload_link(self, cloud_path, *, overwrite=False):
         params = {
             "path": cloud_path,
             "overwrite": "true" if overwrite else "false"
         }
-        response = make_request("GET", "https://cloud-api.yandex.net/v1/disk/resources/upload", headers=self.default_headers, params=params)
+        response = make_request_with_retry("GET", f"{self.api_url}/resources/upload", headers=self.default_headers, params=params, session=self.session)
         js = make_json(response.text)
+        if response.status_code == 409 and get_json_field(js, "error", default="") == "DiskResourceAlreadyExistsError":
+            raise CloudConflictError("File already exists, yandex return DiskResourceAlreadyExistsError")
         if response.status_code != 200:
             error = get_json_field(js, "error", default="")
             raise CloudError(f"Cannot get link for file upload, yandex return {response.status_code} {error}")
         if get_json_field(js, "templated", required=True, ftype=bool):
             raise CloudError("Upload link is templated, not implemented")
         return get_json_field(js, "href", required=True)
+
+
+def _get_error(response) -> str:
+    try:
+        return get_json_field(json.loads(response.text), "error", default="")
+    except json.JSONDecodeError:
+        return response.text[:200]
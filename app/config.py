@@ -1,8 +1,10 @@
 import json
+import ipaddress
 
 from typing import List, Tuple, Union
 from pathlib import Path
 from dataclasses import dataclass
+from urllib.parse import urlsplit
 
 from utils.smrtexcp import SmartException
 
@@ -15,7 +17,8 @@ DEFAULT_CONFIG_PATH = Path(".overpass", "config.json")
 
 
 ADDITIONAL_TYPES_MAP = {
-    Path: str
+    Path: str,
+    float: int
 }
 
 
@@ -63,12 +66,36 @@ class ConfigEntry:
         pass
 
 
+def _check_base_url(base_url):
+    """
+    Plain http would send tokens in clear text, it is allowed only for loopback host, e.g. local stand-in server
+    """
+    if base_url is None:
+        return
+    parts = urlsplit(base_url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ConfigError("Service base url should start with http:// or https://")
+    if parts.scheme == "http" and not _is_loopback_host(parts.hostname):
+        raise ConfigError("Service base url should use https://, http:// is allowed only for loopback host")
+
+
+def _is_loopback_host(hostname: str) -> bool:
+    if hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(hostname).is_loopback
+    except ValueError:
+        return False
+
+
 @dataclass(init=False)
 class Dropbox(ConfigEntry):
     upload_directory: str = None
     refresh_token_path: Path = None
+    base_url: str = None
 
     def check(self):
+        _check_base_url(self.base_url)
         if self.upload_directory is None:
             raise ConfigError("Upload directory not set")
         if self.refresh_token_path is None:
@@ -85,8 +112,10 @@ class Dropbox(ConfigEntry):
 class YandexDisk(ConfigEntry):
     upload_directory: str = None
     access_token_path: Path = None
+    base_url: str = None
 
     def check(self):
+        _check_base_url(self.base_url)
         if self.upload_directory is None:
             raise ConfigError("Upload directory not set")
         if self.access_token_path is None:
@@ -99,7 +128,19 @@ class YandexDisk(ConfigEntry):
             raise ConfigError("Upload directory should end with /")
 
 
-SUPPORTED_CLOUD_SERVICES = ["dropbox", "yandex_disk"]
+@dataclass(init=False)
+class LocalDirectory(ConfigEntry):
+    directory: Path = None
+
+    def check(self):
+        if self.directory is None:
+            raise ConfigError("Local upload directory not set")
+        if not self.directory.is_absolute():
+            raise ConfigError("Local upload directory should be an absolute path")
+
+
+SUPPORTED_CLOUD_SERVICES = ["dropbox", "yandex_disk", "local"]
+SUPPORTED_COMPRESSION_CODECS = ["lzma", "zlib"]
 
 
 @dataclass(init=False)
@@ -107,10 +148,33 @@ class Cloud(ConfigEntry):
     enabled: bool = None
     service: str = None
     autoupload: bool = None
+    upload_delay: int = None
+    exit_wait: int = None
+    incremental: bool = None
+    full_every: int = None
+    dedup: bool = None
+    chunk_size: int = None
+    compression: str = None
+    compression_level: int = None
     dropbox: Dropbox = None
     yandex_disk: YandexDisk = None
+    local: LocalDirectory = None
 
     def check(self):
+        if self.upload_delay is not None and self.upload_delay < 0:
+            raise ConfigError("Upload delay should not be negative")
+        if self.exit_wait is not None and self.exit_wait < 0:
+            raise ConfigError("Exit wait should not be negative")
+        if self.full_every is not None and self.full_every < 0:
+            raise ConfigError("Full backup period should not be negative")
+        if self.incremental and self.dedup:
+            raise ConfigError("Incremental and deduplicated uploads cannot be enabled together")
+        if self.chunk_size is not None and self.chunk_size < 4096:
+            raise ConfigError("Chunk size should be at least 4096")
+        if self.compression is not None and self.compression not in SUPPORTED_COMPRESSION_CODECS:
+            raise ConfigError(f"Not supported compression '{self.compression}'")
+        if self.compression_level is not None and not 0 <= self.compression_level <= 9:
+            raise ConfigError("Compression level should be in [0, 9]")
         if not self.enabled:
             return
         if not self.service:
@@ -123,11 +187,122 @@ class Cloud(ConfigEntry):
         service_config.check()
 
 
+@dataclass(init=False)
+class Scan(ConfigEntry):
+    workers: int = None
+    batch_size: int = None
+
+    def check(self):
+        if self.workers is not None and self.workers < 0:
+            raise ConfigError("Scan workers count should not be negative")
+        if self.batch_size is not None and self.batch_size < 0:
+            raise ConfigError("Scan batch size should not be negative")
+
+
+SUPPORTED_STORAGE_ENGINES = ["sqlite", "log"]
+SUPPORTED_PERFORMANCE_PROFILES = ["durable", "balanced", "fast"]
+SUPPORTED_JOURNAL_MODES = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+SUPPORTED_SYNCHRONOUS_MODES = ["OFF", "NORMAL", "FULL", "EXTRA"]
+SUPPORTED_TEMP_STORE_MODES = ["DEFAULT", "FILE", "MEMORY"]
+
+
+@dataclass(init=False)
+class Performance(ConfigEntry):
+    profile: str = None
+    journal_mode: str = None
+    synchronous: str = None
+    mmap_size: int = None
+    cache_size: int = None
+    page_size: int = None
+    temp_store: str = None
+
+    def check(self):
+        if self.profile is not None and self.profile not in SUPPORTED_PERFORMANCE_PROFILES:
+            raise ConfigError(f"Not supported performance profile '{self.profile}'")
+        if self.journal_mode is not None and self.journal_mode.upper() not in SUPPORTED_JOURNAL_MODES:
+            raise ConfigError(f"Not supported journal mode '{self.journal_mode}'")
+        if self.synchronous is not None and self.synchronous.upper() not in SUPPORTED_SYNCHRONOUS_MODES:
+            raise ConfigError(f"Not supported synchronous mode '{self.synchronous}'")
+        if self.temp_store is not None and self.temp_store.upper() not in SUPPORTED_TEMP_STORE_MODES:
+            raise ConfigError(f"Not supported temp store mode '{self.temp_store}'")
+        if self.mmap_size is not None and self.mmap_size < 0:
+            raise ConfigError("mmap size should not be negative")
+        if self.page_size is not None and (self.page_size < 512 or self.page_size > 65536 or self.page_size & (self.page_size - 1)):
+            raise ConfigError("Page size should be a power of two between 512 and 65536")
+
+
+@dataclass(init=False)
+class Maintenance(ConfigEntry):
+    auto_free_ratio: float = None
+    auto_pages: int = None
+
+    def check(self):
+        if self.auto_free_ratio is not None and not 0 < self.auto_free_ratio <= 1:
+            raise ConfigError("Auto maintenance free ratio should be in (0, 1]")
+        if self.auto_pages is not None and self.auto_pages <= 0:
+            raise ConfigError("Auto maintenance pages count should be positive")
+
+
+@dataclass(init=False)
+class Snapshots(ConfigEntry):
+    directory: Path = None
+    keep: int = None
+    step_pages: int = None
+
+    def check(self):
+        if self.directory is not None and not self.directory.is_absolute():
+            raise ConfigError("Snapshots directory should be an absolute path")
+        if self.keep is not None and self.keep <= 0:
+            raise ConfigError("Snapshots keep count should be positive")
+        if self.step_pages is not None and self.step_pages <= 0:
+            raise ConfigError("Snapshot step pages should be positive")
+
+
+@dataclass(init=False)
+class Mirror(ConfigEntry):
+    flush_interval: int = None
+    flush_statements: int = None
+
+    def check(self):
+        if self.flush_interval is not None and self.flush_interval < 0:
+            raise ConfigError("Mirror flush interval should not be negative")
+        if self.flush_statements is not None and self.flush_statements <= 0:
+            raise ConfigError("Mirror flush statements count should be positive")
+
+
+@dataclass(init=False)
+class Storage(ConfigEntry):
+    engine: str = None
+    tables_limit: int = None
+    scan: Scan = None
+    performance: Performance = None
+    maintenance: Maintenance = None
+    snapshots: Snapshots = None
+    mirror: Mirror = None
+
+    def check(self):
+        if self.engine is not None and self.engine not in SUPPORTED_STORAGE_ENGINES:
+            raise ConfigError(f"Not supported storage engine '{self.engine}'")
+        if self.tables_limit is not None and self.tables_limit <= 0:
+            raise ConfigError("Tables limit should be positive")
+        if self.scan is not None:
+            self.scan.check()
+        if self.performance is not None:
+            self.performance.check()
+        if self.maintenance is not None:
+            self.maintenance.check()
+        if self.snapshots is not None:
+            self.snapshots.check()
+        if self.mirror is not None:
+            self.mirror.check()
+
+
 @dataclass(init=False)
 class Config(ConfigEntry):
     db_directory: Path = None
     default_db: Path = None
     cloud: Cloud = None
+    storage: Storage = None
     config_path: Path = None
 
     def check(self):
@@ -139,6 +314,8 @@ class Config(ConfigEntry):
             raise ConfigError("db_directory path not exist")
         if self.cloud is not None:
             self.cloud.check()
+        if self.storage is not None:
+            self.storage.check()
 
     def fill(self, keys, *, path=None):
         if path is None:
@@ -0,0 +1,50 @@
+import os
+
+from pathlib import Path
+
+# pylint: disable-next=wildcard-import
+from utils.encoding import *
+from utils.common import serial_call
+
+from serialization import serialize, deserialize
+
+from .share import LogStoreError
+
+
+MANIFEST_SUFFIX = ".manifest"
+
+
+def init_manifest(path, mixer, key_hasher):
+    """
+    Plaintext parameters of mixer and key hasher, keys are derived from password with them
+    """
+    manifest = {
+        "mixer": serial_call(mixer, serialize, encode_json_base64),
+        "key_hasher": serial_call(key_hasher, serialize, encode_json_base64)
+    }
+    manifest_path = get_manifest_path(path)
+    temp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as fd:
+        fd.write(encode_json(manifest))
+    os.replace(temp_path, manifest_path)
+
+
+def get_mixer(path):
+    return deserialize(decode_json_base64(_read_manifest(path)["mixer"]))
+
+
+def get_key_hasher(path):
+    return deserialize(decode_json_base64(_read_manifest(path)["key_hasher"]))
+
+
+def get_manifest_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.name}{MANIFEST_SUFFIX}")
+
+
+def _read_manifest(path) -> dict:
+    try:
+        with open(get_manifest_path(path), "r", encoding="utf-8") as fd:
+            return decode_json(fd.read())
+    except (OSError, ValueError) as e:
+        raise LogStoreError(f"Cannot read manifest of log vault: {path}", original_exception=e) from e
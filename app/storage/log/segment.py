@@ -0,0 +1,99 @@
+import os
+import struct
+import zlib
+
+from typing import Iterable, Tuple
+
+from .share import LogStoreError
+
+
+ENTRY_HEADER = struct.Struct("<II") # payload size, crc32 of payload
+
+
+class SegmentFile:
+    """
+    Append-only file of checksummed entries, entry location is (offset, length)
+    Appends stay in memory until flush, one write and fsync per flush (group commit)
+    """
+
+    def __init__(self, path, *, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        # pylint: disable-next=consider-using-with
+        self.fd = open(path, "a+b")
+        self.synced_size = self.fd.seek(0, os.SEEK_END)
+        self.pending = bytearray()
+
+    @property
+    def size(self) -> int:
+        return self.synced_size + len(self.pending)
+
+    def append(self, payload: bytes) -> Tuple[int, int]:
+        offset = self.size
+        self.pending += ENTRY_HEADER.pack(len(payload), zlib.crc32(payload))
+        self.pending += payload
+        return offset, self.size - offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        if offset >= self.synced_size:
+            start = offset - self.synced_size
+            entry = bytes(self.pending[start:start + length])
+        else:
+            self.fd.seek(offset)
+            entry = self.fd.read(length)
+        payload = _check_entry(entry)
+        if payload is None:
+            raise LogStoreError(f"Damaged log entry at offset {offset}")
+        return payload
+
+    def scan(self, start: int = 0) -> Iterable[Tuple[int, int, bytes]]:
+        """
+        (offset, length, payload) of flushed entries, torn entry at the end of file is cut off
+        """
+        offset = start
+        while offset < self.synced_size:
+            self.fd.seek(offset)
+            header = self.fd.read(ENTRY_HEADER.size)
+            size = ENTRY_HEADER.unpack(header)[0] if len(header) == ENTRY_HEADER.size else self.synced_size
+            length = ENTRY_HEADER.size + size
+            payload = None if offset + length > self.synced_size else _check_entry(header + self.fd.read(size))
+            if payload is None:
+                if offset + length < self.synced_size:
+                    raise LogStoreError(f"Damaged log entry at offset {offset}")
+                # NOTE: last write did not complete, entries before it are whole
+                self._truncate(offset)
+                return
+            yield offset, length, payload
+            offset += length
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.fd.write(self.pending)
+        self.fd.flush()
+        if self.fsync:
+            os.fsync(self.fd.fileno())
+        self.synced_size += len(self.pending)
+        self.pending.clear()
+
+    def discard(self):
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+
+    def _truncate(self, size):
+        self.fd.truncate(size)
+        self.fd.flush()
+        self.synced_size = size
+
+
+def _check_entry(entry: bytes):
+    if len(entry) < ENTRY_HEADER.size:
+        return None
+    size, crc = ENTRY_HEADER.unpack_from(entry)
+    payload = entry[ENTRY_HEADER.size:]
+    if len(payload) != size or zlib.crc32(payload) != crc:
+        return None
+    return payload
@@ -0,0 +1,5 @@
+from app.storage.sql.share import StorageError
+
+
+class LogStoreError(StorageError):
+    pass
@@ -0,0 +1,335 @@
+import os
+import secrets
+import zlib
+
+from pathlib import Path
+from typing import Optional
+
+# pylint: disable-next=wildcard-import
+from utils.encoding import *
+from utils.common import serial_call, CloseOnError
+
+from crypto.tools import encode_add_padding, decode_add_padding
+
+from app.storage.store import RecordStore
+from app.storage.sql.description import TableNotExist
+
+from .segment import SegmentFile
+from .share import LogStoreError
+
+
+INDEX_SUFFIX = ".idx"
+COMPACT_SUFFIX = ".compact"
+TEMP_SUFFIX = ".tmp"
+
+OP_HEADER = "hdr"
+OP_CREATE = "create"
+OP_DROP = "drop"
+OP_PUT = "put"
+OP_DEL = "del"
+
+MAX_PAD_RND_SIZE = 6
+GENERATION_SIZE = 16
+CRC_SIZE = 4
+
+COMPACT_MIN_DEAD_BYTES = 1024 * 1024
+COMPACT_DEAD_RATIO = 0.5
+COMPACT_FLUSH_BYTES = 4 * 1024 * 1024
+INDEX_MAX_TAIL_BYTES = 4 * 1024 * 1024
+
+
+# pylint: disable-next=too-few-public-methods
+class _Table:
+
+    def __init__(self, hash_search: bool):
+        self.hash_search = hash_search
+        self.keys = {} # key -> (offset, length) of last put entry
+
+
+class LogRecordStore(RecordStore):
+    """
+    Encrypted append-only log with in-memory hash index
+    Every entry is one whole operation encrypted with its own iv
+    Index is saved encrypted next to log, only log tail written after it is replayed on open
+    Space of overwritten entries is returned by compaction, which rewrites live entries into new log
+    """
+
+    def __init__(self, path, mixer, *, fsync=True):
+        super().__init__()
+        self.path = Path(path)
+        self.mixer = mixer
+        self.segment = SegmentFile(self.path, fsync=fsync)
+        self.generation = None
+        self.tables = {}
+        self.dead_bytes = 0
+        self.indexed_size = 0
+        self._undo = []
+        self._undo_dead_bytes = 0
+
+    @staticmethod
+    def create(path, mixer, *, rewrite=False, fsync=True) -> "LogRecordStore":
+        path = Path(path)
+        if path.exists() and not rewrite:
+            raise LogStoreError(f"File already exists: {path}")
+        for stale_path in (path, get_index_path(path)):
+            stale_path.unlink(missing_ok=True)
+        store = LogRecordStore(path, mixer, fsync=fsync)
+        with CloseOnError(store):
+            store.generation = secrets.token_hex(GENERATION_SIZE)
+            store.segment.append(store.encrypt_entry({"op": OP_HEADER, "generation": store.generation}))
+            store.segment.flush()
+            store.save_index()
+        return store
+
+    @staticmethod
+    def open(path, mixer, *, fsync=True) -> "LogRecordStore":
+        path = Path(path)
+        if not path.is_file():
+            raise LogStoreError(f"File not exists: {path}")
+        store = LogRecordStore(path, mixer, fsync=fsync)
+        with CloseOnError(store):
+            store.load()
+        return store
+
+    # TABLES
+
+    def create_table(self, table, *, hash_search=False):
+        if table in self.tables:
+            raise LogStoreError(f"Table '{table}' already exists")
+        with self.transaction():
+            self._write({"op": OP_CREATE, "table": table, "hash_search": hash_search})
+
+    def delete_table(self, table):
+        self._get_table(table)
+        with self.transaction():
+            self._write({"op": OP_DROP, "table": table})
+
+    def is_table_exist(self, table):
+        return table in self.tables
+
+    def iterate_tables(self):
+        return sorted(self.tables)
+
+    # RECORDS
+
+    def insert(self, table, key, attribs):
+        if key in self._get_table(table).keys:
+            raise LogStoreError(f"Key '{key}' already exists")
+        assert all(isinstance(val, str) for val in attribs.values()), "Values should have string type"
+        with self.transaction():
+            self._write({"op": OP_PUT, "table": table, "key": key, "data": attribs})
+
+    def update(self, table, key, attribs, *, new_key=None, replace=False):
+        keys = self._get_table(table).keys
+        if key not in keys:
+            raise LogStoreError(f"Key '{key}' not exist")
+        assert all(isinstance(val, str) for val in attribs.values()), "Values should have string type"
+        if new_key is not None and new_key in keys:
+            raise LogStoreError(f"Key '{new_key}' already exist")
+        new_data = {} if replace else self._read_data(keys[key])
+        new_data.update(attribs)
+        op = {"op": OP_PUT, "table": table, "key": key if new_key is None else new_key, "data": new_data}
+        if new_key is not None:
+            op["old_key"] = key
+        with self.transaction():
+            self._write(op)
+
+    def get(self, table, key) -> Optional[dict]:
+        location = self._get_table(table).keys.get(key, None)
+        return None if location is None else self._read_data(location)
+
+    def delete(self, table, key):
+        if key not in self._get_table(table).keys:
+            return
+        with self.transaction():
+            self._write({"op": OP_DEL, "table": table, "key": key})
+
+    def count(self, table):
+        return len(self._get_table(table).keys)
+
+    def iterate(self, table):
+        for key, location in list(self._get_table(table).keys.items()):
+            yield key, self._read_data(location)
+
+    def iterate_keys(self, table):
+        # NOTE: keys are kept in index, nothing to decrypt
+        return list(self._get_table(table).keys)
+
+    # FILES
+
+    def compact(self):
+        """
+        Rewrite live entries into new log and replace old one with it
+        """
+        assert self._depth == 0, "Compaction inside transaction"
+        self.segment.flush()
+        compact_path = self.path.with_name(f"{self.path.name}{COMPACT_SUFFIX}")
+        compact_path.unlink(missing_ok=True)
+        generation = secrets.token_hex(GENERATION_SIZE)
+        tables = {}
+        with CloseOnError(SegmentFile(compact_path, fsync=self.segment.fsync)) as segment:
+            segment.append(self.encrypt_entry({"op": OP_HEADER, "generation": generation}))
+            for name, table in self.tables.items():
+                segment.append(self.encrypt_entry({"op": OP_CREATE, "table": name, "hash_search": table.hash_search}))
+                tables[name] = _Table(table.hash_search)
+                for key, (offset, length) in table.keys.items():
+                    # NOTE: entries do not depend on their position, copy them without decryption
+                    tables[name].keys[key] = segment.append(self.segment.read(offset, length))
+                    if len(segment.pending) >= COMPACT_FLUSH_BYTES:
+                        segment.flush()
+            segment.close()
+        self.segment.close()
+        os.replace(compact_path, self.path)
+        self.segment = SegmentFile(self.path, fsync=segment.fsync)
+        self.generation, self.tables, self.dead_bytes = generation, tables, 0
+        self.save_index()
+
+    def need_compaction(self) -> bool:
+        return self.dead_bytes >= max(COMPACT_MIN_DEAD_BYTES, self.segment.size * COMPACT_DEAD_RATIO)
+
+    def save_index(self):
+        index = {"generation": self.generation, "size": self.segment.synced_size, "dead": self.dead_bytes}
+        index["tables"] = {name: [table.hash_search, [[key, *location] for key, location in table.keys.items()]] for name, table in self.tables.items()}
+        data = serial_call(index, encode_json, encode_utf8)
+        data = self._encrypt_bytes(zlib.crc32(data).to_bytes(CRC_SIZE, "little") + data)
+        index_path = get_index_path(self.path)
+        temp_path = index_path.with_name(f"{index_path.name}{TEMP_SUFFIX}")
+        with open(temp_path, "wb") as fd:
+            fd.write(data)
+            fd.flush()
+            if self.segment.fsync:
+                os.fsync(fd.fileno())
+        os.replace(temp_path, index_path)
+        self.indexed_size = self.segment.synced_size
+
+    def close(self):
+        if self.segment.fd.closed:
+            return
+        self.segment.discard()
+        self.segment.close()
+        if self.generation is not None and self.indexed_size != self.segment.synced_size:
+            self.save_index()
+
+    def load(self):
+        """
+        Read header, saved index and replay log tail after it
+        """
+        entries = self.segment.scan()
+        first = next(entries, None)
+        try:
+            header = None if first is None else self.decrypt_entry(first[2])
+        except (ValueError, UnicodeDecodeError) as e:
+            raise LogStoreError("Wrong key or damaged log header", original_exception=e) from e
+        if not isinstance(header, dict) or header.get("op", None) != OP_HEADER:
+            raise LogStoreError("Wrong key or damaged log header")
+        self.generation = header["generation"]
+        start = first[1] if not self._load_index() else self.indexed_size
+        for offset, length, payload in self.segment.scan(start):
+            self._apply(self.decrypt_entry(payload), (offset, length))
+
+    def encrypt_entry(self, op: dict) -> bytes:
+        data = serial_call(op, encode_json, encode_utf8)
+        return self._encrypt_bytes(encode_add_padding(data, 0, MAX_PAD_RND_SIZE))
+
+    def decrypt_entry(self, payload: bytes) -> dict:
+        return serial_call(payload, self._decrypt_bytes, decode_add_padding, decode_utf8, decode_json)
+
+    # UTILS
+
+    def _commit(self):
+        self.segment.flush()
+        self._undo.clear()
+        if self.need_compaction():
+            self.compact()
+        elif self.segment.synced_size - self.indexed_size >= INDEX_MAX_TAIL_BYTES:
+            self.save_index()
+
+    def _rollback(self):
+        self.segment.discard()
+        for container, key, value in reversed(self._undo):
+            if value is None:
+                container.pop(key, None)
+            else:
+                container[key] = value
+        if self._undo:
+            self.dead_bytes = self._undo_dead_bytes
+        self._undo.clear()
+
+    def _get_table(self, table) -> _Table:
+        result = self.tables.get(table, None)
+        if result is None:
+            raise TableNotExist(table)
+        return result
+
+    def _write(self, op: dict):
+        if not self._undo:
+            self._undo_dead_bytes = self.dead_bytes
+        location = self.segment.append(self.encrypt_entry(op))
+        self._apply(op, location, undo=True)
+
+    def _apply(self, op: dict, location, *, undo=False):
+        kind, length = op["op"], location[1]
+        if kind == OP_HEADER:
+            self.generation = op["generation"]
+            return
+        if kind == OP_CREATE:
+            self._set(self.tables, op["table"], _Table(op["hash_search"]), undo)
+            return
+        table = self.tables[op["table"]]
+        if kind == OP_DROP:
+            self.dead_bytes += length + sum(entry_length for _, entry_length in table.keys.values())
+            self._set(self.tables, op["table"], None, undo)
+            return
+        for key in (op.get("old_key", None), op["key"]):
+            if key in table.keys:
+                self.dead_bytes += table.keys[key][1]
+                self._set(table.keys, key, None, undo)
+        if kind == OP_PUT:
+            self._set(table.keys, op["key"], location, undo)
+        else:
+            self.dead_bytes += length
+
+    def _set(self, container: dict, key, value, undo):
+        if undo:
+            self._undo.append((container, key, container.get(key, None)))
+        if value is None:
+            container.pop(key, None)
+        else:
+            container[key] = value
+
+    def _load_index(self) -> bool:
+        index_path = get_index_path(self.path)
+        if not index_path.is_file():
+            return False
+        with open(index_path, "rb") as fd:
+            data = self._decrypt_bytes(fd.read())
+        crc, data = int.from_bytes(data[:CRC_SIZE], "little"), data[CRC_SIZE:]
+        if zlib.crc32(data) != crc:
+            return False
+        index = serial_call(data, decode_utf8, decode_json)
+        # NOTE: index of other generation is left from before compaction
+        if index["generation"] != self.generation or index["size"] > self.segment.synced_size:
+            return False
+        self.tables = {}
+        for name, (hash_search, keys) in index["tables"].items():
+            self.tables[name] = _Table(hash_search)
+            self.tables[name].keys = {key: (offset, length) for key, offset, length in keys}
+        self.dead_bytes, self.indexed_size = index["dead"], index["size"]
+        return True
+
+    def _read_data(self, location) -> dict:
+        return self.decrypt_entry(self.segment.read(*location))["data"]
+
+    def _encrypt_bytes(self, data: bytes) -> bytes:
+        iv = self.mixer.iv_set_random()
+        return iv + self.mixer.process(data)
+
+    def _decrypt_bytes(self, data: bytes) -> bytes:
+        mixer = self.mixer.opp
+        mixer.iv_set(data[:mixer.iv_size_total])
+        return mixer.process(data[mixer.iv_size_total:])
+
+
+def get_index_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.name}{INDEX_SUFFIX}")
@@ -0,0 +1,2 @@
+# NOTE: bloom filter is stored in vault, its row hooks are registered on import and should be active whenever content is changed
+from . import bloom
@@ -0,0 +1,267 @@
+import contextlib
+import hashlib
+import math
+
+from typing import Optional, Tuple
+
+import pypika
+
+# pylint: disable-next=wildcard-import
+from utils.encoding import *
+from utils.common import random_bytes, serial_call
+
+from . import content
+
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+BLOOM_TABLE = "bloom_filter"
+
+KEY_COL = "key"
+DATA_COL = "data"
+IV_DATA_COL = "iv_data"
+
+FALSE_POSITIVE_RATE = 0.001
+MIN_CAPACITY = 1024
+SECRET_SIZE = 32
+HEADER_SIZE_BYTES = 4
+
+MAX_STALE_RATIO = 0.25
+
+
+class BloomFilter:
+    """
+    Bloom filter of keyed key hashes, stored encrypted in BLOOM_TABLE once per transaction
+    No false negatives while filter is a superset of table keys,
+    deleted keys stay as stale bits until rebuild
+    """
+
+    def __init__(self, capacity: int, *, secret: bytes = None, bits: bytes = None, count=0, stale=0):
+        self._setup(capacity, secret, bits)
+        self.count = count
+        self.stale = stale
+        self.dirty = False
+        self.deferred = False
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        self.dirty = True
+
+    def __contains__(self, key: str):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def reset(self, capacity: int):
+        self._setup(capacity, None, None)
+        self.count = 0
+        self.stale = 0
+        self.dirty = True
+
+    def is_stale(self) -> bool:
+        return self.stale > max(MIN_CAPACITY // 4, self.count * MAX_STALE_RATIO)
+
+    def to_bytes(self) -> bytes:
+        header = {"capacity": self.capacity, "secret": encode_base64(self.secret), "count": self.count, "stale": self.stale}
+        header = serial_call(header, encode_json, encode_utf8)
+        return len(header).to_bytes(HEADER_SIZE_BYTES, "little") + header + self.bits
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "BloomFilter":
+        header_end = HEADER_SIZE_BYTES + int.from_bytes(data[:HEADER_SIZE_BYTES], "little")
+        header = serial_call(data[HEADER_SIZE_BYTES:header_end], decode_utf8, decode_json)
+        secret, bits = decode_base64(header["secret"]), data[header_end:]
+        return BloomFilter(header["capacity"], secret=secret, bits=bits, count=header["count"], stale=header["stale"])
+
+    def _setup(self, capacity, secret, bits):
+        self.capacity = max(capacity, MIN_CAPACITY)
+        self.size = _calc_size(self.capacity)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.secret = random_bytes(SECRET_SIZE) if secret is None else secret
+        self.bits = bytearray(self.size // 8) if bits is None else bytearray(bits)
+        assert len(self.bits) * 8 == self.size
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(encode_utf8(key), key=self.secret, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+
+def init_bloom_table(connection):
+    columns = [pypika.Column(KEY_COL, "TEXT", nullable=False), pypika.Column(DATA_COL, "TEXT", nullable=False), pypika.Column(IV_DATA_COL, "TEXT", nullable=False)]
+    create_table_raw(connection, BLOOM_TABLE, *columns, primary_key=KEY_COL)
+
+
+def might_contain(ctx, desc, key: str) -> bool:
+    bloom_filter = _get_filter(ctx, desc)
+    if bloom_filter is None:
+        return True
+    return key in bloom_filter
+
+
+def on_insert(ctx, desc, key: str):
+    bloom_filter, rebuilt = _get_filter_rebuilt(ctx, desc)
+    if bloom_filter is None:
+        return
+    # NOTE: key row is already inserted, rebuild adds it
+    if rebuilt:
+        pass
+    elif bloom_filter.count >= bloom_filter.capacity:
+        _rebuild(ctx, desc, bloom_filter, capacity=bloom_filter.capacity * 2)
+    else:
+        bloom_filter.add(key)
+    _store_if_dirty(ctx, desc, bloom_filter)
+
+
+def on_update(ctx, desc, key: str, new_key: str):
+    if key == new_key:
+        return
+    on_delete(ctx, desc)
+    on_insert(ctx, desc, new_key)
+
+
+def on_delete(ctx, desc):
+    bloom_filter = _get_filter(ctx, desc)
+    if bloom_filter is None:
+        return
+    bloom_filter.stale += 1
+    bloom_filter.dirty = True
+    if bloom_filter.is_stale():
+        _rebuild(ctx, desc, bloom_filter)
+    _store_if_dirty(ctx, desc, bloom_filter)
+
+
+def on_delete_table(ctx, desc):
+    ctx.bloom.pop(desc.raw_name, None)
+    if isinstance(ctx.connection, VaultConnection):
+        ctx.connection.commit_hooks.pop((BLOOM_TABLE, desc.raw_name), None)
+    if is_table_exist_raw(ctx.connection, BLOOM_TABLE):
+        delete_record_raw(ctx.connection, BLOOM_TABLE, KEY_COL, desc.raw_name)
+
+
+def rebuild(ctx, desc):
+    bloom_filter = _get_filter(ctx, desc)
+    if bloom_filter is None:
+        return
+    _rebuild(ctx, desc, bloom_filter)
+    _store_if_dirty(ctx, desc, bloom_filter)
+
+
+def compact(ctx, desc):
+    """
+    Drop stale bits of deleted keys, rebuild only if there are any
+    """
+    bloom_filter = _get_filter(ctx, desc)
+    if bloom_filter is None or bloom_filter.stale == 0:
+        return
+    _rebuild(ctx, desc, bloom_filter)
+    _store_if_dirty(ctx, desc, bloom_filter)
+
+
+@contextlib.contextmanager
+def deferred_store(ctx, desc):
+    """
+    Store filter once on exit instead of on every insert, for bulk loads outside of transaction
+    """
+    bloom_filter = _get_filter(ctx, desc)
+    if bloom_filter is None:
+        yield
+        return
+    bloom_filter.deferred = True
+    try:
+        yield
+    finally:
+        bloom_filter.deferred = False
+    _store_if_dirty(ctx, desc, bloom_filter)
+
+
+content.register_row_hooks("bloom", content.RowHooks(
+    on_init=init_bloom_table,
+    on_insert=lambda ctx, desc, _rowid, key, _attribs: on_insert(ctx, desc, key),
+    on_update=lambda ctx, desc, _rowid, key, new_key, _new_data: on_update(ctx, desc, key, new_key),
+    on_delete=lambda ctx, desc, _rowid: on_delete(ctx, desc),
+    on_delete_table=on_delete_table,
+    might_contain=might_contain,
+    bulk_insert=deferred_store
+))
+
+
+# UTILS
+
+
+def _get_filter(ctx, desc) -> Optional[BloomFilter]:
+    return _get_filter_rebuilt(ctx, desc)[0]
+
+
+def _get_filter_rebuilt(ctx, desc) -> Tuple[Optional[BloomFilter], bool]:
+    """
+    Cached, stored or rebuilt from table filter, second value is True if filter is just rebuilt
+    """
+    if desc.hash_search_enabled:
+        return None, False
+    bloom_filter = ctx.bloom.get(desc.raw_name, None)
+    if bloom_filter is None:
+        bloom_filter = _load(ctx, desc)
+    rebuilt = bloom_filter is None
+    if rebuilt:
+        bloom_filter = BloomFilter(0)
+        _rebuild(ctx, desc, bloom_filter)
+    ctx.bloom[desc.raw_name] = bloom_filter
+    return bloom_filter, rebuilt
+
+
+def _rebuild(ctx, desc, bloom_filter: BloomFilter, *, capacity: int = None):
+    keys = [row[content.KEY_COL] for row in content.iterate_with_decryption(ctx, desc.name, columns=(content.KEY_COL,))]
+    bloom_filter.reset(max(capacity or 0, 2 * len(keys)))
+    for key in keys:
+        bloom_filter.add(key)
+
+
+def _load(ctx, desc) -> Optional[BloomFilter]:
+    if not is_table_exist_raw(ctx.connection, BLOOM_TABLE):
+        return None
+    row = get_record_raw(ctx.connection, BLOOM_TABLE, KEY_COL, desc.raw_name)
+    if row is None:
+        return None
+    mixer = ctx.mixer.opp
+    mixer.iv_set(decode_base64(row[IV_DATA_COL]))
+    data = serial_call(row[DATA_COL], decode_base64, mixer.process)
+    return BloomFilter.from_bytes(data)
+
+
+def _store_if_dirty(ctx, desc, bloom_filter: BloomFilter):
+    if not bloom_filter.dirty or bloom_filter.deferred:
+        return
+    connection = ctx.connection
+    if isinstance(connection, VaultConnection) and connection.in_transaction:
+        # NOTE: whole blob is rewritten on store, so store it on commit, drop cached filter changed by rolled back transaction
+        key = (BLOOM_TABLE, desc.raw_name)
+        connection.commit_hooks[key] = lambda: _store(ctx, desc, bloom_filter)
+        connection.rollback_hooks[key] = lambda: _drop_cached(ctx, desc, bloom_filter)
+        return
+    _store(ctx, desc, bloom_filter)
+
+
+def _store(ctx, desc, bloom_filter: BloomFilter):
+    if not bloom_filter.dirty:
+        return
+    if not is_table_exist_raw(ctx.connection, BLOOM_TABLE):
+        init_bloom_table(ctx.connection)
+    iv = encode_base64(ctx.mixer.iv_set_random())
+    crypted_data = serial_call(bloom_filter.to_bytes(), ctx.mixer.process, encode_base64)
+    # NOTE: filter blob is large, bind it as parameter instead of building sql literal
+    sql_text = f"INSERT OR REPLACE INTO {BLOOM_TABLE} ({KEY_COL}, {DATA_COL}, {IV_DATA_COL}) VALUES (?, ?, ?)"
+    execute_sql(ctx.connection, sql_text, params=(desc.raw_name, crypted_data, iv), close_cursor=True)
+    bloom_filter.dirty = False
+
+
+def _drop_cached(ctx, desc, bloom_filter: BloomFilter):
+    if ctx.bloom.get(desc.raw_name, None) is bloom_filter:
+        del ctx.bloom[desc.raw_name]
+
+
+def _calc_size(capacity: int) -> int:
+    size = math.ceil(-capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+    return (size + 7) // 8 * 8
@@ -0,0 +1,43 @@
+from typing import Iterable, Optional
+
+
+class DescriptionCatalog:
+    """
+    Decrypted table descriptions of one connection
+    Filled by name on lookup or fully on iteration, kept in sync by description.insert/delete
+    """
+
+    def __init__(self):
+        self.descs = {}
+        self.raw_names = set()
+        self.loaded = False
+        self.name_hash_key = None
+
+    def load(self, descs: Iterable):
+        self.descs.clear()
+        self.raw_names.clear()
+        for desc in descs:
+            self.add(desc)
+        self.loaded = True
+
+    def invalidate(self):
+        self.descs.clear()
+        self.raw_names.clear()
+        self.loaded = False
+
+    def add(self, desc):
+        self.descs[desc.name] = desc
+        self.raw_names.add(desc.raw_name)
+
+    def remove(self, desc):
+        self.descs.pop(desc.name, None)
+        self.raw_names.discard(desc.raw_name)
+
+    def get(self, name) -> Optional[object]:
+        return self.descs.get(name, None)
+
+    def __iter__(self):
+        return iter(sorted(self.descs.values(), key=lambda desc: desc.raw_name))
+
+    def __len__(self):
+        return len(self.descs)
@@ -0,0 +1,68 @@
+from typing import Iterable
+
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+CHANGELOG_TABLE = "change_log"
+
+TABLE_COL = "raw_name"
+ROW_COL = "row_id"
+SEQ_COL = "seq"
+
+TABLE_ROW_ID = 0 # whole table was created or deleted, real row ids start from 1
+
+
+def init_changelog_table(connection):
+    """
+    One entry per changed row with the seq of its last change, entries hold no row content
+    """
+    if is_changelog_enabled(connection):
+        return
+    execute_sql(
+        connection,
+        f"CREATE TABLE {CHANGELOG_TABLE} ({TABLE_COL} TEXT NOT NULL, {ROW_COL} INTEGER NOT NULL, {SEQ_COL} INTEGER NOT NULL, "
+        f"PRIMARY KEY ({TABLE_COL}, {ROW_COL}))",
+        close_cursor=True
+    )
+    create_index_raw(connection, CHANGELOG_TABLE, SEQ_COL)
+
+
+def is_changelog_enabled(connection) -> bool:
+    return is_table_exist_raw(connection, CHANGELOG_TABLE)
+
+
+def on_change(ctx, desc, rowid):
+    if ctx.changelog:
+        _log(ctx.connection, desc.raw_name, rowid)
+
+
+def on_table(ctx, desc):
+    if ctx.changelog:
+        _log(ctx.connection, desc.raw_name, TABLE_ROW_ID)
+
+
+def get_last_seq(connection) -> int:
+    row = execute_sql(connection, f"SELECT IFNULL(MAX({SEQ_COL}), 0) AS seq FROM {CHANGELOG_TABLE}", fetch_one=True)
+    return row["seq"]
+
+
+def iterate_changes(connection, after_seq: int) -> Iterable:
+    sql_text = f"SELECT {TABLE_COL}, {ROW_COL}, {SEQ_COL} FROM {CHANGELOG_TABLE} WHERE {SEQ_COL} > ? ORDER BY {SEQ_COL}"
+    yield from iterate_query_raw(connection, sql_text, params=(after_seq,))
+
+
+def prune(connection, up_to_seq: int):
+    """
+    Drop entries already contained in full backup, the last entry is kept so seq never goes back
+    """
+    sql_text = f"DELETE FROM {CHANGELOG_TABLE} WHERE {SEQ_COL} <= ? AND {SEQ_COL} < (SELECT MAX({SEQ_COL}) FROM {CHANGELOG_TABLE})"
+    execute_sql(connection, sql_text, params=(up_to_seq,), close_cursor=True)
+
+
+def _log(connection, raw_name, row_id):
+    sql_text = (
+        f"INSERT OR REPLACE INTO {CHANGELOG_TABLE} ({TABLE_COL}, {ROW_COL}, {SEQ_COL}) "
+        f"VALUES (?, ?, (SELECT IFNULL(MAX({SEQ_COL}), 0) + 1 FROM {CHANGELOG_TABLE}))"
+    )
+    execute_sql(connection, sql_text, params=(raw_name, row_id), close_cursor=True)
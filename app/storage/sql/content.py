@@ -1,20 +1,25 @@
+import contextlib
 import collections
 import secrets
 
-from typing import Iterable
+from typing import Callable, Iterable, Tuple
 from collections import namedtuple
+from dataclasses import dataclass
 
 import pypika
 
 # pylint: disable-next=wildcard-import
 from utils.encoding import *
-from utils.common import serial_call
+from utils.common import serial_call, FreeOnError
 
 from crypto.primitives import Hash512SHA3
 from crypto.tools import encode_add_padding, decode_add_padding
 
 from . import manifest
 from . import description
+from . import pipeline
+from . import shard
+from . import changelog
 
 from .description import TableDescription
 from .share import StorageError
@@ -45,49 +50,117 @@ MAX_KEY_PAD_RND_SIZE = 6
 
 MAX_DATA_PAD_RND_SIZE = 6
 
+DEFAULT_TABLES_LIMIT = 1000
+
 KeyEncryptionResult = namedtuple("KeyEncryptionResult", ["iv_key", "crypted_key", "key_hash"])
 DataEncryptionResult = namedtuple("DataEncryptionResult", ["iv_data", "crypted_data"])
 
 
+@dataclass(frozen=True)
+class RowHooks:
+    """
+    Callbacks of modules keeping state derived from rows (search index, bloom filter), they register themselves on import
+    """
+    on_init: Callable = None # (connection), empty database initialization
+    on_insert: Callable = None # (ctx, desc, rowid, key, attribs)
+    on_update: Callable = None # (ctx, desc, rowid, key, new_key, new_data)
+    on_delete: Callable = None # (ctx, desc, rowid), called after row is deleted
+    on_delete_table: Callable = None # (ctx, desc), called before table is deleted
+    might_contain: Callable = None # (ctx, desc, key) -> bool, False only if table surely has no key
+    bulk_insert: Callable = None # (ctx, desc) -> context manager around many inserts into table
+
+
+ROW_HOOKS = {} # name -> RowHooks
+
+
+def register_row_hooks(name, hooks: RowHooks):
+    ROW_HOOKS[name] = hooks
+
+
+def _iterate_row_hooks(hook_name) -> Iterable[Callable]:
+    return (hook for hooks in ROW_HOOKS.values() if (hook := getattr(hooks, hook_name)) is not None)
+
+
+def _run_row_hooks(hook_name, *args):
+    for hook in _iterate_row_hooks(hook_name):
+        hook(*args)
+
+
+@contextlib.contextmanager
+def _bulk_insert(ctx, desc):
+    with contextlib.ExitStack() as stack:
+        for hook in _iterate_row_hooks("bulk_insert"):
+            stack.enter_context(hook(ctx, desc))
+        yield
+
+
 def init_empty_database(connection, mixer, hs_hasher, key_hasher):
     if len(get_db_tables_raw(connection)) > 0:
         raise StorageError("Database is not empty for initializing")
     with connection:
         manifest.init_manifest_table(connection, mixer, key_hasher, hs_hasher)
         description.init_description_table(connection)
+        _run_row_hooks("on_init", connection)
     try:
         manifest.check_key(connection, mixer)
     except manifest.KeyCheckError:
         assert False, "Cannot verify key after database initialization, encryption error"
 
 
-def create_table(ctx, original_table_name, *, enable_hash_search=False):
+def create_table(ctx, original_table_name, *, enable_hash_search=False, tables_limit=DEFAULT_TABLES_LIMIT):
     if description.is_table_exist(ctx, original_table_name):
         raise StorageError(f"Table '{original_table_name}' already exists")
-    counter = _get_free_table_counter(ctx)
+    counter = _allocate_table_counter(ctx, tables_limit)
     desc = TableDescription(f"{RAW_TABLE_PREFIX}{counter}", original_table_name, enable_hash_search)
-    _create_content_table(ctx, desc)
-    _create_iv_table(ctx, desc)
-    if desc.hash_search_enabled:
-        _create_hs_table(ctx, desc)
-    description.insert(ctx, desc)
-
-
-def _get_free_table_counter(ctx) -> str:
-    counter_set = set(range(1000))
-    for desc in description.iterate_with_decryption(ctx):
-        desc_counter = int(desc.raw_name.replace(RAW_TABLE_PREFIX, ""))
-        counter_set.remove(desc_counter)
-    if len(counter_set) == 0:
-        raise StorageError("Tables limit exceeded (1000)")
-    return str(counter_set.pop()).zfill(3)
+    # NOTE: catalog is not transactional, reload it if transaction goes wrong
+    with FreeOnError(ctx.catalog, ctx.catalog.invalidate):
+        _create_content_table(ctx, desc)
+        _create_iv_table(ctx, desc)
+        if desc.hash_search_enabled:
+            _create_hs_table(ctx, desc)
+        description.insert(ctx, desc)
+        changelog.on_table(ctx, desc)
+
+
+def _allocate_table_counter(ctx, tables_limit) -> str:
+    counter, free_list = _get_table_allocator(ctx)
+    if counter - len(free_list) >= tables_limit:
+        raise StorageError(f"Tables limit exceeded ({tables_limit})")
+    if free_list:
+        free_list.sort()
+        result = free_list.pop(0)
+    else:
+        result = counter
+        counter += 1
+    manifest.set_table_allocator(ctx.connection, counter, free_list)
+    return str(result).zfill(3)
+
+
+def _release_table_counter(ctx, desc):
+    counter, free_list = _get_table_allocator(ctx)
+    free_list.append(int(desc.raw_name.replace(RAW_TABLE_PREFIX, "")))
+    manifest.set_table_allocator(ctx.connection, counter, free_list)
+
+
+def _get_table_allocator(ctx):
+    allocator = manifest.get_table_allocator(ctx.connection)
+    if allocator is not None:
+        return allocator
+    # NOTE: databases created before allocator, restore it from catalog once
+    used = {int(raw_name.replace(RAW_TABLE_PREFIX, "")) for raw_name in description.get_raw_names(ctx)}
+    counter = max(used) + 1 if used else 0
+    return counter, [i for i in range(counter) if i not in used]
+
+
+def _get_table_schema(ctx, desc):
+    return shard.get_schema(ctx, int(desc.raw_name.replace(RAW_TABLE_PREFIX, "")))
 
 
 def _create_content_table(ctx, desc):
     columns = [pypika.Column(KEY_COL, "TEXT", nullable=False)]
     columns.append(pypika.Column(DATA_COL, "TEXT", nullable=False))
     columns.append(pypika.Column(ID_COL, "INTEGER", nullable=False))
-    create_table_raw(ctx.connection, desc.raw_name, *columns, primary_key=ID_COL)
+    create_table_raw(ctx.connection, desc.raw_name, *columns, primary_key=ID_COL, schema=_get_table_schema(ctx, desc))
 
 
 def _create_iv_table(ctx, desc):
@@ -96,7 +169,8 @@ def _create_iv_table(ctx, desc):
     columns = [pypika.Column(IV_KEY_COL, "TEXT", nullable=False)]
     columns.append(pypika.Column(IV_DATA_COL, "TEXT", nullable=False))
     columns.append(pypika.Column(ID_COL, "INTEGER", nullable=False))
-    create_table_raw(ctx.connection, iv_table_name, *columns, primary_key=ID_COL, foreign_key=ForeignKey(ID_COL, ID_COL, desc.raw_name))
+    schema = _get_table_schema(ctx, desc)
+    create_table_raw(ctx.connection, iv_table_name, *columns, primary_key=ID_COL, foreign_key=ForeignKey(ID_COL, ID_COL, desc.raw_name), schema=schema)
 
 
 def _create_hs_table(ctx, desc):
@@ -105,17 +179,22 @@ def _create_hs_table(ctx, desc):
     desc.hs_data = secrets.token_bytes(MIN_HS_DATA_SIZE + secrets.randbelow(MAX_HS_DATA_SIZE - MIN_HS_DATA_SIZE))
     columns = [pypika.Column(HS_HASH_COL, "TEXT", nullable=False)]
     columns.append(pypika.Column(ID_COL, "INTEGER", nullable=False))
-    create_table_raw(ctx.connection, hs_table_name, *columns, primary_key=ID_COL, foreign_key=ForeignKey(ID_COL, ID_COL, desc.raw_name), unique=(HS_HASH_COL,))
-    create_index_raw(ctx.connection, hs_table_name, HS_HASH_COL)
+    schema = _get_table_schema(ctx, desc)
+    create_table_raw(ctx.connection, hs_table_name, *columns, primary_key=ID_COL, foreign_key=ForeignKey(ID_COL, ID_COL, desc.raw_name), unique=(HS_HASH_COL,), schema=schema)
+    create_index_raw(ctx.connection, hs_table_name, HS_HASH_COL, schema=schema)
 
 
 def delete_table(ctx, table):
     desc = description.get(ctx, table)
-    description.delete(ctx, table)
-    if desc.hash_search_enabled:
-        delete_table_raw(ctx.connection, f"{HS_TABLE_PREFIX}{desc.raw_name}")
-    delete_table_raw(ctx.connection, f"{IV_TABLE_PREFIX}{desc.raw_name}")
-    delete_table_raw(ctx.connection, desc.raw_name)
+    with FreeOnError(ctx.catalog, ctx.catalog.invalidate):
+        _run_row_hooks("on_delete_table", ctx, desc)
+        description.delete(ctx, table)
+        if desc.hash_search_enabled:
+            delete_table_raw(ctx.connection, f"{HS_TABLE_PREFIX}{desc.raw_name}")
+        delete_table_raw(ctx.connection, f"{IV_TABLE_PREFIX}{desc.raw_name}")
+        delete_table_raw(ctx.connection, desc.raw_name)
+        _release_table_counter(ctx, desc)
+        changelog.on_table(ctx, desc)
 
 
 def copy_data(ctx, src_table: str, dst_table: str):
@@ -125,9 +204,10 @@ def copy_data(ctx, src_table: str, dst_table: str):
         raise StorageError(f"Table {dst_table} not exist")
     if count_records(ctx, dst_table) > 0:
         raise StorageError("Copy not allowed to non-empty tables")
-    for row in iterate_with_decryption(ctx, src_table):
-        key, attribs = row[KEY_COL], row[DATA_COL]
-        insert_record(ctx, dst_table, key, attribs)
+    with _bulk_insert(ctx, description.get(ctx, dst_table)):
+        for row in iterate_with_decryption(ctx, src_table):
+            key, attribs = row[KEY_COL], row[DATA_COL]
+            insert_record(ctx, dst_table, key, attribs)
 
 
 def insert_record(ctx, table, key: str, attribs: dict):
@@ -142,6 +222,8 @@ def insert_record(ctx, table, key: str, attribs: dict):
     insert_record_raw(ctx.connection, f"{IV_TABLE_PREFIX}{desc.raw_name}", iv_key, iv_data, rowid, columns=(IV_KEY_COL, IV_DATA_COL, ID_COL))
     if desc.hash_search_enabled:
         insert_record_raw(ctx.connection, f"{HS_TABLE_PREFIX}{desc.raw_name}", key_hash, rowid, columns=(HS_HASH_COL, ID_COL))
+    _run_row_hooks("on_insert", ctx, desc, rowid, key, attribs)
+    changelog.on_change(ctx, desc, rowid)
 
 
 def update_record(ctx, table, key: str, attribs: dict, *, new_key=None, replace=False):
@@ -156,12 +238,21 @@ def update_record(ctx, table, key: str, attribs: dict, *, new_key=None, replace=
         new_key = key
     new_data = {} if replace else dict(get_record_by_id(ctx, desc, rowid))
     new_data.update(attribs)
+    update_record_by_id(ctx, desc, rowid, key, new_key, new_data)
+
+
+def update_record_by_id(ctx, desc, rowid, key: str, new_key: str, new_data: dict):
+    """
+    Rewrite row with known id, key is the current key of row (for bloom filter)
+    """
     iv_key, crypted_key, key_hash = encrypt_key(ctx, new_key, desc)
     iv_data, crypted_data = encrypt_data(ctx, new_data)
     update_record_raw(ctx.connection, desc.raw_name, ID_COL, rowid, {KEY_COL: crypted_key, DATA_COL: crypted_data})
     update_record_raw(ctx.connection, desc.iv_name, ID_COL, rowid, {IV_KEY_COL: iv_key, IV_DATA_COL: iv_data})
     if desc.hash_search_enabled:
         update_record_raw(ctx.connection, desc.hs_name, ID_COL, rowid, {HS_HASH_COL: key_hash})
+    _run_row_hooks("on_update", ctx, desc, rowid, key, new_key, new_data)
+    changelog.on_change(ctx, desc, rowid)
 
 
 def get_record(ctx, table, key) -> Optional[dict]:
@@ -197,6 +288,13 @@ def del_record_by_id(ctx, desc, rowid):
         delete_record_raw(ctx.connection, f"{HS_TABLE_PREFIX}{desc.raw_name}", ID_COL, rowid)
     delete_record_raw(ctx.connection, f"{IV_TABLE_PREFIX}{desc.raw_name}", ID_COL, rowid)
     delete_record_raw(ctx.connection, desc.raw_name, ID_COL, rowid)
+    _run_row_hooks("on_delete", ctx, desc, rowid)
+    changelog.on_change(ctx, desc, rowid)
+
+
+def get_key_and_record_by_id(ctx, desc, rowid) -> Tuple[str, dict]:
+    row = decrypt_row(ctx.mixer, get_encrypted_joined_iv_row(ctx, desc, rowid))
+    return row[KEY_COL], row[DATA_COL]
 
 
 def count_records(ctx, table):
@@ -223,31 +321,35 @@ def get_rowid_by_key_hash(ctx, desc, key):
 
 
 def get_rowid_by_seq_decryption(ctx, desc, key):
+    if not all(might_contain(ctx, desc, key) for might_contain in _iterate_row_hooks("might_contain")):
+        return None
     for row in iterate_with_decryption(ctx, desc.name, columns=(ID_COL, KEY_COL)):
         if row[KEY_COL] == key:
             return row[ID_COL]
     return None
 
 
-def iterate_with_decryption(ctx, table, *, columns=(STAR,)) -> Iterable[collections.OrderedDict]:
+def iterate_with_decryption(ctx, table, *, columns=(STAR,), after_id: int = None, limit: int = None) -> Iterable[collections.OrderedDict]:
+    """
+    Rows are ordered by id, after_id continues scan from the last seen row (keyset pagination)
+    """
     table_raw_name = description.get(ctx, table).raw_name
-    # pylint: disable-next=unnecessary-lambda-assignment
-    decrypt_callback = lambda row: decrypt_row(ctx.mixer, row)
-    yield from _iterate_table_joined_iv_raw(ctx, table_raw_name, *columns, callback=decrypt_callback)
-
-
-def _iterate_table_joined_iv_raw(ctx, raw_table_name, *cols, callback=None):
-    query = _build_query_select_joined_iv(raw_table_name, *cols)
-    yield from iterate_query_raw(ctx.connection, query.get_sql(), callback=callback)
+    query = _build_query_select_joined_iv(table_raw_name, *columns, after_id=after_id, limit=limit)
+    yield from pipeline.iterate_query_decrypted(ctx, query.get_sql(), decrypt_row)
 
 
-def _build_query_select_joined_iv(raw_table_name, *cols):
+def _build_query_select_joined_iv(raw_table_name, *cols, after_id=None, limit=None):
     # pylint: disable-next=unbalanced-tuple-unpacking
     raw_table_name, iv_table = pypika.Tables(raw_table_name, f"iv_{raw_table_name}")
     query = pypika.Query.from_(raw_table_name).inner_join(iv_table).on(getattr(raw_table_name, ID_COL) == getattr(iv_table, ID_COL))
     if len(cols) > 1 or cols[0] != STAR:
         cols = (*cols, *(getattr(iv_table, f"iv_{col}") for col in cols if col != ID_COL))
     query = query.select(*cols)
+    if after_id is not None:
+        query = query.where(getattr(raw_table_name, ID_COL) > after_id)
+    query = query.orderby(getattr(raw_table_name, ID_COL))
+    if limit is not None:
+        query = query.limit(limit)
     return query
 
 
@@ -346,5 +448,6 @@ def import_table(ctx, connection_dump, table: str):
         raise StorageError(f"Table not created {table}")
     if count_records(ctx, table) > 0:
         raise StorageError(f"Table is not empty {table}")
-    for row in iterate_table_raw(connection_dump, dump_table_name):
-        insert_record(ctx, table, row[KEY_COL], decode_json(row[DATA_COL]))
+    with _bulk_insert(ctx, description.get(ctx, table)):
+        for row in iterate_table_raw(connection_dump, dump_table_name):
+            insert_record(ctx, table, row[KEY_COL], decode_json(row[DATA_COL]))
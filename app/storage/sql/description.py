@@ -1,5 +1,4 @@
-from functools import lru_cache
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Set
 from dataclasses import dataclass, astuple
 from collections import namedtuple
 
@@ -9,10 +8,14 @@ import pypika
 from utils.encoding import *
 from utils.common import serial_call
 
+from crypto.primitives import Hash512SHA3
 from crypto.tools import encode_add_padding, decode_add_padding
 
 from serialization import serialize, deserialize
 
+from . import manifest
+from . import pipeline
+
 from .share import StorageError
 
 # pylint: disable-next=wildcard-import
@@ -26,6 +29,7 @@ DUMP_TABLE_NAME = "description"
 
 KEY_COL = "key"
 DATA_COL = "data"
+NAME_HASH_COL = "name_hash"
 
 IV_DATA_COL = "iv_data"
 
@@ -53,31 +57,53 @@ class TableNotExist(StorageError):
 
 
 def init_description_table(connection):
-    columns = [pypika.Column("key", "TEXT", nullable=False), pypika.Column("data", "TEXT", nullable=False)]
+    columns = [pypika.Column("key", "TEXT", nullable=False), pypika.Column("data", "TEXT", nullable=False), pypika.Column("name_hash", "TEXT", nullable=False)]
     create_table_raw(connection, DESCRIPTION_TABLE, *columns, primary_key=KEY_COL)
+    create_index_raw(connection, DESCRIPTION_TABLE, NAME_HASH_COL)
     columns = [pypika.Column("key", "TEXT", nullable=False), pypika.Column("iv_data", "TEXT", nullable=False)]
     create_table_raw(connection, IV_DESCRIPTION_TABLE, *columns, primary_key=KEY_COL, foreign_key=ForeignKey("key", "key", DESCRIPTION_TABLE))
 
 
+def upgrade_description_table(ctx):
+    """
+    Databases created before name hash index, add and fill name_hash column
+    """
+    if NAME_HASH_COL in get_table_columns_raw(ctx.connection, DESCRIPTION_TABLE):
+        return
+    if manifest.get_desc_hash_key(ctx.connection, ctx.mixer) is None:
+        manifest.insert_desc_hash_key(ctx.connection, ctx.mixer)
+    execute_sql(ctx.connection, f"ALTER TABLE {DESCRIPTION_TABLE} ADD COLUMN {NAME_HASH_COL} TEXT", close_cursor=True)
+    for desc in list(iterate_with_decryption(ctx)):
+        update_record_raw(ctx.connection, DESCRIPTION_TABLE, KEY_COL, desc.raw_name, {NAME_HASH_COL: calc_name_hash(ctx, desc.name)})
+    create_index_raw(ctx.connection, DESCRIPTION_TABLE, NAME_HASH_COL)
+
+
 def insert(ctx, table_desc: TableDescription):
     iv, crypted_desc = _encrypt_desc(ctx.mixer, table_desc)
-    insert_record_raw(ctx.connection, DESCRIPTION_TABLE, table_desc.raw_name, crypted_desc, columns=(KEY_COL, DATA_COL))
+    name_hash = calc_name_hash(ctx, table_desc.name)
+    insert_record_raw(ctx.connection, DESCRIPTION_TABLE, table_desc.raw_name, crypted_desc, name_hash, columns=(KEY_COL, DATA_COL, NAME_HASH_COL))
     insert_record_raw(ctx.connection, IV_DESCRIPTION_TABLE, table_desc.raw_name, iv, columns=(KEY_COL, IV_DATA_COL))
+    ctx.catalog.add(table_desc)
+    _invalidate_catalog_on_rollback(ctx)
 
 
 def delete(ctx, table_name):
     desc = get(ctx, table_name)
-    get.cache_clear()
     delete_record_raw(ctx.connection, IV_DESCRIPTION_TABLE, KEY_COL, desc.raw_name)
     delete_record_raw(ctx.connection, DESCRIPTION_TABLE, KEY_COL, desc.raw_name)
+    ctx.catalog.remove(desc)
+    _invalidate_catalog_on_rollback(ctx)
 
 
-@lru_cache(maxsize=16) # NOTE: cache clear in description.delete, cmd_con_backend
 def get(ctx, table_name) -> TableDescription:
-    for desc in iterate_with_decryption(ctx):
-        if table_name == desc.name:
-            return desc
-    raise TableNotExist(table_name)
+    desc = ctx.catalog.get(table_name)
+    if desc is None and not ctx.catalog.loaded:
+        desc = _get_by_name_hash(ctx, table_name)
+        if desc is not None:
+            ctx.catalog.add(desc)
+    if desc is None:
+        raise TableNotExist(table_name)
+    return desc
 
 
 def get_unsafe(ctx, table_name) -> Optional[TableDescription]:
@@ -91,11 +117,46 @@ def is_table_exist(ctx, table_name) -> bool:
     return get_unsafe(ctx, table_name) is not None
 
 
+def iterate(ctx) -> Iterable[TableDescription]:
+    yield from _get_catalog(ctx)
+
+
+def get_raw_names(ctx) -> Set[str]:
+    return _get_catalog(ctx).raw_names
+
+
 def iterate_with_decryption(ctx) -> Iterable[TableDescription]:
     sql_text = _build_query_select_joined_iv().get_sql()
-    # pylint: disable-next=unnecessary-lambda-assignment
-    decrypt_callback = lambda row: _decrypt_desc(ctx.mixer, row)
-    yield from iterate_query_raw(ctx.connection, sql_text, callback=decrypt_callback)
+    yield from pipeline.iterate_query_decrypted(ctx, sql_text, _decrypt_desc)
+
+
+def calc_name_hash(ctx, table_name: str) -> str:
+    if ctx.catalog.name_hash_key is None:
+        ctx.catalog.name_hash_key = manifest.get_desc_hash_key(ctx.connection, ctx.mixer)
+    hs_hasher_input = Hash512SHA3().process(ctx.catalog.name_hash_key + encode_utf8(table_name))
+    return encode_base64(ctx.hs_hasher.process(hs_hasher_input))
+
+
+def _get_by_name_hash(ctx, table_name) -> Optional[TableDescription]:
+    table = pypika.Table(DESCRIPTION_TABLE)
+    query = _build_query_select_joined_iv().where(getattr(table, NAME_HASH_COL) == calc_name_hash(ctx, table_name))
+    for row in iterate_query_raw(ctx.connection, query.get_sql()):
+        desc = _decrypt_desc(ctx.mixer, row)
+        if desc.name == table_name:
+            return desc
+    return None
+
+
+def _invalidate_catalog_on_rollback(ctx):
+    # NOTE: catalog is not transactional, reload it if transaction of caller is rolled back
+    if isinstance(ctx.connection, VaultConnection) and ctx.connection.in_transaction:
+        ctx.connection.rollback_hooks[(DESCRIPTION_TABLE, "catalog")] = ctx.catalog.invalidate
+
+
+def _get_catalog(ctx):
+    if not ctx.catalog.loaded:
+        ctx.catalog.load(iterate_with_decryption(ctx))
+    return ctx.catalog
 
 
 def _build_query_select_joined_iv():
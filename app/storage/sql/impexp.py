@@ -8,7 +8,7 @@ from . import raw
 # pylint: disable-next=redefined-builtin
 def export_tables(ctx, dump_path, *tables: str, rewrite=False, all=False):
     if all:
-        tables = tuple(desc.name for desc in description.iterate_with_decryption(ctx))
+        tables = tuple(desc.name for desc in description.iterate(ctx))
     connection_dump = raw.db_create_new(dump_path, rewrite=rewrite, connect=True)
     with contextlib.closing(connection_dump), connection_dump:
         for table in tables:
@@ -0,0 +1,344 @@
+import os
+import json
+import shutil
+import sqlite3
+import datetime
+
+from typing import List, Optional
+from pathlib import Path
+from contextlib import closing
+from dataclasses import dataclass, asdict
+
+from utils.path import remove_file_path
+
+from . import manifest
+from . import changelog
+from . import content
+from . import bloom
+
+from .share import StorageError
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+DELTA_INFO_TABLE = "delta_info"
+DELTA_SCHEMA_TABLE = "delta_schema"
+DELTA_PAGE_SIZE = 1024 # deltas are small, keep per-table page overhead low
+
+SOURCE_SCHEMA = "src"
+DELTA_SCHEMA = "delta"
+
+DEFAULT_FULL_EVERY = 7 # deltas between full backups
+MAX_DELTA_RATIO = 0.5 # larger delta is replaced by full backup
+
+CHAIN_STATE_PREFIX = "chain_"
+RESTORE_SUFFIX = ".restore"
+
+
+@dataclass
+class DeltaInfo:
+    dbid: str
+    from_seq: int
+    to_seq: int
+
+
+@dataclass
+class ChainState:
+    dbid: str
+    chain: str # chain id, time of its full backup
+    base_seq: int # change log seq of full backup
+    seq: int # change log seq of the last uploaded file
+    count: int # uploaded files, full backup included
+
+
+@dataclass
+class ChainFile:
+    path: Path
+    filename: str # name in backup storage
+    chain: str
+    number: int # 0 - full backup
+    seq: int
+    dbid: str
+    temporary: bool = False # delta created for upload, remove it afterwards
+
+
+def is_chain_supported(path) -> bool:
+    with closing(db_connect(path, read_only=True)) as connection:
+        return changelog.is_changelog_enabled(connection) and manifest.get_shard_count(connection) == 0
+
+
+def create_delta(src_path, delta_path, since_seq: int) -> DeltaInfo:
+    """
+    Rows changed after since_seq according to change log of src, src should not change meanwhile (snapshot)
+    Rows are copied as stored, so they stay encrypted. Vault tables are copied by changed rows,
+    bloom filters - of changed tables, other small tables (manifest, descriptions) - whole
+    """
+    with closing(db_connect(src_path, read_only=True)) as src:
+        if not changelog.is_changelog_enabled(src):
+            raise StorageError(f"Database has no change log {src_path}")
+        if manifest.get_shard_count(src) > 0:
+            raise StorageError("Incremental backup of sharded database is not supported")
+        info = DeltaInfo(manifest.get_dbid(src), since_seq, changelog.get_last_seq(src))
+    if info.to_seq < since_seq:
+        raise StorageError("Change log is behind the backup chain")
+    delta = db_create_new(delta_path, rewrite=True, connect=True, settings=SqliteSettings(page_size=DELTA_PAGE_SIZE))
+    with closing(delta):
+        try:
+            delta.execute("PRAGMA foreign_keys = OFF")
+            db_attach(delta, src_path, SOURCE_SCHEMA, read_only=True)
+            with delta, closing(delta.cursor()) as cursor:
+                # NOTE: explicit begin, otherwise DDL statements would be committed one by one
+                cursor.execute("BEGIN EXCLUSIVE")
+                _fill_delta(cursor, info)
+        except sqlite3.Error as e:
+            raise StorageError(f"Cannot create delta {delta_path}", original_exception=e) from e
+    return info
+
+
+def _fill_delta(cursor, info: DeltaInfo):
+    cursor.execute(f"CREATE TABLE {DELTA_INFO_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.executemany(f"INSERT INTO {DELTA_INFO_TABLE} VALUES (?, ?)", [(key, str(value)) for key, value in asdict(info).items()])
+    cursor.execute(f"CREATE TABLE {DELTA_SCHEMA_TABLE} (type TEXT, name TEXT, tbl_name TEXT, sql TEXT, whole INTEGER)")
+    log = changelog.CHANGELOG_TABLE
+    cursor.execute(_get_schema_sql(cursor, log))
+    cursor.execute(f"INSERT INTO main.{log} SELECT * FROM {SOURCE_SCHEMA}.{log} WHERE {changelog.SEQ_COL} > ?", (info.from_seq,))
+    changed, table_events = _get_changed_tables(cursor, "main")
+    rows = cursor.execute(f"SELECT type, name, tbl_name, sql FROM {SOURCE_SCHEMA}.sqlite_master WHERE sql IS NOT NULL").fetchall()
+    for table_type, name, _, sql_text in rows:
+        if table_type != "table" or name == log or name.startswith("sqlite_"):
+            continue
+        raw_name, params = _get_raw_name(name), ()
+        if name == bloom.BLOOM_TABLE:
+            where, whole = f"WHERE {bloom.KEY_COL} IN (SELECT DISTINCT {changelog.TABLE_COL} FROM main.{log})", False
+        elif raw_name is None or raw_name in table_events:
+            where, whole = "", True
+        elif raw_name in changed:
+            where = f"WHERE {content.ID_COL} IN (SELECT {changelog.ROW_COL} FROM main.{log} WHERE {changelog.TABLE_COL} = ?)"
+            whole, params = False, (raw_name,)
+        else:
+            continue
+        cursor.execute(sql_text)
+        cursor.execute(f"INSERT INTO main.{name} SELECT * FROM {SOURCE_SCHEMA}.{name} {where}", params)
+        indexes = [row for row in rows if row[0] == "index" and row[2] == name]
+        for row in [(table_type, name, name, sql_text)] + indexes:
+            cursor.execute(f"INSERT INTO {DELTA_SCHEMA_TABLE} VALUES (?, ?, ?, ?, ?)", (*row, int(whole)))
+
+
+def apply_delta(connection, delta_path) -> DeltaInfo:
+    """
+    Replay delta on database restored up to its from_seq, connection should not be in transaction
+    """
+    if not changelog.is_changelog_enabled(connection):
+        raise StorageError("Database has no change log")
+    try:
+        connection.execute("PRAGMA foreign_keys = OFF")
+        db_attach(connection, delta_path, DELTA_SCHEMA, read_only=True)
+        try:
+            info = _read_delta_info(connection, DELTA_SCHEMA)
+            if info.dbid != manifest.get_dbid(connection):
+                raise StorageError(f"Delta belongs to other database {delta_path}")
+            last_seq = changelog.get_last_seq(connection)
+            if info.from_seq != last_seq:
+                raise StorageError(f"Delta {delta_path} starts at {info.from_seq}, database is at {last_seq}")
+            with connection, closing(connection.cursor()) as cursor:
+                cursor.execute("BEGIN EXCLUSIVE")
+                _replay_delta(cursor)
+        finally:
+            connection.execute(f"DETACH DATABASE {DELTA_SCHEMA}")
+            connection.execute("PRAGMA foreign_keys = ON")
+    except sqlite3.Error as e:
+        raise StorageError(f"Cannot apply delta {delta_path}", original_exception=e) from e
+    return info
+
+
+def _replay_delta(cursor):
+    log = changelog.CHANGELOG_TABLE
+    changed, table_events = _get_changed_tables(cursor, DELTA_SCHEMA)
+    existing = {row[0] for row in cursor.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    # NOTE: created or deleted tables are dropped here and recreated below if delta has them
+    for raw_name in table_events:
+        for name in _get_group_tables(raw_name):
+            if name in existing:
+                cursor.execute(f"DROP TABLE main.{name}")
+                existing.discard(name)
+    for raw_name in changed - table_events:
+        for name in _get_group_tables(raw_name):
+            if name in existing:
+                where = f"SELECT {changelog.ROW_COL} FROM {DELTA_SCHEMA}.{log} WHERE {changelog.TABLE_COL} = ?"
+                cursor.execute(f"DELETE FROM main.{name} WHERE {content.ID_COL} IN ({where})", (raw_name,))
+    if bloom.BLOOM_TABLE in existing:
+        cursor.execute(f"DELETE FROM main.{bloom.BLOOM_TABLE} WHERE {bloom.KEY_COL} IN (SELECT DISTINCT {changelog.TABLE_COL} FROM {DELTA_SCHEMA}.{log})")
+    schema = cursor.execute(f"SELECT type, name, tbl_name, sql, whole FROM {DELTA_SCHEMA}.{DELTA_SCHEMA_TABLE}").fetchall()
+    for table_type, name, _, sql_text, whole in schema:
+        if table_type != "table":
+            continue
+        if name not in existing:
+            cursor.execute(sql_text)
+            for index in (row for row in schema if row[0] == "index" and row[2] == name):
+                cursor.execute(index[3])
+        elif whole:
+            cursor.execute(f"DELETE FROM main.{name}")
+        columns = ", ".join(_add_missing_columns(cursor, name))
+        cursor.execute(f"INSERT INTO main.{name} ({columns}) SELECT {columns} FROM {DELTA_SCHEMA}.{name}")
+    cursor.execute(f"INSERT OR REPLACE INTO main.{log} SELECT * FROM {DELTA_SCHEMA}.{log}")
+
+
+def _add_missing_columns(cursor, name) -> List[str]:
+    """
+    Columns added by upgrade of newer database are added to restored table
+    """
+    delta_columns = cursor.execute(f"PRAGMA {DELTA_SCHEMA}.table_info({name})").fetchall()
+    main_columns = {row[1] for row in cursor.execute(f"PRAGMA main.table_info({name})").fetchall()}
+    for _, column, column_type, *_ in (row for row in delta_columns if row[1] not in main_columns):
+        cursor.execute(f"ALTER TABLE main.{name} ADD COLUMN {column} {column_type}")
+    return [row[1] for row in delta_columns]
+
+
+def is_delta(path) -> bool:
+    with closing(db_connect(path, read_only=True)) as connection:
+        return is_table_exist_raw(connection, DELTA_INFO_TABLE)
+
+
+def read_delta_info(path) -> DeltaInfo:
+    with closing(db_connect(path, read_only=True)) as connection:
+        return _read_delta_info(connection, "main")
+
+
+def _read_delta_info(connection, schema) -> DeltaInfo:
+    values = dict(tuple(row) for row in connection.execute(f"SELECT key, value FROM {schema}.{DELTA_INFO_TABLE}"))
+    return DeltaInfo(values["dbid"], int(values["from_seq"]), int(values["to_seq"]))
+
+
+def _get_changed_tables(cursor, schema):
+    log = changelog.CHANGELOG_TABLE
+    changed = {row[0] for row in cursor.execute(f"SELECT DISTINCT {changelog.TABLE_COL} FROM {schema}.{log}")}
+    table_events = {
+        row[0] for row in cursor.execute(f"SELECT {changelog.TABLE_COL} FROM {schema}.{log} WHERE {changelog.ROW_COL} = ?", (changelog.TABLE_ROW_ID,))
+    }
+    return changed, table_events
+
+
+def _get_schema_sql(cursor, name) -> str:
+    return cursor.execute(f"SELECT sql FROM {SOURCE_SCHEMA}.sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()[0]
+
+
+def _get_raw_name(name) -> Optional[str]:
+    """
+    Vault table which the table belongs to: content table itself, its iv or hash search table
+    """
+    for prefix in (content.IV_TABLE_PREFIX, content.HS_TABLE_PREFIX, ""):
+        if name.startswith(f"{prefix}{content.RAW_TABLE_PREFIX}"):
+            return name[len(prefix):]
+    return None
+
+
+def _get_group_tables(raw_name) -> List[str]:
+    # NOTE: dependent tables first
+    return [f"{content.HS_TABLE_PREFIX}{raw_name}", f"{content.IV_TABLE_PREFIX}{raw_name}", raw_name]
+
+
+# BACKUP CHAIN
+
+
+def prepare_backup(snapshot_path, directory, key: str, *, name: str, full_every=DEFAULT_FULL_EVERY) -> Optional[ChainFile]:
+    """
+    Next file of backup chain for snapshot: delta since the last uploaded file or full backup starting new chain
+    Chain state is kept per database and key (e.g. cloud service) in directory, see commit_backup
+    None - nothing changed since the last uploaded file
+    """
+    snapshot_path = Path(snapshot_path)
+    with closing(db_connect(snapshot_path, read_only=True)) as connection:
+        dbid = manifest.get_dbid(connection)
+        seq = changelog.get_last_seq(connection)
+    state = read_chain_state(get_chain_state_path(directory, dbid, key))
+    if state is not None and state.seq == seq:
+        return None
+    if state is None or state.count > full_every or state.seq > seq:
+        return _make_full(snapshot_path, dbid, seq, name)
+    delta_path = get_chain_state_path(directory, dbid, key).with_suffix(".delta")
+    create_delta(snapshot_path, delta_path, state.seq)
+    if os.stat(delta_path).st_size > MAX_DELTA_RATIO * os.stat(snapshot_path).st_size:
+        remove_file_path(delta_path)
+        return _make_full(snapshot_path, dbid, seq, name)
+    filename = get_chain_filename(dbid, state.chain, state.count, name)
+    return ChainFile(delta_path, filename, state.chain, state.count, seq, dbid, temporary=True)
+
+
+def commit_backup(directory, key: str, chain_file: ChainFile):
+    """
+    Remember uploaded chain file, the next backup continues after it
+    """
+    path = get_chain_state_path(directory, chain_file.dbid, key)
+    state = read_chain_state(path)
+    if chain_file.number == 0:
+        state = ChainState(chain_file.dbid, chain_file.chain, chain_file.seq, chain_file.seq, 0)
+    state.seq = chain_file.seq
+    state.count = chain_file.number + 1
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(temp_path, "w", encoding="utf-8") as fd:
+            json.dump(asdict(state), fd, indent=4)
+        os.replace(temp_path, path)
+    except OSError as e:
+        raise StorageError(f"Cannot save backup chain state {path}", original_exception=e) from e
+
+
+def read_chain_state(path) -> Optional[ChainState]:
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            return ChainState(**json.load(fd))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def get_chain_state_path(directory, dbid: str, key: str) -> Path:
+    return Path(directory, dbid, f"{CHAIN_STATE_PREFIX}{key}.json")
+
+
+def get_chain_base_seq(directory, dbid: str) -> Optional[int]:
+    """
+    Change log entries up to this seq are in every chain's full backup
+    """
+    states = [read_chain_state(path) for path in Path(directory, dbid).glob(f"{CHAIN_STATE_PREFIX}*.json")]
+    seqs = [state.base_seq for state in states if state is not None]
+    return min(seqs) if seqs else None
+
+
+def get_chain_filename(dbid: str, chain: str, number: int, name: str) -> str:
+    return f"{dbid}_{chain}_{number:04d}_{name}"
+
+
+def restore_chain(paths, dst_path) -> int:
+    """
+    Copy full backup to dst_path and replay deltas in order of chain numbers, returns reached seq
+    dst_path is replaced only after the whole chain is applied
+    """
+    paths = sorted((Path(path) for path in paths), key=lambda path: path.name)
+    if not paths:
+        raise StorageError("Backup chain is empty")
+    if is_delta(paths[0]):
+        raise StorageError(f"Backup chain should start with full backup, got delta {paths[0].name}")
+    dst_path = Path(dst_path)
+    temp_path = dst_path.with_name(dst_path.name + RESTORE_SUFFIX)
+    try:
+        shutil.copyfile(paths[0], temp_path)
+        with closing(db_connect(temp_path)) as connection:
+            if not changelog.is_changelog_enabled(connection):
+                raise StorageError(f"Full backup has no change log {paths[0].name}")
+            for path in paths[1:]:
+                apply_delta(connection, path)
+            seq = changelog.get_last_seq(connection)
+        os.replace(temp_path, dst_path)
+    except OSError as e:
+        raise StorageError(f"Cannot restore {dst_path}", original_exception=e) from e
+    finally:
+        if temp_path.exists():
+            remove_file_path(temp_path)
+    return seq
+
+
+def _make_full(snapshot_path, dbid, seq, name) -> ChainFile:
+    current_time_z = datetime.datetime.now(datetime.timezone(datetime.timedelta(0)))
+    chain = current_time_z.strftime("%Y_%m_%d_%H_%M_%S")
+    return ChainFile(snapshot_path, get_chain_filename(dbid, chain, 0, name), chain, 0, seq, dbid)
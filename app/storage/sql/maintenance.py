@@ -0,0 +1,114 @@
+import sqlite3
+
+from typing import List, Optional
+from dataclasses import dataclass
+from collections import namedtuple
+
+from . import content
+from . import description
+from . import bloom
+
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+DEFAULT_VACUUM_STEP_PAGES = 256
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+TableUsage = namedtuple("TableUsage", ["name", "pages", "size"])
+
+
+@dataclass
+class MaintenanceReport:
+    page_size: int
+    page_count: int
+    freelist_count: int
+    auto_vacuum: str
+    tables: Optional[List[TableUsage]] = None # None - dbstat is not available
+
+    @property
+    def free_ratio(self) -> float:
+        return self.freelist_count / self.page_count if self.page_count else 0.0
+
+
+def get_report(ctx) -> MaintenanceReport:
+    report = MaintenanceReport(
+        _get_pragma(ctx.connection, "page_size"),
+        _get_pragma(ctx.connection, "page_count"),
+        _get_pragma(ctx.connection, "freelist_count"),
+        AUTO_VACUUM_MODES.get(_get_pragma(ctx.connection, "auto_vacuum"), "UNKNOWN")
+    )
+    report.tables = _get_tables_usage(ctx)
+    return report
+
+
+def incremental_vacuum(ctx, *, max_pages: int = None, step_pages: int = DEFAULT_VACUUM_STEP_PAGES) -> int:
+    """
+    Release free pages in short steps, every step is a separate write transaction
+    Does nothing if database is not in INCREMENTAL auto_vacuum mode, see convert_to_incremental
+    """
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        free_pages = _get_pragma(ctx.connection, "freelist_count")
+        if free_pages == 0:
+            break
+        step = min(step_pages, free_pages) if max_pages is None else min(step_pages, free_pages, max_pages - freed)
+        execute_sql(ctx.connection, f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+        released = free_pages - _get_pragma(ctx.connection, "freelist_count")
+        if released <= 0:
+            break
+        freed += released
+    return freed
+
+
+def convert_to_incremental(ctx):
+    """
+    auto_vacuum mode of existing database changes only after full VACUUM (rewrites whole file)
+    """
+    execute_sql(ctx.connection, "PRAGMA auto_vacuum = INCREMENTAL", close_cursor=True)
+    execute_sql(ctx.connection, "VACUUM", close_cursor=True)
+
+
+def optimize(ctx):
+    if not is_table_exist_raw(ctx.connection, "sqlite_stat1"):
+        # NOTE: optimize skips tables never queried on this connection, collect initial statistics once
+        execute_sql(ctx.connection, "ANALYZE", close_cursor=True)
+    execute_sql(ctx.connection, "PRAGMA optimize", close_cursor=True)
+
+
+def compact_bloom_filters(ctx):
+    with ctx.connection:
+        for desc in description.iterate(ctx):
+            bloom.compact(ctx, desc)
+
+
+# UTILS
+
+
+def _get_pragma(connection, name):
+    return execute_sql(connection, f"PRAGMA {name}", fetch_one=True)[0]
+
+
+def _get_tables_usage(ctx) -> Optional[List[TableUsage]]:
+    sql_text = \
+        "SELECT COALESCE(m.tbl_name, s.name) AS tbl, COUNT(*) AS pages, SUM(s.pgsize) AS size " \
+        "FROM dbstat AS s LEFT JOIN sqlite_master AS m ON m.name = s.name GROUP BY tbl"
+    try:
+        rows = list(iterate_query_raw(ctx.connection, sql_text))
+    except sqlite3.OperationalError:
+        return None
+    names = {desc.raw_name: desc.name for desc in description.iterate(ctx)}
+    usage = {}
+    for row in rows:
+        name = _get_owner_name(row["tbl"], names)
+        pages, size = usage.get(name, (0, 0))
+        usage[name] = (pages + row["pages"], size + row["size"])
+    return sorted((TableUsage(name, pages, size) for name, (pages, size) in usage.items()), key=lambda u: u.size, reverse=True)
+
+
+def _get_owner_name(table_name, names: dict) -> str:
+    for prefix in (content.IV_TABLE_PREFIX, content.HS_TABLE_PREFIX, ""):
+        if table_name.startswith(prefix) and (name := names.get(table_name[len(prefix):], None)) is not None:
+            return name
+    return f"<{table_name}>"
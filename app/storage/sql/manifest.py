@@ -1,6 +1,6 @@
 import sqlite3
 
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 import pypika
 
@@ -23,6 +23,8 @@ MANIFEST_TABLE = "manifest"
 KEY_COL = "key"
 DATA_COL = "data"
 
+DESC_HASH_KEY_SIZE = 64
+
 
 class KeyCheckError(StorageError):
 
@@ -38,6 +40,8 @@ def init_manifest_table(connection, mixer, key_hasher, hs_hasher):
     _insert_key_hasher(connection, key_hasher)
     _insert_hs_hasher(connection, hs_hasher)
     _insert_key_check(connection, mixer)
+    insert_desc_hash_key(connection, mixer)
+    _insert_table_allocator(connection)
 
 
 def check_key(connection, mixer):
@@ -57,6 +61,52 @@ def get_key_check_data(connection):
     return crypted_check_bytes, iv, check_bytes_hash
 
 
+def get_desc_hash_key(connection, mixer) -> Optional[bytes]:
+    row = get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "desc_hash_key")
+    if row is None:
+        return None
+    iv = decode_base64(get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "iv_desc_hash_key")[DATA_COL])
+    mixer = mixer.opp
+    mixer.iv_set(iv)
+    return serial_call(row[DATA_COL], decode_base64, mixer.process)
+
+
+def insert_desc_hash_key(connection, mixer):
+    desc_hash_key = random_bytes(DESC_HASH_KEY_SIZE)
+    iv = mixer.iv_set_random()
+    crypted_desc_hash_key = mixer.process(desc_hash_key)
+    insert_record_raw(connection, MANIFEST_TABLE, "desc_hash_key", encode_base64(crypted_desc_hash_key))
+    insert_record_raw(connection, MANIFEST_TABLE, "iv_desc_hash_key", encode_base64(iv))
+
+
+def get_table_allocator(connection) -> Optional[Tuple[int, List[int]]]:
+    counter_row = get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "table_counter")
+    if counter_row is None:
+        return None
+    free_list_row = get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "table_free_list")
+    return int(counter_row[DATA_COL]), decode_json(free_list_row[DATA_COL])
+
+
+def set_table_allocator(connection, counter: int, free_list: List[int]):
+    if get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "table_counter") is None:
+        _insert_table_allocator(connection, counter, free_list)
+        return
+    update_record_raw(connection, MANIFEST_TABLE, KEY_COL, "table_counter", {DATA_COL: str(counter)})
+    update_record_raw(connection, MANIFEST_TABLE, KEY_COL, "table_free_list", {DATA_COL: encode_json(free_list)})
+
+
+def get_shard_count(connection) -> int:
+    row = get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "shard_count")
+    return 0 if row is None else int(row[DATA_COL])
+
+
+def set_shard_count(connection, count: int):
+    if get_record_raw(connection, MANIFEST_TABLE, KEY_COL, "shard_count") is None:
+        insert_record_raw(connection, MANIFEST_TABLE, "shard_count", str(count))
+        return
+    update_record_raw(connection, MANIFEST_TABLE, KEY_COL, "shard_count", {DATA_COL: str(count)})
+
+
 def is_db_created_by_app(connection):
     try:
         dbid = get_dbid(connection)
@@ -147,6 +197,11 @@ def _insert_key_check(connection, mixer):
     insert_record_raw(connection, MANIFEST_TABLE, "shake128_key_check", encode_base64(check_bytes_hash))
 
 
+def _insert_table_allocator(connection, counter=0, free_list=()):
+    insert_record_raw(connection, MANIFEST_TABLE, "table_counter", str(counter))
+    insert_record_raw(connection, MANIFEST_TABLE, "table_free_list", encode_json(list(free_list)))
+
+
 def _insert_dbid(connection):
     dbid = random_bytes(3).hex().upper()
     insert_record_raw(connection, MANIFEST_TABLE, "dbid", dbid)
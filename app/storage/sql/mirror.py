@@ -0,0 +1,156 @@
+import time
+import sqlite3
+
+from contextlib import closing
+
+import utils.common
+
+from . import manifest
+from . import search
+from . import raw
+
+from .share import StorageError
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+MODIFYING_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+
+DEFAULT_FLUSH_INTERVAL = 30 # seconds
+DEFAULT_FLUSH_STATEMENTS = 10000
+
+
+class MirrorCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=(), /):
+        super().execute(sql, parameters)
+        self.connection.mirror_statement(sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters, /):
+        seq_of_parameters = list(seq_of_parameters)
+        super().executemany(sql, seq_of_parameters)
+        self.connection.mirror_statement(sql, seq_of_parameters, many=True)
+        return self
+
+
+class MirrorConnection(raw.VaultConnection):
+    """
+    In-memory copy of vault file, reads never touch the disk
+    Modifying statements are repeated on disk connection:
+    at once, disk commits right before memory (write-through)
+    or on flush, all committed statements in one disk transaction (deferred)
+    Both copies start equal and get the same statements, so generated row ids match
+    """
+
+    def __init__(
+        self, *args, disk: sqlite3.Connection, deferred=False, flush_interval=DEFAULT_FLUSH_INTERVAL, flush_statements=DEFAULT_FLUSH_STATEMENTS, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.disk = disk
+        self.deferred = deferred
+        self.flush_interval = flush_interval
+        self.flush_statements = flush_statements
+        self.journal = [] # deferred: (sql, parameters, many) committed in memory, not flushed
+        self.pending = [] # deferred: statements of open memory transaction
+        self.last_flush = time.monotonic()
+
+    # NOTE: not useless, changes default factory so every statement goes through MirrorCursor
+    # pylint: disable-next=useless-parent-delegation
+    def cursor(self, factory=MirrorCursor):
+        return super().cursor(factory)
+
+    def mirror_statement(self, sql, parameters, *, many=False):
+        if not _is_mirrored(sql):
+            return
+        if not self.deferred:
+            with closing(self.disk.cursor()) as cursor:
+                if many:
+                    cursor.executemany(sql, parameters)
+                else:
+                    cursor.execute(sql, parameters)
+            return
+        self.pending.append((sql, parameters, many))
+        if not self.in_transaction:
+            self._on_commit()
+
+    def flush(self):
+        """
+        Repeat journaled statements on disk, no-op in write-through mode
+        """
+        if self.journal:
+            try:
+                with self.disk, closing(self.disk.cursor()) as cursor:
+                    # NOTE: explicit begin, otherwise DDL statements would be committed one by one
+                    cursor.execute("BEGIN EXCLUSIVE")
+                    for sql, parameters, many in self.journal:
+                        if many:
+                            cursor.executemany(sql, parameters)
+                        else:
+                            cursor.execute(sql, parameters)
+            except sqlite3.Error as e:
+                raise StorageError("Cannot flush memory mirror to disk", original_exception=e) from e
+            self.journal.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        try:
+            self.flush()
+            self.disk.close()
+        finally:
+            super().close()
+
+    def _before_commit(self):
+        super()._before_commit()
+        if not self.deferred:
+            self.disk.commit()
+
+    def _on_commit(self):
+        super()._on_commit()
+        if not self.deferred:
+            return
+        self.journal.extend(self.pending)
+        self.pending.clear()
+        if len(self.journal) >= self.flush_statements or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _on_rollback(self):
+        super()._on_rollback()
+        if self.deferred:
+            self.pending.clear()
+        else:
+            self.disk.rollback()
+
+
+def db_connect_mirror(path, *, settings: SqliteSettings = None, deferred=False, flush_interval=None, flush_statements=None) -> MirrorConnection:
+    disk = db_connect(path, settings=settings)
+    with utils.common.CloseOnError(disk):
+        if manifest.get_shard_count(disk) > 0:
+            raise StorageError("Memory mirror of sharded database is not supported")
+        try:
+            # NOTE: extra keyword arguments of connect are passed to factory
+            connection = sqlite3.connect(
+                ":memory:", isolation_level="EXCLUSIVE", cached_statements=128, check_same_thread=True, factory=MirrorConnection,
+                disk=disk, deferred=deferred,
+                flush_interval=DEFAULT_FLUSH_INTERVAL if flush_interval is None else flush_interval,
+                flush_statements=DEFAULT_FLUSH_STATEMENTS if flush_statements is None else flush_statements
+            )
+        except sqlite3.Error as e:
+            raise StorageError(original_exception=e) from e
+    with utils.common.CloseOnError(disk), utils.common.CloseOnError(connection):
+        try:
+            disk.backup(connection)
+            # pylint: disable-next=protected-access
+            raw._connection_setup(connection, settings)
+        except sqlite3.Error as e:
+            raise StorageError(f"Cannot load database into memory {path}", original_exception=e) from e
+    return connection
+
+
+def is_mirror(connection) -> bool:
+    return isinstance(connection, MirrorConnection)
+
+
+def _is_mirrored(sql: str) -> bool:
+    # NOTE: search index lives only in memory, its plaintext must not reach the disk
+    return sql.lstrip()[:8].upper().startswith(MODIFYING_STATEMENTS) and search.SEARCH_SCHEMA not in sql
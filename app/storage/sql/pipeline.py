@@ -0,0 +1,73 @@
+import copy
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, Iterable
+
+from .raw import execute_sql
+from .share import ScanOptions
+
+
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 1024
+
+_executors = {}
+
+
+def iterate_query_decrypted(ctx, sql_text, decrypt: Callable, *, params=()) -> Iterable:
+    """
+    Scan pipeline: reader fetches growing batches on caller thread (sqlite connection is not shared),
+    decryption workers process batches while next one is fetched, results are delivered in order
+    Bounded number of batches in flight gives backpressure to reader
+    """
+    options = ctx.scan
+    with closing(execute_sql(ctx.connection, sql_text, params=params)) as cursor:
+        batches = _iterate_batches(cursor, options)
+        if options.workers <= 0:
+            for batch in batches:
+                yield from _decrypt_batch(ctx.mixer, decrypt, batch, copy_mixer=False)
+            return
+        yield from _iterate_pipelined(ctx.mixer, decrypt, batches, options)
+
+
+def _iterate_pipelined(mixer, decrypt, batches, options: ScanOptions):
+    executor = _get_executor(options.workers)
+    queue_size = options.queue_size if options.queue_size > 0 else options.workers * 2
+    in_flight = collections.deque()
+    try:
+        for batch in batches:
+            in_flight.append(executor.submit(_decrypt_batch, mixer, decrypt, batch))
+            if len(in_flight) >= queue_size:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _iterate_batches(cursor, options: ScanOptions):
+    batch_size = options.batch_size if options.batch_size > 0 else MIN_BATCH_SIZE
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+        if options.batch_size <= 0:
+            batch_size = min(batch_size * 2, MAX_BATCH_SIZE)
+
+
+def _decrypt_batch(mixer, decrypt, batch, *, copy_mixer=True) -> list:
+    # NOTE: mixer keeps iv state, every worker needs its own instance
+    if copy_mixer:
+        mixer = copy.deepcopy(mixer)
+    return [decrypt(mixer, row) for row in batch]
+
+
+def _get_executor(workers) -> ThreadPoolExecutor:
+    executor = _executors.get(workers, None)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+        _executors[workers] = executor
+    return executor
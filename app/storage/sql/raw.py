@@ -1,7 +1,8 @@
+import sys
 import sqlite3
 
 from typing import List, Optional, Union
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, make_dataclass
 from contextlib import closing
 from pathlib import Path
 
@@ -9,6 +10,7 @@ import pypika
 
 import utils.common
 from utils.path import make_not_existing_path, make_existing_file_path, remove_file_path
+from app.config import Performance
 
 from .share import StorageError
 
@@ -20,10 +22,86 @@ class ForeignKey:
     ref_table: str
 
 
+# NOTE: pragmas are declared once by performance config entry, profile is not a pragma
+SqliteSettings = make_dataclass(
+    "SqliteSettings",
+    [(field.name, field.type, None) for field in fields(Performance) if field.name != "profile"],
+    namespace={
+        "__module__": __name__,
+        "__doc__": """
+    Connection pragmas, None - keep sqlite/database default
+    page_size is applied only to new databases
+    """,
+    },
+    frozen=True,
+)
+
+
+class VaultConnection(sqlite3.Connection):
+    """
+    Connection with hooks of open transaction, keyed to be registered once per transaction:
+    commit hooks run right before its commit, rollback hooks - right after its rollback
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commit_hooks = {}
+        self.rollback_hooks = {}
+
+    def commit(self):
+        self._before_commit()
+        super().commit()
+        self._on_commit()
+
+    def rollback(self):
+        super().rollback()
+        self._on_rollback()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            try:
+                self._before_commit()
+            except BaseException:
+                super().__exit__(*sys.exc_info())
+                self._on_rollback()
+                raise
+        result = super().__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None:
+            self._on_commit()
+        else:
+            self._on_rollback()
+        return result
+
+    def _before_commit(self):
+        while self.commit_hooks:
+            hook = self.commit_hooks.pop(next(iter(self.commit_hooks)))
+            hook()
+
+    def _on_commit(self):
+        self.rollback_hooks.clear()
+
+    def _on_rollback(self):
+        self.commit_hooks.clear()
+        hooks = list(self.rollback_hooks.values())
+        self.rollback_hooks.clear()
+        for hook in hooks:
+            hook()
+
+
 STAR = "*"
 
+SQLITE_HEADER = b"SQLite format 3\x00"
 
-def db_create_new(path, *, rewrite=False, connect=False) -> Optional[sqlite3.Connection]:
+# NOTE: WAL needs shared memory, don't use it for databases on network file systems
+PERFORMANCE_PROFILES = {
+    "durable": SqliteSettings(journal_mode="DELETE", synchronous="FULL", cache_size=-8192, temp_store="MEMORY"),
+    "balanced": SqliteSettings(journal_mode="WAL", synchronous="NORMAL", mmap_size=64 * 2 ** 20, cache_size=-8192, temp_store="MEMORY"),
+    "fast": SqliteSettings(journal_mode="MEMORY", synchronous="OFF", mmap_size=256 * 2 ** 20, cache_size=-32768, temp_store="MEMORY"),
+}
+DEFAULT_PERFORMANCE_PROFILE = "durable"
+
+
+def db_create_new(path, *, rewrite=False, connect=False, settings: SqliteSettings = None) -> Optional[sqlite3.Connection]:
     try:
         path = Path(path)
         if rewrite:
@@ -34,9 +112,15 @@ def db_create_new(path, *, rewrite=False, connect=False) -> Optional[sqlite3.Con
         path = make_not_existing_path(path)
         if not path.parent.exists():
             path.parent.mkdir(parents=True)
-        connection = sqlite3.connect(path)
+        connection = sqlite3.connect(path, factory=VaultConnection)
+        with utils.common.CloseOnError(connection):
+            if settings is not None and settings.page_size is not None:
+                connection.execute(f"PRAGMA page_size = {int(settings.page_size)}")
+            # NOTE: auto_vacuum can be changed only before first table is created (or by full VACUUM)
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if connect:
+                _connection_setup(connection, settings)
         if connect:
-            _connection_setup(connection)
             return connection
         connection.close()
     except (FileExistsError, sqlite3.Error) as e:
@@ -44,10 +128,11 @@ def db_create_new(path, *, rewrite=False, connect=False) -> Optional[sqlite3.Con
     return None
 
 
-def db_connect(path) -> sqlite3.Connection:
+def db_connect(path, *, settings: SqliteSettings = None, read_only=False) -> sqlite3.Connection:
     try:
         path = make_existing_file_path(path)
-        connection = sqlite3.connect(path, isolation_level="EXCLUSIVE", cached_statements=128, check_same_thread=True)
+        database = f"{path.resolve().as_uri()}?mode=ro" if read_only else path
+        connection = sqlite3.connect(database, isolation_level="EXCLUSIVE", cached_statements=128, check_same_thread=True, uri=read_only, factory=VaultConnection)
     except (FileNotFoundError, sqlite3.Error) as e:
         raise StorageError(original_exception=e) from e
     try:
@@ -56,24 +141,79 @@ def db_connect(path) -> sqlite3.Connection:
     except sqlite3.Error as e:
         connection.close()
         raise StorageError(f"Database connection test failed {path}", original_exception=e) from e
-    _connection_setup(connection)
+    try:
+        _connection_setup(connection, settings)
+    except sqlite3.Error as e:
+        connection.close()
+        raise StorageError(f"Cannot apply connection settings {path}", original_exception=e) from e
     return connection
 
 
-def _connection_setup(connection):
+def is_sqlite_file(path) -> bool:
+    """
+    Empty file is opened by sqlite as empty database too
+    """
+    with open(path, "rb") as fd:
+        header = fd.read(len(SQLITE_HEADER))
+    return header in (SQLITE_HEADER, b"")
+
+
+def db_attach(connection, path, schema: str, *, settings: SqliteSettings = None, read_only=False):
+    try:
+        path = make_existing_file_path(path)
+        database = f"{path.resolve().as_uri()}?mode=ro" if read_only else str(path)
+        execute_sql(connection, "ATTACH DATABASE ? AS ?", params=(database, schema), close_cursor=True)
+        if settings is not None:
+            with closing(connection.cursor()) as cursor:
+                _apply_schema_settings(cursor, settings, schema)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        raise StorageError(f"Cannot attach database {path}", original_exception=e) from e
+
+
+def _connection_setup(connection, settings: SqliteSettings = None):
     connection.row_factory = sqlite3.Row
     with closing(connection.cursor()) as cursor:
         cursor.execute("PRAGMA foreign_keys = ON")
+        if settings is None:
+            return
+        _apply_schema_settings(cursor, settings, "main")
+        if settings.temp_store is not None:
+            cursor.execute(f"PRAGMA temp_store = {_check_pragma_word(settings.temp_store)}")
+
+
+def _apply_schema_settings(cursor, settings: SqliteSettings, schema: str):
+    if settings.journal_mode is not None:
+        cursor.execute(f"PRAGMA {schema}.journal_mode = {_check_pragma_word(settings.journal_mode)}")
+    if settings.synchronous is not None:
+        cursor.execute(f"PRAGMA {schema}.synchronous = {_check_pragma_word(settings.synchronous)}")
+    if settings.mmap_size is not None:
+        cursor.execute(f"PRAGMA {schema}.mmap_size = {int(settings.mmap_size)}")
+    if settings.cache_size is not None:
+        cursor.execute(f"PRAGMA {schema}.cache_size = {int(settings.cache_size)}")
+
+
+def _check_pragma_word(value: str) -> str:
+    # NOTE: pragma values can't be bound as parameters
+    if not value.isalpha():
+        raise StorageError(f"Invalid pragma value '{value}'")
+    return value
 
 
 def get_changed_rows_count(connection):
     return connection.total_changes
 
 
-def execute_sql(connection, sql_text, *, close_cursor=False, fetch_one=False) -> Union[sqlite3.Cursor, sqlite3.Row, None]:
+def get_content_changes_count(ctx):
+    """
+    Changed rows of vault (main and shard files), writes of in-memory indexes are not counted
+    """
+    return get_changed_rows_count(ctx.connection) - ctx.changes.ignored
+
+
+def execute_sql(connection, sql_text, *, params=(), close_cursor=False, fetch_one=False) -> Union[sqlite3.Cursor, sqlite3.Row, None]:
     cursor = connection.cursor()
     with utils.common.CloseOnError(cursor):
-        cursor.execute(sql_text)
+        cursor.execute(sql_text, params)
     if fetch_one:
         row = cursor.fetchone()
         cursor.close()
@@ -84,8 +224,13 @@ def execute_sql(connection, sql_text, *, close_cursor=False, fetch_one=False) ->
     return cursor
 
 
-def create_table_raw(connection, table_name, *columns: pypika.Column, primary_key: str = None, foreign_key: ForeignKey = None, unique=tuple()):
-    query = pypika.Query.create_table(table_name).columns(*columns)
+def execute_sql_many(connection, sql_text, params_seq):
+    with closing(connection.cursor()) as cursor:
+        cursor.executemany(sql_text, params_seq)
+
+
+def create_table_raw(connection, table_name, *columns: pypika.Column, primary_key: str = None, foreign_key: ForeignKey = None, unique=tuple(), schema: str = None):
+    query = pypika.Query.create_table(pypika.Table(table_name, schema=schema)).columns(*columns)
     if primary_key:
         query = query.primary_key(primary_key)
     if foreign_key:
@@ -100,8 +245,9 @@ def delete_table_raw(connection, table_name):
     execute_sql(connection, query.get_sql(), close_cursor=True)
 
 
-def create_index_raw(connection, table_name, col_name):
-    execute_sql(connection, f"CREATE INDEX index_{table_name}_{col_name} ON {table_name}({col_name})", close_cursor=True)
+def create_index_raw(connection, table_name, col_name, *, schema: str = None):
+    index_name = f"index_{table_name}_{col_name}" if schema is None else f"{schema}.index_{table_name}_{col_name}"
+    execute_sql(connection, f"CREATE INDEX {index_name} ON {table_name}({col_name})", close_cursor=True)
 
 
 def get_record_raw(connection, table, column, value):
@@ -142,8 +288,8 @@ def iterate_table_raw(connection, table, callback=None):
     yield from iterate_query_raw(connection, query.get_sql(), callback=callback)
 
 
-def iterate_query_raw(connection, sql_text, *, callback=None, fetch_count=8):
-    with closing(execute_sql(connection, sql_text)) as cursor:
+def iterate_query_raw(connection, sql_text, *, params=(), callback=None, fetch_count=8):
+    with closing(execute_sql(connection, sql_text, params=params)) as cursor:
         cursor.arraysize = fetch_count
         while True:
             rows = cursor.fetchmany()
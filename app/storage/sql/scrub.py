@@ -0,0 +1,188 @@
+import os
+import concurrent.futures
+
+from typing import Callable, List
+from dataclasses import dataclass, field
+from collections import namedtuple
+
+# pylint: disable-next=wildcard-import
+from utils.encoding import *
+from utils.common import serial_call
+
+from serialization import serialize, deserialize
+
+from . import content
+from . import description
+from . import shard
+
+from .share import ConnectionContext
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+DEFAULT_CHUNK_ROWS = 2048
+
+CHECK_MISSING_IV = "missing_iv"
+CHECK_ORPHAN_IV = "orphan_iv"
+CHECK_KEY = "key_decrypt"
+CHECK_DATA = "data_decrypt"
+CHECK_MISSING_HS = "missing_hs"
+CHECK_HS_MISMATCH = "hs_mismatch"
+
+ScrubIssue = namedtuple("ScrubIssue", ["table", "id", "check", "detail"])
+
+
+@dataclass
+class ScrubReport:
+    tables: int = 0
+    rows: int = 0
+    issues: List[ScrubIssue] = field(default_factory=list)
+
+    def is_ok(self) -> bool:
+        return not self.issues
+
+    def to_dict(self) -> dict:
+        issues = [issue._asdict() for issue in sorted(self.issues, key=lambda i: (i.table, i.id or 0, i.check))]
+        return {"tables": self.tables, "rows": self.rows, "ok": self.is_ok(), "issues": issues}
+
+
+def scrub(ctx, db_path, *, workers: int = None, chunk_rows=DEFAULT_CHUNK_ROWS, progress: Callable[[int, int], None] = None) -> ScrubReport:
+    """
+    Check that every row of every table decrypts and matches its iv/hs rows
+    Rows are checked in id ranges by worker processes, every worker has own read-only connection and mixer,
+    workers <= 1 checks in current process (db_path is not used then)
+    """
+    workers = os.cpu_count() if workers is None else workers
+    report = ScrubReport()
+    tasks, total_rows = _plan_ranges(ctx, report, chunk_rows)
+    if workers <= 1:
+        results = (_scrub_range(ctx, *task) for task in tasks)
+        _collect(report, results, total_rows, progress)
+        return report
+    with _create_worker_pool(ctx, db_path, workers) as executor:
+        futures = [executor.submit(_scrub_range_worker, *task) for task in tasks]
+        try:
+            _collect(report, (future.result() for future in concurrent.futures.as_completed(futures)), total_rows, progress)
+        finally:
+            for future in futures:
+                future.cancel()
+    return report
+
+
+def _plan_ranges(ctx, report, chunk_rows):
+    """
+    (desc, begin id, end id) ranges of rows of every table and their total count, orphan iv rows are reported here
+    """
+    tasks, total_rows = [], 0
+    for desc in description.iterate(ctx):
+        report.tables += 1
+        report.issues.extend(_check_orphan_iv(ctx, desc))
+        row = execute_sql(ctx.connection, f"SELECT MIN(id), MAX(id), COUNT(*) FROM {desc.raw_name}", fetch_one=True)
+        if row[2] == 0:
+            continue
+        total_rows += row[2]
+        tasks.extend((desc, begin, begin + chunk_rows) for begin in range(row[0], row[1] + 1, chunk_rows))
+    return tasks, total_rows
+
+
+# WORKER
+
+
+@dataclass
+class _WorkerState:
+    """
+    Connection context of worker process, set by pool initializer in every worker
+    """
+    ctx: ConnectionContext = None
+
+
+_WORKER_STATE = _WorkerState()
+
+
+def _create_worker_pool(ctx, db_path, workers) -> concurrent.futures.ProcessPoolExecutor:
+    mixer_keys = tuple(elem.key for elem in ctx.mixer.elements)
+    initargs = (str(db_path), serialize(ctx.mixer), mixer_keys, serialize(ctx.hs_hasher))
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+
+
+def _init_worker(db_path, mixer_serialized, mixer_keys, hs_hasher_serialized):
+    mixer = deserialize(mixer_serialized)
+    mixer.set_keys(*mixer_keys)
+    mixer.opposite_instance(set_attribute=True)
+    connection = db_connect(db_path, read_only=True)
+    shards = shard.attach_shards(connection, db_path, read_only=True)
+    _WORKER_STATE.ctx = ConnectionContext(connection, mixer, deserialize(hs_hasher_serialized), shards=shards)
+
+
+def _scrub_range_worker(desc, begin, end):
+    return _scrub_range(_WORKER_STATE.ctx, desc, begin, end)
+
+
+# UTILS
+
+
+def _collect(report, results, total_rows, progress):
+    for rows, issues in results:
+        report.rows += rows
+        report.issues.extend(issues)
+        if progress is not None:
+            progress(report.rows, total_rows)
+
+
+def _scrub_range(ctx, desc, begin, end):
+    hs_select, hs_join = "", ""
+    if desc.hash_search_enabled:
+        hs_select = f", hs.{content.HS_HASH_COL} AS {content.HS_HASH_COL}, hs.id AS hs_id"
+        hs_join = f"LEFT JOIN {content.HS_TABLE_PREFIX}{desc.raw_name} AS hs ON hs.id = t.id"
+    sql_text = \
+        f"SELECT t.id AS id, t.{content.KEY_COL} AS {content.KEY_COL}, t.{content.DATA_COL} AS {content.DATA_COL}, " \
+        f"iv.id AS iv_id, iv.{content.IV_KEY_COL} AS {content.IV_KEY_COL}, iv.{content.IV_DATA_COL} AS {content.IV_DATA_COL}{hs_select} " \
+        f"FROM {desc.raw_name} AS t LEFT JOIN {content.IV_TABLE_PREFIX}{desc.raw_name} AS iv ON iv.id = t.id {hs_join} " \
+        "WHERE t.id >= ? AND t.id < ?"
+    rows, issues = 0, []
+    for row in iterate_query_raw(ctx.connection, sql_text, params=(begin, end)):
+        rows += 1
+        issues.extend(_scrub_row(ctx, desc, row))
+    return rows, issues
+
+
+def _scrub_row(ctx, desc, row):
+    rowid = row["id"]
+    if row["iv_id"] is None:
+        return [ScrubIssue(desc.name, rowid, CHECK_MISSING_IV, None)]
+    issues = []
+    key = None
+    try:
+        key = serial_call(_decrypt(ctx.mixer, row[content.KEY_COL], row[content.IV_KEY_COL]), decode_utf8)
+    except ValueError as e:
+        issues.append(ScrubIssue(desc.name, rowid, CHECK_KEY, str(e)))
+    try:
+        data = serial_call(_decrypt(ctx.mixer, row[content.DATA_COL], row[content.IV_DATA_COL]), decode_utf8, decode_json)
+        if not isinstance(data, dict):
+            raise ValueError("Data is not an object")
+    except ValueError as e:
+        issues.append(ScrubIssue(desc.name, rowid, CHECK_DATA, str(e)))
+    if desc.hash_search_enabled:
+        if row["hs_id"] is None:
+            issues.append(ScrubIssue(desc.name, rowid, CHECK_MISSING_HS, None))
+        elif key is not None and content.calc_key_hash(ctx.hs_hasher, desc, key) != row[content.HS_HASH_COL]:
+            issues.append(ScrubIssue(desc.name, rowid, CHECK_HS_MISMATCH, None))
+    return issues
+
+
+def _decrypt(mixer, encrypted_base64, iv_base64) -> bytes:
+    """
+    content.decrypt_bytes + padding removal with validation, raises ValueError
+    """
+    iv = decode_base64(iv_base64)
+    if len(iv) != mixer.iv_size_total:
+        raise ValueError(f"Invalid iv size {len(iv)}")
+    data = content.decrypt_bytes(mixer, encrypted_base64, iv_base64)
+    if len(data) < 2 or data[0] + data[-1] + 2 > len(data):
+        raise ValueError("Invalid padding")
+    return data[data[0] + 1:len(data) - data[-1] - 1]
+
+
+def _check_orphan_iv(ctx, desc) -> List[ScrubIssue]:
+    sql_text = f"SELECT iv.id AS id FROM {content.IV_TABLE_PREFIX}{desc.raw_name} AS iv LEFT JOIN {desc.raw_name} AS t ON t.id = iv.id WHERE t.id IS NULL"
+    return [ScrubIssue(desc.name, row["id"], CHECK_ORPHAN_IV, None) for row in iterate_query_raw(ctx.connection, sql_text)]
@@ -0,0 +1,200 @@
+import sqlite3
+
+from typing import List
+from collections import namedtuple
+from contextlib import contextmanager
+
+from . import content
+from . import description
+
+from .share import StorageError
+# pylint: disable-next=wildcard-import
+from .raw import *
+
+
+SEARCH_SCHEMA = "search_mem"
+
+INDEX_TABLE = "search_index"
+MAP_TABLE = "search_map"
+
+RAW_NAME_COL = "raw_name"
+TABLE_COL = "table_name"
+ID_COL = "id"
+KEY_COL = "key"
+DATA_COL = "data"
+FTS_ROWID_COL = "fts_rowid"
+
+INSERT_BATCH_SIZE = 512
+
+SNIPPET_TOKENS = 10
+
+SearchResult = namedtuple("SearchResult", ["table", "key", "snippet"])
+
+
+class SearchIndexError(StorageError):
+    pass
+
+
+class SearchIndex:
+    """
+    Full-text index over decrypted records, lives in attached :memory: database
+    Plaintext is never written to the vault file
+    """
+
+    def __init__(self):
+        self.raw_names = set()
+        self.last_fts_rowid = 0
+
+    def is_tracked(self, desc) -> bool:
+        return desc.raw_name in self.raw_names
+
+    def next_fts_rowid(self) -> int:
+        self.last_fts_rowid += 1
+        return self.last_fts_rowid
+
+
+def is_search_enabled(ctx) -> bool:
+    return ctx.search is not None
+
+
+def create_search_index(connection) -> SearchIndex:
+    execute_sql(connection, "PRAGMA temp_store = MEMORY", close_cursor=True)
+    execute_sql(connection, f"ATTACH DATABASE ':memory:' AS {SEARCH_SCHEMA}", close_cursor=True)
+    with connection:
+        execute_sql(connection, _build_create_index_sql(), close_cursor=True)
+        execute_sql(connection, _build_create_map_sql(), close_cursor=True)
+    return SearchIndex()
+
+
+def drop_search_index(ctx):
+    if not is_search_enabled(ctx):
+        return
+    execute_sql(ctx.connection, f"DETACH DATABASE {SEARCH_SCHEMA}", close_cursor=True)
+    ctx.search.raw_names.clear()
+
+
+def index_tables(ctx, *tables: str):
+    for table in tables:
+        desc = description.get(ctx, table)
+        if ctx.search.is_tracked(desc):
+            continue
+        batch = []
+        for row in content.iterate_with_decryption(ctx, table):
+            batch.append((row[content.ID_COL], row[content.KEY_COL], row[content.DATA_COL]))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                _insert_rows(ctx, desc, batch)
+                batch.clear()
+        _insert_rows(ctx, desc, batch)
+        ctx.search.raw_names.add(desc.raw_name)
+
+
+def search(ctx, query: str, *, table: str = None, limit: int = 20) -> List[SearchResult]:
+    if not is_search_enabled(ctx):
+        raise SearchIndexError("Search index not created")
+    params = [query]
+    sql_text = \
+        f"SELECT {TABLE_COL}, {KEY_COL}, snippet({INDEX_TABLE}, -1, '[', ']', '...', {SNIPPET_TOKENS}) AS snip " \
+        f"FROM {SEARCH_SCHEMA}.{INDEX_TABLE} WHERE {INDEX_TABLE} MATCH ?"
+    if table is not None:
+        sql_text += f" AND {RAW_NAME_COL} = ?"
+        params.append(description.get(ctx, table).raw_name)
+    sql_text += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    try:
+        rows = iterate_query_raw(ctx.connection, sql_text, params=params)
+        return [SearchResult(row[TABLE_COL], row[KEY_COL], row["snip"]) for row in rows]
+    except sqlite3.OperationalError as e:
+        raise SearchIndexError("Invalid search query", original_exception=e) from e
+
+
+# CONTENT HOOKS
+
+
+def on_insert(ctx, desc, rowid, key: str, attribs: dict):
+    if not is_search_enabled(ctx) or not ctx.search.is_tracked(desc):
+        return
+    _insert_rows(ctx, desc, [(rowid, key, attribs)])
+
+
+def on_update(ctx, desc, rowid, _key: str, new_key: str, new_data: dict):
+    if not is_search_enabled(ctx) or not ctx.search.is_tracked(desc):
+        return
+    _delete_row(ctx, desc, rowid)
+    _insert_rows(ctx, desc, [(rowid, new_key, new_data)])
+
+
+def on_delete(ctx, desc, rowid):
+    if not is_search_enabled(ctx) or not ctx.search.is_tracked(desc):
+        return
+    _delete_row(ctx, desc, rowid)
+
+
+def on_delete_table(ctx, desc):
+    if not is_search_enabled(ctx) or not ctx.search.is_tracked(desc):
+        return
+    with _ignore_changes(ctx):
+        for table in (INDEX_TABLE, MAP_TABLE):
+            execute_sql(ctx.connection, f"DELETE FROM {SEARCH_SCHEMA}.{table} WHERE {RAW_NAME_COL} = ?", params=(desc.raw_name,), close_cursor=True)
+    ctx.search.raw_names.discard(desc.raw_name)
+
+
+content.register_row_hooks("search", content.RowHooks(on_insert=on_insert, on_update=on_update, on_delete=on_delete, on_delete_table=on_delete_table))
+
+
+# UTILS
+
+
+def _insert_rows(ctx, desc, rows: List[tuple]):
+    if not rows:
+        return
+    index_rows, map_rows = [], []
+    for rowid, key, attribs in rows:
+        fts_rowid = ctx.search.next_fts_rowid()
+        index_rows.append((fts_rowid, desc.raw_name, desc.name, rowid, key, _flatten_attribs(attribs)))
+        map_rows.append((desc.raw_name, rowid, fts_rowid))
+    index_columns = ("rowid", RAW_NAME_COL, TABLE_COL, ID_COL, KEY_COL, DATA_COL)
+    with _ignore_changes(ctx):
+        execute_sql_many(ctx.connection, _build_insert_sql(INDEX_TABLE, index_columns), index_rows)
+        execute_sql_many(ctx.connection, _build_insert_sql(MAP_TABLE, (RAW_NAME_COL, ID_COL, FTS_ROWID_COL)), map_rows)
+
+
+def _delete_row(ctx, desc, rowid):
+    where = f"WHERE {RAW_NAME_COL} = ? AND {ID_COL} = ?"
+    sql_text = f"SELECT {FTS_ROWID_COL} FROM {SEARCH_SCHEMA}.{MAP_TABLE} {where}"
+    row = execute_sql(ctx.connection, sql_text, params=(desc.raw_name, rowid), fetch_one=True)
+    if row is None:
+        return
+    with _ignore_changes(ctx):
+        execute_sql(ctx.connection, f"DELETE FROM {SEARCH_SCHEMA}.{INDEX_TABLE} WHERE rowid = ?", params=(row[FTS_ROWID_COL],), close_cursor=True)
+        execute_sql(ctx.connection, f"DELETE FROM {SEARCH_SCHEMA}.{MAP_TABLE} {where}", params=(desc.raw_name, rowid), close_cursor=True)
+
+
+@contextmanager
+def _ignore_changes(ctx):
+    # NOTE: index writes (and fts5 shadow table writes) count toward total_changes, they should not trigger autoupload
+    before = get_changed_rows_count(ctx.connection)
+    try:
+        yield
+    finally:
+        ctx.changes.ignored += get_changed_rows_count(ctx.connection) - before
+
+
+def _flatten_attribs(attribs: dict) -> str:
+    return "\n".join(f"{name}: {value}" for name, value in attribs.items())
+
+
+def _build_insert_sql(table, columns):
+    return f"INSERT INTO {SEARCH_SCHEMA}.{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+def _build_create_index_sql():
+    return \
+        f"CREATE VIRTUAL TABLE {SEARCH_SCHEMA}.{INDEX_TABLE} USING fts5(" \
+        f"{RAW_NAME_COL} UNINDEXED, {TABLE_COL} UNINDEXED, {ID_COL} UNINDEXED, {KEY_COL}, {DATA_COL})"
+
+
+def _build_create_map_sql():
+    return \
+        f"CREATE TABLE {SEARCH_SCHEMA}.{MAP_TABLE} (" \
+        f"{RAW_NAME_COL} TEXT NOT NULL, {ID_COL} INTEGER NOT NULL, {FTS_ROWID_COL} INTEGER NOT NULL, " \
+        f"PRIMARY KEY ({RAW_NAME_COL}, {ID_COL}))"
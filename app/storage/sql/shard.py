@@ -0,0 +1,55 @@
+from typing import List, Optional
+from pathlib import Path
+
+from . import manifest
+
+from .share import StorageError
+from .raw import db_create_new, db_attach, SqliteSettings
+
+
+SCHEMA_PREFIX = "shard_"
+FILE_INFIX = ".shard"
+
+# NOTE: sqlite attaches at most 10 databases, one is left for search index and one for other tools
+MAX_SHARDS = 8
+
+
+def get_shard_paths(root_path, count: int) -> List[Path]:
+    """
+    Shard files are named after root file, so copies of a vault (snapshots, downloads) keep working after rename
+    """
+    root_path = Path(root_path)
+    return [root_path.with_name(f"{root_path.stem}{FILE_INFIX}{i}{root_path.suffix}") for i in range(count)]
+
+
+def get_schema(ctx, table_number: int) -> Optional[str]:
+    """
+    Whole table with its iv/hs tables lives in one shard, None - main database
+    """
+    if ctx.shards == 0:
+        return None
+    return f"{SCHEMA_PREFIX}{table_number % ctx.shards}"
+
+
+def create_shards(connection, root_path, count: int, *, settings: SqliteSettings = None):
+    if not 0 < count <= MAX_SHARDS:
+        raise StorageError(f"Shards count should be in [1, {MAX_SHARDS}]")
+    if manifest.get_shard_count(connection) > 0:
+        raise StorageError("Database already has shards")
+    for path in get_shard_paths(root_path, count):
+        db_create_new(path, rewrite=True, settings=settings)
+    with connection:
+        manifest.set_shard_count(connection, count)
+
+
+def attach_shards(connection, root_path, *, settings: SqliteSettings = None, read_only=False) -> int:
+    count = manifest.get_shard_count(connection)
+    for i, path in enumerate(get_shard_paths(root_path, count)):
+        if not path.exists():
+            raise StorageError(f"Shard file not found {path}")
+        db_attach(connection, path, f"{SCHEMA_PREFIX}{i}", settings=settings, read_only=read_only)
+    return count
+
+
+def get_existing_shard_paths(connection, root_path) -> List[Path]:
+    return [path for path in get_shard_paths(root_path, manifest.get_shard_count(connection)) if path.exists()]
@@ -1,17 +1,41 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from sqlite3 import Connection
 
 from utils.smrtexcp import SmartException
 
 from crypto.mixer import Mixer, Hasher
 
+from .catalog import DescriptionCatalog
+
 
 class StorageError(SmartException):
     pass
 
 
+@dataclass(frozen=True)
+class ScanOptions:
+    workers: int = 0 # 0 - decrypt on caller thread
+    batch_size: int = 0 # 0 - adaptive
+    queue_size: int = 0 # 0 - two batches per worker
+
+
+@dataclass
+class ChangeCounter:
+    """
+    Changes counted by connection.total_changes that are not vault content, e.g. writes into attached :memory: search index
+    """
+    ignored: int = 0
+
+
 @dataclass(frozen=True)
 class ConnectionContext:
     connection: Connection
     mixer: Mixer
     hs_hasher: Hasher
+    scan: ScanOptions = ScanOptions()
+    shards: int = 0 # attached shard databases, see shard.py
+    changelog: bool = False # row changes are logged for incremental backups, see changelog.py
+    catalog: DescriptionCatalog = field(default_factory=DescriptionCatalog, compare=False)
+    search: object = None # search.SearchIndex, created on demand
+    bloom: dict = field(default_factory=dict, compare=False) # raw_name -> bloom.BloomFilter
+    changes: ChangeCounter = field(default_factory=ChangeCounter, compare=False) # shared by replaced copies of context
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import datetime
+
+from typing import List
+from pathlib import Path
+from contextlib import closing
+
+from utils.path import remove_file_path
+
+from . import manifest
+from . import shard
+
+from .share import StorageError
+from .raw import db_connect, execute_sql
+
+
+DEFAULT_STEP_PAGES = 1024
+DEFAULT_KEEP = 3
+
+SNAPSHOT_SUFFIX = ".db"
+PARTIAL_SUFFIX = ".part"
+
+
+def create_snapshot(src_path, dst_path, *, step_pages=DEFAULT_STEP_PAGES, progress=None) -> Path:
+    """
+    Consistent copy of a database that may be in use
+    Source is read by own read-only connection in steps of step_pages, so locks are held only for one step,
+    backup restarts by itself if source is changed by other connection between steps
+    Shards are attached to the same connection and copied in one read transaction with main database,
+    so snapshot of sharded vault is consistent as a whole, writers wait for the end of it
+    """
+    dst_path = Path(dst_path)
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    with closing(db_connect(src_path, read_only=True)) as src:
+        try:
+            shard_count = manifest.get_shard_count(src)
+        except sqlite3.Error as e:
+            raise StorageError(f"Cannot read manifest of {src_path}", original_exception=e) from e
+        if shard_count == 0:
+            _backup(src, "main", dst_path, step_pages, progress)
+            return dst_path
+        shard.attach_shards(src, src_path, read_only=True)
+        schemas = [f"{shard.SCHEMA_PREFIX}{i}" for i in range(shard_count)]
+        try:
+            execute_sql(src, "BEGIN", close_cursor=True)
+            # NOTE: read lock of attached database is taken on first read from it, take all of them before copying
+            for schema in [*schemas, "main"]:
+                execute_sql(src, f"SELECT COUNT(*) FROM {schema}.sqlite_master", close_cursor=True)
+        except sqlite3.Error as e:
+            raise StorageError(f"Cannot start reading {src_path}", original_exception=e) from e
+        try:
+            for schema, shard_dst in zip(schemas, shard.get_shard_paths(dst_path, shard_count)):
+                _backup(src, schema, shard_dst, step_pages, progress)
+            _backup(src, "main", dst_path, step_pages, progress)
+        finally:
+            src.commit()
+    return dst_path
+
+
+def _backup(src, schema, dst_path, step_pages, progress):
+    partial_path = dst_path.with_name(dst_path.name + PARTIAL_SUFFIX)
+    try:
+        with closing(sqlite3.connect(partial_path)) as dst:
+            src.backup(dst, pages=step_pages, progress=progress, name=schema)
+        os.replace(partial_path, dst_path)
+    except (OSError, sqlite3.Error) as e:
+        _remove_quietly(partial_path)
+        raise StorageError(f"Cannot create snapshot {dst_path}", original_exception=e) from e
+
+
+def gen_snapshot_path(directory, dbid: str) -> Path:
+    current_time_z = datetime.datetime.now(datetime.timezone(datetime.timedelta(0)))
+    return Path(directory, dbid, current_time_z.strftime("%Y_%m_%d_%H_%M_%S_%f") + SNAPSHOT_SUFFIX)
+
+
+def list_snapshots(directory, dbid: str) -> List[Path]:
+    """
+    Oldest first
+    """
+    snapshots_dir = Path(directory, dbid)
+    if not snapshots_dir.is_dir():
+        return []
+    return sorted(path for path in snapshots_dir.glob(f"*{SNAPSHOT_SUFFIX}") if shard.FILE_INFIX not in path.stem)
+
+
+def rotate_snapshots(directory, dbid: str, keep: int = DEFAULT_KEEP) -> List[Path]:
+    snapshots = list_snapshots(directory, dbid)
+    removed = snapshots[:max(0, len(snapshots) - keep)]
+    for path in removed:
+        for shard_path in shard.get_shard_paths(path, shard.MAX_SHARDS):
+            remove_file_path(shard_path)
+        remove_file_path(path)
+    return removed
+
+
+def _remove_quietly(path):
+    try:
+        remove_file_path(path)
+    except OSError:
+        pass
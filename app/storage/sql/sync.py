@@ -0,0 +1,188 @@
+import json
+import math
+import hashlib
+
+from typing import List, Tuple
+from dataclasses import dataclass
+from collections import namedtuple
+
+# pylint: disable-next=wildcard-import
+from utils.encoding import *
+from utils.common import random_bytes
+
+from . import content
+from . import description
+from . import bloom
+
+
+ROWS_PER_BUCKET = 32
+MAX_DEPTH = 16
+DIGEST_SIZE = 16
+SYNC_KEY_SIZE = 32
+
+RowLeaf = namedtuple("RowLeaf", ["rowid", "digest"])
+
+
+class MerkleTree:
+    """
+    Rows are placed into 2 ** depth buckets by keyed key digest, leaf hash covers row digests of bucket sorted by key digest
+    Equal node hashes mean equal subtrees, so only buckets under differing nodes are compared row by row
+    """
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.buckets = [{} for _ in range(2 ** depth)]
+        self.levels = None
+
+    def add(self, rowid, key_digest: bytes, row_digest: bytes):
+        self.buckets[self._bucket_index(key_digest)][key_digest] = RowLeaf(rowid, row_digest)
+
+    def build(self) -> "MerkleTree":
+        level = [_hash_bucket(bucket) for bucket in self.buckets]
+        self.levels = [level]
+        while len(level) > 1:
+            level = [_hash(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+            self.levels.insert(0, level)
+        return self
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[0][0]
+
+    def diff_buckets(self, other: "MerkleTree") -> List[int]:
+        assert self.depth == other.depth
+        nodes = [0] if self.root != other.root else []
+        for level in range(1, self.depth + 1):
+            children = (child for node in nodes for child in (2 * node, 2 * node + 1))
+            nodes = [child for child in children if self.levels[level][child] != other.levels[level][child]]
+        return nodes
+
+    def _bucket_index(self, key_digest: bytes) -> int:
+        if self.depth == 0:
+            return 0
+        return int.from_bytes(key_digest[:8], "big") >> (64 - self.depth)
+
+
+@dataclass
+class TableSyncResult:
+    table: str
+    created: bool = False
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    diff_buckets: int = 0
+    total_buckets: int = 0
+
+    def is_changed(self) -> bool:
+        return self.created or self.inserted > 0 or self.updated > 0 or self.deleted > 0
+
+
+@dataclass
+class _TableSync:
+    src_ctx: object
+    dst_ctx: object
+    src_desc: description.TableDescription
+    dst_desc: description.TableDescription # None for dry run
+    result: TableSyncResult
+    delete: bool
+
+
+def sync_tables(src_ctx, dst_ctx, *tables: str, delete=False, dry_run=False) -> List[TableSyncResult]:
+    """
+    Make dst tables equal to src tables, rows are re-encrypted with dst mixer
+    Rows of dst which are not in src are kept unless delete is set
+    """
+    if not tables:
+        tables = tuple(desc.name for desc in description.iterate(src_ctx))
+    return [sync_table(src_ctx, dst_ctx, table, delete=delete, dry_run=dry_run) for table in tables]
+
+
+def sync_table(src_ctx, dst_ctx, table: str, *, delete=False, dry_run=False) -> TableSyncResult:
+    """
+    Digests of decrypted rows are keyed with random key of this sync and live only in memory, vaults keep no digests
+    """
+    src_desc = description.get(src_ctx, table)
+    result = TableSyncResult(table)
+    dst_exists = description.is_table_exist(dst_ctx, table)
+    rows = max(content.count_records(src_ctx, table), content.count_records(dst_ctx, table) if dst_exists else 0)
+    depth = calc_depth(rows)
+    sync_key = random_bytes(SYNC_KEY_SIZE)
+    src_tree = build_tree(src_ctx, table, depth, sync_key)
+    dst_tree = build_tree(dst_ctx, table, depth, sync_key) if dst_exists else MerkleTree(depth).build()
+    diff = src_tree.diff_buckets(dst_tree)
+    result.diff_buckets, result.total_buckets = len(diff), len(src_tree.buckets)
+    if not dst_exists:
+        result.created = True
+        if not dry_run:
+            content.create_table(dst_ctx, table, enable_hash_search=src_desc.hash_search_enabled)
+    if dry_run:
+        _apply_diff(_TableSync(src_ctx, dst_ctx, src_desc, None, result, delete), src_tree, dst_tree, diff)
+        return result
+    dst_desc = description.get(dst_ctx, table)
+    with bloom.deferred_store(dst_ctx, dst_desc):
+        _apply_diff(_TableSync(src_ctx, dst_ctx, src_desc, dst_desc, result, delete), src_tree, dst_tree, diff)
+    return result
+
+
+def build_tree(ctx, table: str, depth: int, sync_key: bytes) -> MerkleTree:
+    tree = MerkleTree(depth)
+    for row in content.iterate_with_decryption(ctx, table):
+        tree.add(row[content.ID_COL], *calc_row_digests(row[content.KEY_COL], row[content.DATA_COL], sync_key))
+    return tree.build()
+
+
+def calc_depth(rows: int) -> int:
+    if rows <= ROWS_PER_BUCKET:
+        return 0
+    return min(MAX_DEPTH, math.ceil(math.log2(rows / ROWS_PER_BUCKET)))
+
+
+def calc_row_digests(key: str, attribs: dict, sync_key: bytes) -> Tuple[bytes, bytes]:
+    """
+    Keyed digests of key and of whole row
+    """
+    key_digest = hashlib.blake2b(encode_utf8(key), key=sync_key, digest_size=DIGEST_SIZE, person=b"key").digest()
+    row_data = encode_utf8(json.dumps([key, attribs], sort_keys=True, ensure_ascii=False))
+    row_digest = hashlib.blake2b(row_data, key=sync_key, digest_size=DIGEST_SIZE, person=b"row").digest()
+    return key_digest, row_digest
+
+
+# UTILS
+
+
+def _apply_diff(job: _TableSync, src_tree: MerkleTree, dst_tree: MerkleTree, diff: List[int]):
+    for index in diff:
+        src_bucket, dst_bucket = src_tree.buckets[index], dst_tree.buckets[index]
+        for key_digest, leaf in src_bucket.items():
+            dst_leaf = dst_bucket.get(key_digest, None)
+            if dst_leaf is not None and dst_leaf.digest == leaf.digest:
+                continue
+            if dst_leaf is None:
+                job.result.inserted += 1
+                if job.dst_desc is not None:
+                    key, attribs = content.get_key_and_record_by_id(job.src_ctx, job.src_desc, leaf.rowid)
+                    content.insert_record(job.dst_ctx, job.dst_desc.name, key, attribs)
+            else:
+                job.result.updated += 1
+                if job.dst_desc is not None:
+                    key, attribs = content.get_key_and_record_by_id(job.src_ctx, job.src_desc, leaf.rowid)
+                    content.update_record_by_id(job.dst_ctx, job.dst_desc, dst_leaf.rowid, key, key, attribs)
+        if not job.delete:
+            continue
+        for key_digest, dst_leaf in dst_bucket.items():
+            if key_digest in src_bucket:
+                continue
+            job.result.deleted += 1
+            if job.dst_desc is not None:
+                content.del_record_by_id(job.dst_ctx, job.dst_desc, dst_leaf.rowid)
+
+
+def _hash_bucket(bucket: dict) -> bytes:
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for key in sorted(bucket):
+        hasher.update(bucket[key].digest)
+    return hasher.digest()
+
+
+def _hash(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
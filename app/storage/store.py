@@ -0,0 +1,163 @@
+import contextlib
+
+from typing import Iterable, Optional, Tuple
+
+from utils.abstract import ABC, abstractmethod
+
+from app.storage import sql
+# pylint: disable=unused-import
+import app.storage.sql.content
+import app.storage.sql.description
+# pylint: enable=unused-import
+
+
+class RecordStore(ABC):
+    """
+    Table and record operations of storage engine, keys and values are plaintext at this level
+    Every write outside of transaction() is committed on its own
+    """
+
+    def __init__(self):
+        self._depth = 0
+
+    @abstractmethod
+    def create_table(self, table: str, *, hash_search=False):
+        pass
+
+    @abstractmethod
+    def delete_table(self, table: str):
+        pass
+
+    @abstractmethod
+    def is_table_exist(self, table: str) -> bool:
+        pass
+
+    @abstractmethod
+    def iterate_tables(self) -> Iterable[str]:
+        pass
+
+    @abstractmethod
+    def insert(self, table: str, key: str, attribs: dict):
+        pass
+
+    @abstractmethod
+    def update(self, table: str, key: str, attribs: dict, *, new_key=None, replace=False):
+        pass
+
+    @abstractmethod
+    def get(self, table: str, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def delete(self, table: str, key: str):
+        pass
+
+    @abstractmethod
+    def count(self, table: str) -> int:
+        pass
+
+    @abstractmethod
+    def iterate(self, table: str) -> Iterable[Tuple[str, dict]]:
+        pass
+
+    @abstractmethod
+    def iterate_keys(self, table: str) -> Iterable[str]:
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group writes into one commit, nested transactions join the outer one
+        """
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._rollback()
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._commit()
+
+    @abstractmethod
+    def _commit(self):
+        pass
+
+    @abstractmethod
+    def _rollback(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SqlRecordStore(RecordStore):
+    """
+    RecordStore over sqlite vault, thin layer on sql.content and sql.description
+    """
+
+    def __init__(self, ctx: sql.share.ConnectionContext, *, tables_limit=sql.content.DEFAULT_TABLES_LIMIT):
+        super().__init__()
+        self.ctx = ctx
+        self.tables_limit = tables_limit
+
+    def create_table(self, table, *, hash_search=False):
+        with self.transaction():
+            sql.content.create_table(self.ctx, table, enable_hash_search=hash_search, tables_limit=self.tables_limit)
+
+    def delete_table(self, table):
+        with self.transaction():
+            sql.content.delete_table(self.ctx, table)
+
+    def is_table_exist(self, table):
+        return sql.description.is_table_exist(self.ctx, table)
+
+    def iterate_tables(self):
+        return sorted(desc.name for desc in sql.description.iterate(self.ctx))
+
+    def insert(self, table, key, attribs):
+        with self.transaction():
+            sql.content.insert_record(self.ctx, table, key, attribs)
+
+    def update(self, table, key, attribs, *, new_key=None, replace=False):
+        with self.transaction():
+            sql.content.update_record(self.ctx, table, key, attribs, new_key=new_key, replace=replace)
+
+    def get(self, table, key):
+        return sql.content.get_record(self.ctx, table, key)
+
+    def delete(self, table, key):
+        with self.transaction():
+            sql.content.del_record(self.ctx, table, key)
+
+    def count(self, table):
+        return sql.content.count_records(self.ctx, table)
+
+    def iterate(self, table):
+        for row in sql.content.iterate_with_decryption(self.ctx, table, columns=(sql.content.KEY_COL, sql.content.DATA_COL)):
+            yield row[sql.content.KEY_COL], row[sql.content.DATA_COL]
+
+    def iterate_keys(self, table):
+        for row in sql.content.iterate_with_decryption(self.ctx, table, columns=(sql.content.KEY_COL,)):
+            yield row[sql.content.KEY_COL]
+
+    def close(self):
+        self.ctx.connection.close()
+
+    def _commit(self):
+        self.ctx.connection.commit()
+
+    def _rollback(self):
+        self.ctx.connection.rollback()
+        # NOTE: caches are not transactional, reload them after rollback
+        self.ctx.catalog.invalidate()
+        self.ctx.bloom.clear()
@@ -1,16 +1,24 @@
 import os
+import glob
+import json
 import random
+import itertools
 import string
 import sys
+import time
 import secrets
+import tempfile
+import threading
+import dataclasses
 
-from typing import Optional
-from collections import OrderedDict
+from typing import Iterator, Optional
+from collections import OrderedDict, namedtuple
 from functools import wraps
 from pathlib import Path
 from dataclasses import dataclass, field
 from contextlib import closing
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import prompt_toolkit as ptk
 
@@ -28,9 +36,18 @@ from app import config
 
 from app.ui.console.app_meta import AppStateMeta
 
+from app.cloud import chunkstore
 from app.cloud import cloud
+from app.cloud import compress as cloud_compress
+from app.cloud import share as cloud_share
+from app.cloud import upload_queue
+from app.cloud import upload_state as cloud_upload_state
 from app.cloud.share import CloudError
 
+from app.storage.store import RecordStore, SqlRecordStore
+from app.storage.log import store as log_store
+from app.storage.log import manifest as log_manifest
+
 # pylint: disable=unused-import
 from app.storage import sql
 import app.storage.sql.content
@@ -39,9 +56,22 @@ import app.storage.sql.description
 import app.storage.sql.share
 import app.storage.sql.impexp
 import app.storage.sql.raw
+import app.storage.sql.search
+import app.storage.sql.maintenance
+import app.storage.sql.snapshot
+import app.storage.sql.scrub
+import app.storage.sql.sync
+import app.storage.sql.shard
+import app.storage.sql.mirror
+import app.storage.sql.changelog
+import app.storage.sql.increment
 # pylint: enable=unused-import
 
 
+SNAPSHOTS_DIRNAME = ".snapshots"
+UPLOAD_QUEUE_FILENAME = "upload_queue.json"
+
+
 class Section(Enum):
     DATABASE = "Database"
     TABLE = "Table"
@@ -63,6 +93,7 @@ class HelpInfo:
 @dataclass
 class CmdInfo:
     con_required: bool = None
+    sql_required: bool = None
     helpinfo: HelpInfo = field(default_factory=HelpInfo)
 
 
@@ -92,8 +123,8 @@ class Help:
 # pylint: disable-next=too-few-public-methods
 class Command:
 
-    def __init__(self, con_required=False):
-        self.cmdinfo = CmdInfo(con_required)
+    def __init__(self, con_required=False, sql_required=False):
+        self.cmdinfo = CmdInfo(con_required, sql_required)
 
     def __call__(self, cmd_callable):
 
@@ -102,6 +133,8 @@ class Command:
             con_required = wrapper.cmdinfo.con_required
             if con_required and not app_state.con_info.is_connected():
                 raise AppError("Command requires connection")
+            if wrapper.cmdinfo.sql_required and app_state.con_info.is_connected() and app_state.con_info.ctx is None:
+                raise AppError("Command is not supported by log storage engine")
             return cmd_callable(app_state, *args, **kwargs)
 
         wrapper.cmdinfo = self.cmdinfo
@@ -117,12 +150,21 @@ class AppError(SmartException):
 
 @dataclass(frozen=True)
 class ConnectionInfo:
+    """
+    Record and table commands go through store, ctx is set only for sqlite engine
+    """
     ctx: sql.share.ConnectionContext = None
     connection_path: Path = None
     connection_abs_path: Path = None
+    store: RecordStore = None
 
     def is_connected(self):
-        return self.ctx is not None
+        return self.store is not None
+
+
+KeyListItem = namedtuple("KeyListItem", ["key", "cursor"])
+
+CloudUploadResult = namedtuple("CloudUploadResult", ["path", "service", "error", "seconds", "skipped"], defaults=[False])
 
 
 # pylint: disable-next=too-many-public-methods
@@ -131,21 +173,30 @@ class AppState(metaclass=AppStateMeta):
     def __init__(self):
         self.con_info = ConnectionInfo()
         self.cloud = {}
+        self.cloud_lock = threading.Lock()
+        upload_delay = config.curconfig.get_entry("cloud.upload_delay")
+        self.upload_queue = upload_queue.UploadQueue(
+            self._upload_queued,
+            Path(get_snapshots_directory(), UPLOAD_QUEUE_FILENAME),
+            delay=upload_queue.DEFAULT_DELAY if upload_delay is None else upload_delay,
+            notify=_print_queued_upload_result
+        )
 
     def __del__(self):
         if self.con_info.is_connected():
-            self.con_info.ctx.connection.close()
+            self.con_info.store.close()
 
     @Arg("rewrite", "Remove exsiting file")
     @Arg("connect", "Connect after creation")
+    @Arg("shards", f"Spread tables over this count of shard files, max {sql.shard.MAX_SHARDS}, 0 - single file")
     @Help(Section.DATABASE, "Create new database")
     @Command()
-    def cmd_newdb(self, path, *, rewrite=False, connect=False):
+    def cmd_newdb(self, path, *, rewrite=False, connect=False, shards=0):
         path = get_database_absolute_path(path)
         if not rewrite and path.exists():
             raise AppError("Database file already exist, use --rewrite")
         password = _prompt_hidden_input(f"New DB password ({path.name})")
-        self.cmd_newdb_backend(path, rewrite=rewrite, connect=connect, password=password)
+        self.cmd_newdb_backend(path, rewrite=rewrite, connect=connect, password=password, shards=shards)
 
     @Help(Section.DATABASE, "Delete database")
     @Command()
@@ -159,13 +210,15 @@ class AppState(metaclass=AppStateMeta):
             return
         self.cmd_deldb_backend(path)
 
+    @Arg("mirror", "Load database into memory, every commit is written through to file")
+    @Arg("deferred", "Load database into memory, write changes to file periodically and on disconnect")
     @Help(Section.DATABASE, "Connect database")
     @Command()
-    def cmd_con(self, path):
+    def cmd_con(self, path, *, mirror=False, deferred=False):
         if not get_database_absolute_path(path).exists():
             raise AppError("Database file not exist")
         password = _prompt_hidden_input("Password")
-        self.cmd_con_backend(path, password=password)
+        self.cmd_con_backend(path, password=password, mirror=mirror, deferred=deferred)
 
     @Help(Section.DATABASE, "Disconnect database")
     @Command()
@@ -174,7 +227,8 @@ class AppState(metaclass=AppStateMeta):
         if not con_info.is_connected():
             print("Not connected")
             return
-        changed_rows = sql.raw.get_changed_rows_count(con_info.ctx.connection)
+        # NOTE: log storage engine vaults are not uploaded, cloud backups are built from sqlite manifest
+        changed_rows = 0 if con_info.ctx is None else sql.raw.get_content_changes_count(con_info.ctx)
         self.cmd_discon_backend()
         print("Disconnected")
         cfg = config.curconfig
@@ -183,6 +237,65 @@ class AppState(metaclass=AppStateMeta):
         if cfg.cloud.enabled and cfg.cloud.autoupload and changed_rows > 0:
             _disconnect_task_upload(self, con_info.connection_path)
 
+    @Arg("report", "Only print fragmentation report")
+    @Arg("pages", "Max free pages to release, 0 - all")
+    @Arg("convert", "Switch old database to incremental vacuum (rewrites whole file)")
+    @Help(Section.DATABASE, "Release free pages, update planner statistics, print fragmentation report")
+    @Command(con_required=True, sql_required=True)
+    def cmd_maintain(self, *, report=False, pages=0, convert=False):
+        before, after = self.cmd_maintain_backend(report=report, pages=pages, convert=convert)
+        _print_maintenance_report(before)
+        if after is not None:
+            print(f"Released {before.page_count - after.page_count} pages, free: {after.freelist_count} ({after.free_ratio:.1%})")
+
+    @Arg("path", "Database path, default - connected database")
+    @Help(Section.DATABASE, "Create local snapshot of database (safe for connected database)")
+    @Command()
+    def cmd_snapshot(self, *, path=None):
+        snapshot_path = self.cmd_snapshot_backend(path=path)
+        print("Snapshot created:", snapshot_path)
+
+    @Arg("files", "Full backup and its deltas or one manifest of deduplicated upload, wildcards are expanded")
+    @Arg("rewrite", "Replace existing database")
+    @Help(Section.DATABASE, "Rebuild database from incremental or deduplicated cloud upload")
+    @Command()
+    def cmd_restore(self, path, *files, rewrite=False):
+        seq = self.cmd_restore_backend(path, *files, rewrite=rewrite)
+        print("Database restored" if seq is None else f"Database restored up to change {seq}")
+
+    @Arg("workers", "Worker processes count, 0 - cpu count, 1 - check in this process")
+    @Arg("report", "Write JSON report to this file")
+    @Help(Section.DATABASE, "Check that every record decrypts and matches its iv/hash rows")
+    @Command(con_required=True, sql_required=True)
+    def cmd_scrub(self, *, workers=0, report=None):
+
+        def progress(done, total):
+            print(f"\rChecked {done}/{total} rows", end="", flush=True)
+
+        result = self.cmd_scrub_backend(workers=workers, report=report, progress=progress)
+        print()
+        print(f"Tables: {result.tables}, rows: {result.rows}, issues: {len(result.issues)}")
+        for issue in result.issues:
+            print(f"{issue.table}: id {issue.id}: {issue.check}" + (f" ({issue.detail})" if issue.detail else ""))
+
+    @Arg("path", "Other database")
+    @Arg("tables", "Tables to sync, default - all tables of source")
+    @Arg("pull", "Copy changes from other database to connected (default - from connected to other)")
+    @Arg("delete", "Delete target rows missing in source")
+    @Arg("dry_run", "Only print what would be changed")
+    @Help(Section.DATABASE, "Sync rows with other database, only changed rows are transferred")
+    @Command(con_required=True, sql_required=True)
+    def cmd_sync(self, path, *tables, pull=False, delete=False, dry_run=False):
+        abs_path = get_database_absolute_path(path, check_exist=True)
+        password = _prompt_hidden_input(f"Password ({abs_path.name})")
+        results = self.cmd_sync_backend(abs_path, *tables, password=password, pull=pull, delete=delete, dry_run=dry_run)
+        for result in results:
+            created = " (created)" if result.created else ""
+            print(
+                f"{result.table}{created}: inserted {result.inserted}, updated {result.updated}, deleted {result.deleted}, "
+                f"buckets differ {result.diff_buckets}/{result.total_buckets}"
+            )
+
     @Help(Section.DATABASE, "Check current connection")
     @Command()
     def cmd_coninfo(self):
@@ -236,17 +349,44 @@ class AppState(metaclass=AppStateMeta):
         result = self.cmd_count_backend(table)
         print(result)
 
+    @Arg("limit", "Max keys count, 0 - no limit")
+    @Arg("after", "Continue from cursor printed by previous call")
     @Help(Section.DATA, "Get all table keys")
     @Command(con_required=True)
-    def cmd_keys(self, table):
-        for k in self.cmd_keys_backend(table):
-            print(k)
+    def cmd_keys(self, table, *, limit=0, after=None):
+        _print_key_list(self.cmd_keys_backend(table, limit=limit, after=after), limit)
 
+    @Arg("limit", "Max keys count, 0 - no limit")
+    @Arg("after", "Continue from cursor printed by previous call")
     @Help(Section.DATA, "Find key by substring")
     @Command(con_required=True)
-    def cmd_find(self, table, key_substr):
-        for k in self.cmd_find_backend(table, key_substr):
-            print(k)
+    def cmd_find(self, table, key_substr, *, limit=0, after=None):
+        _print_key_list(self.cmd_find_backend(table, key_substr, limit=limit, after=after), limit)
+
+    @Arg("tables", "List of tables for indexing")
+    @Arg("all", "Index all tables")
+    @Help(Section.DATA, "Build in-memory full-text index for search")
+    @Command(con_required=True, sql_required=True)
+    def cmd_searchidx(self, *tables, all=False): # pylint: disable=redefined-builtin
+        self.cmd_searchidx_backend(*tables, all=all)
+
+    @Help(Section.DATA, "Drop in-memory full-text index")
+    @Command(con_required=True, sql_required=True)
+    def cmd_delsearchidx(self):
+        self.cmd_delsearchidx_backend()
+
+    @Arg("query", "Full-text query, e.g. \"mail OR login\"")
+    @Arg("table", "Search only in this table")
+    @Arg("limit", "Max results count, default=20")
+    @Help(Section.DATA, "Full-text search over indexed tables")
+    @Command(con_required=True, sql_required=True)
+    def cmd_search(self, query, *, table=None, limit=20):
+        results = self.cmd_search_backend(query, table=table, limit=limit)
+        if not results:
+            print("Nothing found")
+        for result in results:
+            snippet = result.snippet.replace("\n", " ")
+            print(f"{result.table}: {result.key}: {snippet}")
 
     @Arg("hash_search", "Enable key search by hash")
     @Help(Section.TABLE, "Create new table")
@@ -263,34 +403,84 @@ class AppState(metaclass=AppStateMeta):
     @Command(con_required=True)
     def cmd_tables(self):
         for desc in self.cmd_tables_backend():
-            print(desc.name)
+            print(desc)
 
     @Help(Section.TABLE, "Get some data about table")
-    @Command(con_required=True)
+    @Command(con_required=True, sql_required=True)
     def cmd_desctable(self, table):
         desc = self.cmd_desctable_backend(table)
         print("name:", desc.name)
         print("rawname:", desc.raw_name)
         print("hs:", desc.hash_search_enabled)
 
+    @Arg("paths", "Databases to upload, default - connected database")
     @Arg("service", "Cloud service name e.g. 'dropbox'")
-    @Help(Section.CLOUD, "Upload database to cloud")
+    @Arg("all_services", "Upload to every configured cloud service")
+    @Arg("all_dbs", "Upload every database from config's db_directory")
+    @Arg("workers", f"Concurrent uploads, 0 - one per destination (max {cloud_share.SESSION_POOL_SIZE})")
+    @Help(Section.CLOUD, "Upload databases to cloud")
     @Command()
-    def cmd_cloudup(self, path, *, service=None):
-        self.cmd_cloudup_backend(path, service=service)
+    def cmd_cloudup(self, *paths, service=None, all_services=False, all_dbs=False, workers=0):
+
+        def progress(result, done, total):
+            if result.error is not None:
+                status = f"failed: {result.error}"
+            else:
+                status = "unchanged, skipped" if result.skipped else "uploaded"
+            print(f"[{done}/{total}] {result.path.name} -> {result.service}: {status} ({result.seconds:.1f} s)")
+
+        results = self.cmd_cloudup_backend(
+            *paths, service=service, all_services=all_services, all_dbs=all_dbs, workers=workers, progress=progress
+        )
+        failed = sum(1 for result in results if result.error is not None)
+        if failed:
+            raise AppError(f"{failed} of {len(results)} uploads failed")
+
+    @Arg("dbid", "Only backups whose id (dbid_time) starts with it")
+    @Arg("service", "Cloud service name, default - service from config")
+    @Help(Section.CLOUD, "List backups uploaded to cloud")
+    @Command()
+    def cmd_cloudls(self, *, dbid=None, service=None):
+        for backup in self.cmd_cloudls_backend(dbid=dbid, service=service):
+            print(f"{backup.id}  {backup.name}  {backup.kind}, {len(backup.files)} files, {backup.size / 2 ** 20:.2f} MiB")
+
+    @Arg("prefix", "dbid or backup id prefix, the latest matching backup is restored")
+    @Arg("path", "Restored database path, default - database name of backup")
+    @Arg("service", "Cloud service name, default - service from config")
+    @Arg("workers", f"Parallel range requests per file, 0 - {cloud_share.DOWNLOAD_WORKERS}")
+    @Arg("rewrite", "Replace existing database")
+    @Help(Section.CLOUD, "Download backup from cloud, verify it and put database into db_directory")
+    @Command()
+    def cmd_cloudrestore(self, prefix, *, path=None, service=None, workers=0, rewrite=False):
+        backup, restored_path = self.cmd_cloudrestore_backend(prefix, path=path, service=service, workers=workers, rewrite=rewrite)
+        print(f"Backup {backup.id} ({backup.kind}) restored to {restored_path}")
+
+    @Arg("path", "Database, default - connected database")
+    @Arg("service", "Only uploads to this service")
+    @Arg("limit", "Last uploads shown per service, 0 - all kept")
+    @Help(Section.CLOUD, "Show successful uploads of database with sent size and throughput")
+    @Command()
+    def cmd_cloudhist(self, *, path=None, service=None, limit=10):
+        for key, state in self.cmd_cloudhist_backend(path=path, service=service, limit=limit):
+            print(f"{key} ({state.destination}):")
+            for record in state.history:
+                print(
+                    f"  {record.time}  size {record.size / 2 ** 20:.2f} MiB, sent {record.uploaded / 2 ** 20:.2f} MiB "
+                    f"in {record.seconds:.1f} s ({record.throughput / 2 ** 20:.2f} MiB/s)"
+                )
 
     @Arg("tables", "List of tables for export")
     @Arg("rewrite", "Rewrite dump file")
     @Arg("all", "Export all tables")
     @Help(Section.IMEXP, "Create decrypted dump")
-    @Command(con_required=True)
+    @Command(con_required=True, sql_required=True)
     def cmd_export(self, path, *tables, rewrite=False, all=False): # pylint: disable=redefined-builtin
         self.cmd_export_backend(path, *tables, rewrite=rewrite, all=all)
 
     @Arg("tables", "List of tables for import")
     @Arg("all", "Import all tables")
     @Help(Section.IMEXP, "Import from decrypted dump")
-    @Command(con_required=True)
+    @Command(con_required=True, sql_required=True)
     def cmd_import(self, path, *tables, all=False): # pylint: disable=redefined-builtin
         self.cmd_import_backend(path, *tables, all=all)
 
@@ -329,7 +519,9 @@ class AppState(metaclass=AppStateMeta):
     @Command()
     def cmd_lsdb(self):
         db_directory = config.curconfig.db_directory
-        for root, _, files in os.walk(db_directory):
+        snapshots_directory = get_snapshots_directory()
+        for root, dirs, files in os.walk(db_directory):
+            dirs[:] = [d for d in dirs if Path(root, d) != snapshots_directory]
             for f in files:
                 fullpath = Path(root, f)
                 relative = fullpath.relative_to(db_directory)
@@ -353,14 +545,14 @@ class AppState(metaclass=AppStateMeta):
         print(os.getcwd())
 
     @Help(Section.OTHER, "Get database id")
-    @Command(con_required=True)
+    @Command(con_required=True, sql_required=True)
     def cmd_dbid(self):
         dbid = self.cmd_dbid_backend()
         print(dbid)
 
     @Arg("new_dbid", "3 bytes hexadecimal string")
     @Help(Section.OTHER, "Set database id")
-    @Command(con_required=True)
+    @Command(con_required=True, sql_required=True)
     def cmd_setdbid(self, new_dbid):
         self.cmd_setdbid_backend(new_dbid)
 
@@ -388,15 +580,27 @@ class AppState(metaclass=AppStateMeta):
     def cmd_q(self):
         return self.cmd_exit()
 
-    def cmd_newdb_backend(self, path, *, rewrite=False, connect=False, password):
+    def cmd_newdb_backend(self, path, *, rewrite=False, connect=False, password, shards=0):
         mixer = create_default_mixer()
         key_hasher = create_default_key_hasher()
         _set_mixer_keys(mixer, key_hasher, encode_utf8(password))
         hs_hasher = create_default_hash_search_hasher()
         path = get_database_absolute_path(path)
-        connection = sql.raw.db_create_new(path, rewrite=rewrite, connect=True)
-        with closing(connection), connection:
-            sql.content.init_empty_database(connection, mixer, hs_hasher, key_hasher)
+        if config.curconfig.get_entry("storage.engine") == "log":
+            if shards:
+                raise AppError("Shards are not supported by log storage engine")
+            log_store.LogRecordStore.create(path, mixer, rewrite=rewrite).close()
+            log_manifest.init_manifest(path, mixer, key_hasher)
+            if connect:
+                self.cmd_con_backend(path, password=password)
+            return
+        settings = _get_sqlite_settings()
+        connection = sql.raw.db_create_new(path, rewrite=rewrite, connect=True, settings=settings)
+        with closing(connection):
+            with connection:
+                sql.content.init_empty_database(connection, mixer, hs_hasher, key_hasher)
+            if shards:
+                sql.shard.create_shards(connection, path, shards, settings=settings)
         if connect:
             self.cmd_con_backend(path, password=password)
 
@@ -404,80 +608,117 @@ class AppState(metaclass=AppStateMeta):
         path = get_database_absolute_path(path, check_exist=True)
         if self.con_info.connection_abs_path == path:
             raise AppError("Cannot delete currenly connected db")
+        if not sql.raw.is_sqlite_file(path):
+            extra_paths = [p for p in (log_store.get_index_path(path), log_manifest.get_manifest_path(path)) if p.exists()]
+        else:
+            with closing(sql.raw.db_connect(path, read_only=True)) as connection:
+                extra_paths = sql.shard.get_existing_shard_paths(connection, path) if sql.manifest.is_db_created_by_app(connection) else []
         try:
+            for extra_path in extra_paths:
+                remove_file_path(extra_path)
             remove_file_path(path)
         except OSError as e:
             raise AppError(original_exception=e) from e
 
-    def cmd_con_backend(self, path, *, password):
+    def cmd_con_backend(self, path, *, password, mirror=False, deferred=False):
         if self.con_info.is_connected():
             self.cmd_discon_backend()
         abs_path = get_database_absolute_path(path)
-        password = encode_utf8(password)
-        connection = sql.raw.db_connect(abs_path)
-        with CloseOnError(connection):
-            if not sql.manifest.is_db_created_by_app(connection):
-                raise AppError("Database is not created by application")
-            hs_hasher = sql.manifest.get_hs_hasher(connection)
-            mixer = sql.manifest.get_mixer(connection)
-            key_hasher = sql.manifest.get_key_hasher(connection)
-            _set_mixer_keys(mixer, key_hasher, password)
-            sql.manifest.check_key(connection, mixer)
         rel_path = abs_path.relative_to(config.curconfig.db_directory)
-        ctx = sql.share.ConnectionContext(connection, mixer, hs_hasher)
-        sql.description.get.cache_clear()
-        self.con_info = ConnectionInfo(ctx, rel_path, abs_path)
+        if not sql.raw.is_sqlite_file(abs_path):
+            if mirror or deferred:
+                raise AppError("Memory mirror is not supported by log storage engine")
+            store = _open_log_store(abs_path, password)
+            self.con_info = ConnectionInfo(None, rel_path, abs_path, store)
+            return
+        ctx = _open_database(abs_path, password, mirror=mirror or deferred, deferred=deferred)
+        tables_limit = config.curconfig.get_entry("storage.tables_limit") or sql.content.DEFAULT_TABLES_LIMIT
+        self.con_info = ConnectionInfo(ctx, rel_path, abs_path, SqlRecordStore(ctx, tables_limit=tables_limit))
 
     def cmd_discon_backend(self):
         con_info = self.con_info
+        _flush_mirror(con_info)
         self.con_info = ConnectionInfo()
-        if con_info.is_connected():
-            con_info.ctx.connection.close()
+        if con_info.is_connected() and con_info.ctx is None:
+            con_info.store.close()
+        elif con_info.is_connected():
+            with closing(con_info.ctx.connection):
+                sql.search.drop_search_index(con_info.ctx)
+                _auto_maintain(con_info.ctx)
+
+    def cmd_maintain_backend(self, *, report=False, pages=0, convert=False):
+        ctx = self.con_info.ctx
+        if sql.mirror.is_mirror(ctx.connection):
+            raise AppError("Maintenance is not available for memory mirror, reconnect without --mirror/--deferred")
+        before = sql.maintenance.get_report(ctx)
+        if report:
+            return before, None
+        if convert and before.auto_vacuum != "INCREMENTAL":
+            sql.maintenance.convert_to_incremental(ctx)
+        else:
+            sql.maintenance.incremental_vacuum(ctx, max_pages=pages or None)
+        sql.maintenance.compact_bloom_filters(ctx)
+        sql.maintenance.optimize(ctx)
+        return before, sql.maintenance.get_report(ctx)
 
     def cmd_coninfo_backend(self):
         return self.con_info.connection_path
 
     def cmd_get_backend(self, table, key) -> Optional[dict]:
-        row = sql.content.get_record(self.con_info.ctx, table, key)
+        row = self.con_info.store.get(table, key)
         return row
 
     def cmd_ins_backend(self, table, key, *attribs):
         attribs = _build_attributes_dict(*attribs)
-        with self.con_info.ctx.connection:
-            sql.content.insert_record(self.con_info.ctx, table, key, attribs)
+        self.con_info.store.insert(table, key, attribs)
 
     def cmd_upd_backend(self, table, key, *attribs, replace=False, new_key=None):
         attribs = _build_attributes_dict(*attribs)
-        with self.con_info.ctx.connection:
-            sql.content.update_record(self.con_info.ctx, table, key, attribs, new_key=new_key, replace=replace)
+        self.con_info.store.update(table, key, attribs, new_key=new_key, replace=replace)
 
     def cmd_del_backend(self, table, key):
-        with self.con_info.ctx.connection:
-            sql.content.del_record(self.con_info.ctx, table, key)
+        self.con_info.store.delete(table, key)
 
     def cmd_count_backend(self, table):
-        result = sql.content.count_records(self.con_info.ctx, table)
+        result = self.con_info.store.count(table)
         return result
 
-    def cmd_keys_backend(self, table):
-        row_gen = sql.content.iterate_with_decryption(self.con_info.ctx, table, columns=(sql.content.KEY_COL,))
-        return list(row[sql.content.KEY_COL] for row in row_gen)
+    def cmd_keys_backend(self, table, *, limit=0, after=None):
+        _check_limit(limit)
+        return _iterate_key_list(self.con_info, table, _decode_key_cursor(after), limit=limit or None)
+
+    def cmd_find_backend(self, table, key_substr, *, limit=0, after=None):
+        _check_limit(limit)
+        key_gen = (item for item in _iterate_key_list(self.con_info, table, _decode_key_cursor(after)) if key_substr in item.key)
+        return itertools.islice(key_gen, limit or None)
+
+    def cmd_searchidx_backend(self, *tables, all=False): # pylint: disable=redefined-builtin
+        ctx = self.con_info.ctx
+        if all:
+            tables = tuple(desc.name for desc in sql.description.iterate(ctx))
+        if not sql.search.is_search_enabled(ctx):
+            ctx = dataclasses.replace(ctx, search=sql.search.create_search_index(ctx.connection))
+            self.con_info = _replace_ctx(self.con_info, ctx)
+        for table in tables:
+            with ctx.connection:
+                sql.search.index_tables(ctx, table)
+
+    def cmd_delsearchidx_backend(self):
+        ctx = self.con_info.ctx
+        sql.search.drop_search_index(ctx)
+        self.con_info = _replace_ctx(self.con_info, dataclasses.replace(ctx, search=None))
 
-    def cmd_find_backend(self, table, key_substr):
-        row_gen = sql.content.iterate_with_decryption(self.con_info.ctx, table, columns=(sql.content.KEY_COL,))
-        key_list = [row[sql.content.KEY_COL] for row in row_gen if key_substr in row[sql.content.KEY_COL]]
-        return key_list
+    def cmd_search_backend(self, query, *, table=None, limit=20):
+        return sql.search.search(self.con_info.ctx, query, table=table, limit=limit)
 
     def cmd_newtable_backend(self, name, *, hash_search=False):
-        with self.con_info.ctx.connection:
-            sql.content.create_table(self.con_info.ctx, name, enable_hash_search=hash_search)
+        self.con_info.store.create_table(name, hash_search=hash_search)
 
     def cmd_deltable_backend(self, name):
-        with self.con_info.ctx.connection:
-            sql.content.delete_table(self.con_info.ctx, name)
+        self.con_info.store.delete_table(name)
 
     def cmd_tables_backend(self):
-        return list(sql.description.iterate_with_decryption(self.con_info.ctx))
+        return list(self.con_info.store.iterate_tables())
 
     def cmd_desctable_backend(self, table):
         desc = sql.description.get(self.con_info.ctx, table)
@@ -490,20 +731,195 @@ class AppState(metaclass=AppStateMeta):
         with self.con_info.ctx.connection:
             sql.impexp.import_tables(self.con_info.ctx, Path(path), *tables, all=all)
 
-    def cmd_cloudup_backend(self, path, *, service=None):
-        path = get_database_absolute_path(path, check_exist=True)
-        if self.con_info.connection_abs_path == path:
-            raise AppError("Cannot upload currenly connected db")
+    def cmd_cloudup_backend(self, *paths, service=None, all_services=False, all_dbs=False, workers=0, progress=None):
+        """
+        Every database is uploaded to every chosen service, uploads run concurrently on thread pool
+        Single upload raises its error, otherwise errors are returned per destination
+        """
         if not config.curconfig.get_entry("cloud.enabled"):
             raise AppError("Cloud service disabled")
-        if service is None:
-            service = config.curconfig.cloud.service
+        _check_workers(workers)
+        paths = self._get_cloudup_paths(paths, all_dbs)
+        services = _get_cloudup_services(service, all_services)
+        # NOTE: upload consistent copy, database may be connected or changed by other process
+        snapshot_paths = {path: self.cmd_snapshot_backend(path=path) for path in paths}
+        results, destinations = self._get_cloudup_destinations(paths, services)
+        total = len(results) + len(destinations)
+        for done, result in enumerate(results, start=1):
+            if progress is not None:
+                progress(result, done, total)
+        if destinations:
+            for result in self._iterate_uploads(destinations, snapshot_paths, workers):
+                results.append(result)
+                if progress is not None:
+                    progress(result, len(results), total)
+        if len(results) == 1 and results[0].error is not None:
+            raise AppError(original_exception=results[0].error) from None
+        return results
+
+    def _get_cloudup_paths(self, paths, all_dbs) -> list:
+        if all_dbs:
+            paths = _list_app_databases()
+        elif not paths:
+            if not self.con_info.is_connected():
+                raise AppError("Not connected")
+            paths = [self.con_info.connection_abs_path]
+        return list(OrderedDict.fromkeys(get_database_absolute_path(path, check_exist=True) for path in paths))
+
+    def _get_cloudup_destinations(self, paths, services) -> tuple:
+        """
+        (failed results, (path, service) destinations), every database of service failed to connect fails
+        """
+        results, destinations = [], []
+        for service_name in services:
+            try:
+                self._get_cloud(service_name)
+            except CloudError as e:
+                results.extend(CloudUploadResult(path, service_name, e, 0) for path in paths)
+                continue
+            destinations.extend((path, service_name) for path in paths)
+        return results, destinations
+
+    def _iterate_uploads(self, destinations, snapshot_paths, workers) -> Iterator[CloudUploadResult]:
+        """
+        Results in order of upload completion
+        """
+        # NOTE: more workers than pooled connections would open and drop extra connections
+        workers = min(workers or cloud_share.SESSION_POOL_SIZE, cloud_share.SESSION_POOL_SIZE, len(destinations))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_upload_to_cloud, self.cloud[service_name], path, snapshot_paths[path], service_name)
+                for path, service_name in destinations
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def cmd_cloudls_backend(self, *, dbid=None, service=None):
+        if not config.curconfig.get_entry("cloud.enabled"):
+            raise AppError("Cloud service disabled")
+        service = config.curconfig.cloud.service if service is None else service
+        try:
+            return cloud.list_backups(self._get_cloud(service), dbid or "")
+        except CloudError as e:
+            raise AppError(original_exception=e) from e
+
+    def cmd_cloudrestore_backend(self, prefix, *, path=None, service=None, workers=0, rewrite=False):
+        """
+        Latest backup matching prefix, its database goes to path (backup database name by default)
+        """
+        found = self.cmd_cloudls_backend(dbid=prefix, service=service)
+        if not found:
+            raise AppError(f"No backups match {prefix}")
+        backup = found[-1]
+        path = get_database_absolute_path(backup.name if path is None else path)
+        if path == self.con_info.connection_abs_path:
+            raise AppError("Cannot restore into connected database")
+        if path.exists() and not rewrite:
+            raise AppError("Database already exists, use --rewrite to replace it")
+        service = config.curconfig.cloud.service if service is None else service
         try:
+            cloud.restore_backup(self._get_cloud(service), backup, path, workers=workers or cloud_share.DOWNLOAD_WORKERS)
+        except CloudError as e:
+            raise AppError(original_exception=e) from e
+        return backup, path
+
+    def cmd_cloudhist_backend(self, *, path=None, service=None, limit=10):
+        """
+        (service, upload state) per destination the database was uploaded to, history is cut to last limit uploads
+        """
+        if path is None:
+            if not self.con_info.is_connected():
+                raise AppError("Not connected")
+            path = self.con_info.connection_abs_path
+        dbid, _ = cloud.get_database_files(get_database_absolute_path(path, check_exist=True))
+        states = []
+        for state_path in cloud_upload_state.iterate_state_paths(get_snapshots_directory(), dbid):
+            key = cloud_upload_state.get_state_key(state_path)
+            if service is not None and key != service:
+                continue
+            state = cloud_upload_state.read_state(state_path)
+            if limit:
+                state.history = state.history[-limit:]
+            states.append((key, state))
+        return states
+
+    def cmd_sync_backend(self, path, *tables, password, pull=False, delete=False, dry_run=False):
+        abs_path = get_database_absolute_path(path, check_exist=True)
+        if abs_path == self.con_info.connection_abs_path:
+            raise AppError("Cannot sync database with itself")
+        other_ctx = _open_database(abs_path, password)
+        with closing(other_ctx.connection):
+            src_ctx, dst_ctx = (other_ctx, self.con_info.ctx) if pull else (self.con_info.ctx, other_ctx)
+            with dst_ctx.connection:
+                return sql.sync.sync_tables(src_ctx, dst_ctx, *tables, delete=delete, dry_run=dry_run)
+
+    def cmd_restore_backend(self, path, *files, rewrite=False):
+        path = get_database_absolute_path(path)
+        if path == self.con_info.connection_abs_path:
+            raise AppError("Cannot restore into connected database")
+        if path.exists() and not rewrite:
+            raise AppError("Database already exists, use --rewrite to replace it")
+        backup_paths = []
+        for pattern in files:
+            matched = glob.glob(os.path.expanduser(pattern))
+            if not matched:
+                raise AppError(f"No backup files match {pattern}")
+            backup_paths.extend(Path(match) for match in matched)
+        manifest_paths = [backup_path for backup_path in backup_paths if backup_path.name.endswith(chunkstore.MANIFEST_SUFFIX)]
+        if not manifest_paths:
+            # NOTE: compressed chain files are unpacked next to snapshots, plain names keep chain order
+            snapshots_directory = get_snapshots_directory()
+            snapshots_directory.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=snapshots_directory) as temp_directory:
+                try:
+                    backup_paths = [_decompress_backup(backup_path, temp_directory) for backup_path in backup_paths]
+                except CloudError as e:
+                    raise AppError(original_exception=e) from e
+                return sql.increment.restore_chain(backup_paths, path)
+        if len(backup_paths) != 1:
+            raise AppError("Deduplicated upload is restored from one manifest, chunks are read from its directory")
+        try:
+            cloud.restore_database_chunks(manifest_paths[0], path)
+        except CloudError as e:
+            raise AppError(original_exception=e) from e
+        return None
+
+    def cmd_scrub_backend(self, *, workers=0, report=None, progress=None):
+        ctx = self.con_info.ctx
+        _flush_mirror(self.con_info)
+        result = sql.scrub.scrub(ctx, self.con_info.connection_abs_path, workers=workers or None, progress=progress)
+        if report is not None:
+            try:
+                with open(report, "w", encoding="utf-8") as fd:
+                    json.dump(result.to_dict(), fd, indent=4)
+            except OSError as e:
+                raise AppError(f"Cannot write report {report}", original_exception=e) from e
+        return result
+
+    def cmd_snapshot_backend(self, *, path=None):
+        if path is None:
+            if not self.con_info.is_connected():
+                raise AppError("Not connected")
+            path = self.con_info.connection_abs_path
+        path = get_database_absolute_path(path, check_exist=True)
+        if path == self.con_info.connection_abs_path:
+            _flush_mirror(self.con_info)
+        return _create_snapshot(path)
+
+    def _get_cloud(self, service):
+        # NOTE: clients are shared with upload queue thread
+        with self.cloud_lock:
             if self.cloud.get(service, None) is None:
                 self.cloud[service] = cloud.init_cloud(service)
-            self.cloud[service].upload_database(path)
-        except CloudError as e:
-            raise AppError(original_exception=e) from None
+            return self.cloud[service]
+
+    def _upload_queued(self, path, service):
+        """
+        Runs on upload queue thread, so connection of this state is not touched:
+        snapshot is taken from committed file content
+        """
+        snapshot_path = _create_snapshot(path)
+        _upload_snapshot(self._get_cloud(service), path, snapshot_path, service)
 
     def cmd_dbid_backend(self):
         return sql.manifest.get_dbid(self.con_info.ctx.connection)
@@ -527,6 +943,130 @@ def get_database_absolute_path(path, check_exist=False):
     return path
 
 
+def _list_app_databases():
+    db_directory = config.curconfig.db_directory
+    snapshots_directory = get_snapshots_directory()
+    paths = []
+    for root, dirs, files in os.walk(db_directory):
+        dirs[:] = [d for d in dirs if Path(root, d) != snapshots_directory]
+        for f in sorted(files):
+            path = Path(root, f)
+            if sql.shard.FILE_INFIX in path.stem:
+                continue
+            try:
+                with closing(sql.raw.db_connect(path, read_only=True)) as connection:
+                    if sql.manifest.is_db_created_by_app(connection):
+                        paths.append(path)
+            except sql.share.StorageError:
+                continue
+    return paths
+
+
+def _create_snapshot(path) -> Path:
+    with closing(sql.raw.db_connect(path, read_only=True)) as connection:
+        if not sql.manifest.is_db_created_by_app(connection):
+            raise AppError("Database is not created by application")
+        dbid = sql.manifest.get_dbid(connection)
+    directory = get_snapshots_directory()
+    step_pages = config.curconfig.get_entry("storage.snapshots.step_pages") or sql.snapshot.DEFAULT_STEP_PAGES
+    snapshot_path = sql.snapshot.create_snapshot(path, sql.snapshot.gen_snapshot_path(directory, dbid), step_pages=step_pages)
+    sql.snapshot.rotate_snapshots(directory, dbid, config.curconfig.get_entry("storage.snapshots.keep") or sql.snapshot.DEFAULT_KEEP)
+    return snapshot_path
+
+
+def _decompress_backup(path, directory) -> Path:
+    codec = cloud_compress.get_codec(path)
+    if codec is None:
+        return path
+    decompressed_path = Path(directory, path.name.removesuffix(cloud_compress.SUFFIXES[codec]))
+    cloud_compress.decompress_file(path, decompressed_path, codec)
+    return decompressed_path
+
+
+def _get_cloudup_services(service, all_services) -> list:
+    if not all_services:
+        return [config.curconfig.cloud.service if service is None else service]
+    services = cloud.get_configured_services()
+    if not services:
+        raise AppError("No configured cloud services")
+    return services
+
+
+def _upload_to_cloud(cloud_instance, path, snapshot_path, service) -> CloudUploadResult:
+    start_time = time.perf_counter()
+    error, skipped = None, False
+    try:
+        skipped = not _upload_snapshot(cloud_instance, path, snapshot_path, service)
+    except (CloudError, sql.share.StorageError) as e:
+        error = e
+    return CloudUploadResult(path, service, error, time.perf_counter() - start_time, skipped)
+
+
+def _upload_snapshot(cloud_instance, path, snapshot_path, service) -> bool:
+    """
+    Snapshot identical to the last successful upload to this destination is skipped, returns False then
+    Every upload is recorded to upload state of database and destination
+    """
+    dbid, files = cloud.get_database_files(snapshot_path)
+    state_path = cloud_upload_state.get_state_path(get_snapshots_directory(), dbid, service)
+    state = cloud_upload_state.read_state(state_path, cloud_instance.destination)
+    size = sum(file.stat().st_size for file in files)
+    content_hash = cloud_upload_state.calculate_hash(files, cloud_instance.create_hasher())
+    if state.is_uploaded(size, content_hash):
+        return False
+    start_time = time.perf_counter()
+    uploaded = _upload_snapshot_files(cloud_instance, path, snapshot_path, service)
+    if uploaded is None:
+        return False
+    record = cloud_upload_state.UploadRecord(
+        cloud_upload_state.get_time_str(), size, path.stat().st_mtime, content_hash, uploaded, time.perf_counter() - start_time
+    )
+    cloud_upload_state.record_upload(state_path, state, record)
+    return True
+
+
+def _upload_snapshot_files(cloud_instance, path, snapshot_path, service) -> Optional[int]:
+    """
+    Incremental mode uploads the next file of backup chain (nothing if database is unchanged),
+    databases without change log are uploaded whole
+    Dedup mode uploads only chunks missing at destination and manifest of snapshot
+    Every uploaded file is compressed when cloud.compression is set
+    Returns bytes sent, None if nothing was sent
+    """
+    compression = config.curconfig.get_entry("cloud.compression")
+    level = config.curconfig.get_entry("cloud.compression_level")
+    if config.curconfig.get_entry("cloud.dedup"):
+        chunk_size = config.curconfig.get_entry("cloud.chunk_size") or chunkstore.DEFAULT_CHUNK_SIZE
+        result = cloud.upload_database_chunks(
+            cloud_instance, snapshot_path, cloud.get_chunk_index_path(get_snapshots_directory(), snapshot_path, service),
+            filename=path.name, options=chunkstore.ChunkOptions(chunk_size, compression, level)
+        )
+        return result.uploaded_bytes
+    if not config.curconfig.get_entry("cloud.incremental") or not sql.increment.is_chain_supported(snapshot_path):
+        if compression is None:
+            cloud_instance.upload_database(snapshot_path, filename=path.name)
+            return sum(file.stat().st_size for file in cloud.get_database_files(snapshot_path)[1])
+        return cloud.upload_database_compressed(cloud_instance, snapshot_path, compression, filename=path.name, level=level)
+    directory = get_snapshots_directory()
+    full_every = config.curconfig.get_entry("cloud.full_every")
+    full_every = sql.increment.DEFAULT_FULL_EVERY if full_every is None else full_every
+    chain_file = sql.increment.prepare_backup(snapshot_path, directory, service, name=path.name, full_every=full_every)
+    if chain_file is None:
+        return None
+    try:
+        uploaded = cloud.upload_compressed(cloud_instance, chain_file.path, chain_file.filename, compression, level=level)
+    finally:
+        if chain_file.temporary:
+            remove_file_path(chain_file.path)
+    sql.increment.commit_backup(directory, service, chain_file)
+    return uploaded
+
+
+def get_snapshots_directory() -> Path:
+    directory = config.curconfig.get_entry("storage.snapshots.directory")
+    return Path(config.curconfig.db_directory, SNAPSHOTS_DIRNAME) if directory is None else directory
+
+
 def create_default_mixer():
     aes = primitives.Enc256AESCTR()
     chacha = primitives.Enc256CHACHA()
@@ -547,12 +1087,153 @@ def create_default_hash_search_hasher():
     return Hasher(big_hasher, shake, iterations=1)
 
 
+def _open_database(abs_path, password: str, *, mirror=False, deferred=False) -> sql.share.ConnectionContext:
+    password = encode_utf8(password)
+    settings = _get_sqlite_settings()
+    if mirror:
+        flush_interval = config.curconfig.get_entry("storage.mirror.flush_interval")
+        flush_statements = config.curconfig.get_entry("storage.mirror.flush_statements")
+        connection = sql.mirror.db_connect_mirror(abs_path, settings=settings, deferred=deferred, flush_interval=flush_interval, flush_statements=flush_statements)
+    else:
+        connection = sql.raw.db_connect(abs_path, settings=settings)
+    with CloseOnError(connection):
+        if not sql.manifest.is_db_created_by_app(connection):
+            raise AppError("Database is not created by application")
+        shards = sql.shard.attach_shards(connection, abs_path, settings=settings)
+        hs_hasher = sql.manifest.get_hs_hasher(connection)
+        mixer = sql.manifest.get_mixer(connection)
+        key_hasher = sql.manifest.get_key_hasher(connection)
+        _set_mixer_keys(mixer, key_hasher, password)
+        sql.manifest.check_key(connection, mixer)
+    with CloseOnError(connection), connection:
+        changelog = _setup_changelog(connection, shards)
+    ctx = sql.share.ConnectionContext(connection, mixer, hs_hasher, scan=_get_scan_options(), shards=shards, changelog=changelog)
+    with CloseOnError(connection), connection:
+        sql.description.upgrade_description_table(ctx)
+    return ctx
+
+
+def _open_log_store(abs_path, password: str) -> log_store.LogRecordStore:
+    mixer = log_manifest.get_mixer(abs_path)
+    key_hasher = log_manifest.get_key_hasher(abs_path)
+    _set_mixer_keys(mixer, key_hasher, encode_utf8(password))
+    return log_store.LogRecordStore.open(abs_path, mixer)
+
+
+def _replace_ctx(con_info, ctx) -> ConnectionInfo:
+    store = SqlRecordStore(ctx, tables_limit=con_info.store.tables_limit)
+    return dataclasses.replace(con_info, ctx=ctx, store=store)
+
+
+def _setup_changelog(connection, shards) -> bool:
+    """
+    Change log is created for incremental uploads and kept once created, entries of full backups are pruned
+    """
+    if shards == 0 and config.curconfig.get_entry("cloud.incremental"):
+        sql.changelog.init_changelog_table(connection)
+    if not sql.changelog.is_changelog_enabled(connection):
+        return False
+    base_seq = sql.increment.get_chain_base_seq(get_snapshots_directory(), sql.manifest.get_dbid(connection))
+    if base_seq is not None:
+        sql.changelog.prune(connection, base_seq)
+    return True
+
+
 def _set_mixer_keys(mixer, key_hasher, password: bytes):
     keys = key_hasher.process(password)
     mixer.set_keys(*keys)
     mixer.opposite_instance(set_attribute=True)
 
 
+def _print_key_list(key_gen, limit):
+    count, item = 0, None
+    for count, item in enumerate(key_gen, 1):
+        print(item.key)
+    if limit and count == limit:
+        print(f"Next: --after {item.cursor}")
+
+
+def _encode_key_cursor(rowid: int) -> str:
+    return f"{rowid:x}"
+
+
+def _decode_key_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        after_id = int(cursor, 16)
+    except ValueError as e:
+        raise AppError(f"Invalid cursor '{cursor}'") from e
+    if after_id < 0:
+        raise AppError(f"Invalid cursor '{cursor}'")
+    return after_id
+
+
+def _iterate_key_list(con_info, table, after_id, *, limit=None):
+    """
+    Cursor is row id for sqlite engine and position of key for log engine (shifts if table changes between pages)
+    """
+    if con_info.ctx is None:
+        start = after_id or 0
+        keys = itertools.islice(con_info.store.iterate_keys(table), start, None if limit is None else start + limit)
+        return (KeyListItem(key, _encode_key_cursor(position)) for position, key in enumerate(keys, start + 1))
+    columns = (sql.content.ID_COL, sql.content.KEY_COL)
+    row_gen = sql.content.iterate_with_decryption(con_info.ctx, table, columns=columns, after_id=after_id, limit=limit)
+    return (KeyListItem(row[sql.content.KEY_COL], _encode_key_cursor(row[sql.content.ID_COL])) for row in row_gen)
+
+
+def _check_workers(workers: int):
+    if workers < 0:
+        raise AppError(f"Invalid workers count {workers}, expected 0 (default) or positive number")
+
+
+def _check_limit(limit: int):
+    if limit < 0:
+        raise AppError(f"Invalid limit {limit}, expected 0 (no limit) or positive number")
+
+
+def _print_maintenance_report(report):
+    print(f"page size: {report.page_size}, pages: {report.page_count}, auto_vacuum: {report.auto_vacuum}")
+    print(f"free pages: {report.freelist_count} ({report.free_ratio:.1%})")
+    if report.tables is None:
+        print("Per table usage is not available (sqlite built without dbstat)")
+        return
+    for usage in report.tables:
+        print(f"{usage.name}: {usage.pages} pages, {usage.size / 2 ** 20:.2f} MiB")
+
+
+def _auto_maintain(ctx):
+    threshold = config.curconfig.get_entry("storage.maintenance.auto_free_ratio")
+    if threshold is None or sql.mirror.is_mirror(ctx.connection):
+        return
+    report = sql.maintenance.get_report(ctx)
+    if report.free_ratio < threshold:
+        return
+    pages = config.curconfig.get_entry("storage.maintenance.auto_pages")
+    sql.maintenance.incremental_vacuum(ctx, max_pages=pages)
+    sql.maintenance.optimize(ctx)
+
+
+def _flush_mirror(con_info):
+    if con_info.ctx is not None and sql.mirror.is_mirror(con_info.ctx.connection):
+        con_info.ctx.connection.flush()
+
+
+def _get_sqlite_settings():
+    profile = config.curconfig.get_entry("storage.performance.profile") or sql.raw.DEFAULT_PERFORMANCE_PROFILE
+    overrides = {}
+    for settings_field in dataclasses.fields(sql.raw.SqliteSettings):
+        if (value := config.curconfig.get_entry(f"storage.performance.{settings_field.name}")) is not None:
+            overrides[settings_field.name] = value
+    return dataclasses.replace(sql.raw.PERFORMANCE_PROFILES[profile], **overrides)
+
+
+def _get_scan_options():
+    workers = config.curconfig.get_entry("storage.scan.workers") or 0
+    batch_size = config.curconfig.get_entry("storage.scan.batch_size") or 0
+    return sql.share.ScanOptions(workers=workers, batch_size=batch_size)
+
+
 def _gen_password(size=20, disable_spec_char=False):
     # pylint: disable-next=invalid-name
     SPECIAL_CHARACTERS = "()[]{}_!#$%&+-*/<=>?@^~"
@@ -616,14 +1297,31 @@ def _process_input_attribute_value(value: str):
 
 
 def _disconnect_task_upload(app_state, connection_path):
-    print(f"Uploading {connection_path} to {config.curconfig.cloud.service}...")
-    app_state.cmd_cloudup_backend(connection_path)
-    print("File uploaded")
+    service = config.curconfig.cloud.service
+    app_state.upload_queue.enqueue(get_database_absolute_path(connection_path), service)
+    print(f"Upload of {connection_path} to {service} queued")
+
+
+def _print_queued_upload_result(job, error):
+    # NOTE: called from upload thread, console_run patches stdout so output goes above prompt
+    if error is None:
+        print(f"Uploaded {job.path.name} to {job.service}")
+    else:
+        print(f"Upload of {job.path.name} to {job.service} failed, it will be retried on next start: {error}")
+
+
+def resume_uploads(app_state):
+    if not config.curconfig.get_entry("cloud.enabled"):
+        return
+    count = app_state.upload_queue.resume()
+    if count:
+        print(f"Retrying {count} failed uploads")
 
 
 def _exit_tasks(app_state):
     if app_state.con_info.is_connected():
         _exit_task_disconnect(app_state)
+    _exit_task_wait_uploads(app_state)
 
 
 def _exit_task_disconnect(app_state):
@@ -631,6 +1329,15 @@ def _exit_task_disconnect(app_state):
     app_state.cmd_discon()
 
 
+def _exit_task_wait_uploads(app_state):
+    if app_state.upload_queue.pending():
+        print("Waiting for uploads...")
+    exit_wait = config.curconfig.get_entry("cloud.exit_wait")
+    left = app_state.upload_queue.close(upload_queue.DEFAULT_EXIT_WAIT if exit_wait is None else exit_wait)
+    if left:
+        print(f"{left} uploads will be retried on next start")
+
+
 def _print_or_clip(clip: bool, *, cdata=None, pdata=None):
     if clip:
         assert cdata is not None
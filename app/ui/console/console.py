@@ -8,6 +8,7 @@ import prompt_toolkit.lexers
 import prompt_toolkit.styles.pygments
 import prompt_toolkit.completion
 import prompt_toolkit.formatted_text
+import prompt_toolkit.patch_stdout
 
 import pygments as pyg
 import pygments.lexer
@@ -20,7 +21,7 @@ from app import config
 from app.storage.sql.share import StorageError
 from app.storage.sql.manifest import KeyCheckError
 
-from .app import AppState, AppError
+from .app import AppState, AppError, resume_uploads
 from .app_meta import call_command_from_cmdline_args
 
 
@@ -136,14 +137,18 @@ def execute_command(app_state, cmd: str) -> int:
 
 def console_run():
     app_state = AppState()
-    _connect_default_db(app_state)
-    last_exec_status = EXEC_SUCCESS
-    prompt_parameters = get_prompt_parameters()
-    while True:
-        angle_brackets_color = "#00ff00" if last_exec_status is EXEC_SUCCESS else "#ffffff"
-        angle_brackets = ptk.formatted_text.FormattedText([(angle_brackets_color, ">> ")])
-        cmd = ptk.prompt(angle_brackets, **prompt_parameters)
-        last_exec_status = execute_command(app_state, cmd)
+    # NOTE: upload queue prints from background thread, keep its output above every prompt,
+    # including password prompt of default database shown while resumed uploads run
+    with ptk.patch_stdout.patch_stdout():
+        resume_uploads(app_state)
+        _connect_default_db(app_state)
+        last_exec_status = EXEC_SUCCESS
+        prompt_parameters = get_prompt_parameters()
+        while True:
+            angle_brackets_color = "#00ff00" if last_exec_status is EXEC_SUCCESS else "#ffffff"
+            angle_brackets = ptk.formatted_text.FormattedText([(angle_brackets_color, ">> ")])
+            cmd = ptk.prompt(angle_brackets, **prompt_parameters)
+            last_exec_status = execute_command(app_state, cmd)
 
 
 def _connect_default_db(app_state):
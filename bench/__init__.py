@@ -0,0 +1,50 @@
+# Usage: python -m bench.<module> [-h]
+
+
+import tempfile
+
+from pathlib import Path
+from time import perf_counter_ns
+
+from utils.common import random_bytes
+
+from app.storage import sql
+# pylint: disable=unused-import
+import app.storage.sql.content
+import app.storage.sql.share
+# pylint: enable=unused-import
+from app.ui.console.app import create_default_mixer, create_default_key_hasher, create_default_hash_search_hasher
+
+
+def create_bench_mixer():
+    mixer = create_default_mixer()
+    mixer.set_keys(*(random_bytes(size) for size in mixer.key_sizes))
+    mixer.opposite_instance(set_attribute=True)
+    return mixer
+
+
+def create_bench_context(path=None, *, settings=None) -> sql.share.ConnectionContext:
+    if path is None:
+        path = Path(tempfile.mkdtemp(prefix="overpass_bench_"), "bench.db")
+    mixer = create_bench_mixer()
+    hs_hasher = create_default_hash_search_hasher()
+    connection = sql.raw.db_create_new(path, rewrite=True, connect=True, settings=settings)
+    sql.content.init_empty_database(connection, mixer, hs_hasher, create_default_key_hasher())
+    return sql.share.ConnectionContext(connection, mixer, hs_hasher)
+
+
+class Timer:
+
+    def __init__(self):
+        self.begin, self.end = None, None
+
+    def __enter__(self):
+        self.begin = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end = perf_counter_ns()
+
+    @property
+    def seconds(self) -> float:
+        return (self.end - self.begin) / 10 ** 9
@@ -0,0 +1,50 @@
+import argparse
+
+from app.storage.sql import bloom, content, description
+
+from . import create_bench_context, Timer
+
+
+def fill_table(ctx, table, rows):
+    with ctx.connection, bloom.deferred_store(ctx, description.get(ctx, table)):
+        for i in range(rows):
+            content.insert_record(ctx, table, f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+
+
+def bench_insert(ctx, table, rows, count):
+    with Timer() as timer:
+        for i in range(count):
+            with ctx.connection:
+                content.insert_record(ctx, table, f"new{rows + i}", {"login": "login", "password": "password"})
+    print(f"insert:      {count / timer.seconds:10.1f} rows/s ({timer.seconds * 1000 / count:.2f} ms/row)")
+
+
+def bench_missing_get(ctx, table, count):
+    with Timer() as timer:
+        for i in range(count):
+            content.get_record(ctx, table, f"missing{i}")
+    print(f"missing get: {count / timer.seconds:10.1f} ops/s ({timer.seconds * 1000 / count:.2f} ms/op)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert throughput into non hash search table with bloom filter")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in table before measurement")
+    parser.add_argument("--count", type=int, default=1000, help="Measured inserts/lookups")
+    args = parser.parse_args()
+    ctx = create_bench_context()
+    with ctx.connection:
+        content.create_table(ctx, "bench")
+    with Timer() as timer:
+        fill_table(ctx, "bench", args.rows)
+    print(f"fill {args.rows} rows: {timer.seconds:.1f} s")
+    ctx.bloom.clear()
+    with Timer() as timer:
+        bloom.might_contain(ctx, description.get(ctx, "bench"), "key0")
+    print(f"filter load: {timer.seconds * 1000:.1f} ms")
+    bench_insert(ctx, "bench", args.rows, args.count)
+    bench_missing_get(ctx, "bench", args.count)
+    ctx.connection.close()
+
+
+if __name__ == "__main__":
+    main()
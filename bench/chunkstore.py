@@ -0,0 +1,49 @@
+import random
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.cloud import chunkstore
+from app.cloud.cloud import LocalCloud
+from app.storage.sql import content, snapshot
+
+from . import create_bench_context, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store size of daily deduplicated backups against one full copy")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows in table")
+    parser.add_argument("--days", type=int, default=90, help="Backups kept")
+    parser.add_argument("--changes", type=int, default=20, help="Rows updated per day")
+    parser.add_argument("--chunk-size", type=int, default=chunkstore.DEFAULT_CHUNK_SIZE, help="Average chunk size")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_") as temp_directory:
+        path = Path(temp_directory, "bench.db")
+        store = LocalCloud(Path(temp_directory, "store"))
+        index_path = Path(temp_directory, "chunk_index.json")
+        ctx = create_bench_context(path)
+        with ctx.connection:
+            content.create_table(ctx, "bench", enable_hash_search=True)
+            for i in range(args.rows):
+                content.insert_record(ctx, "bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+        uploaded_bytes, seconds = 0, 0
+        for day in range(args.days):
+            with ctx.connection:
+                for i in random.sample(range(args.rows), args.changes):
+                    content.update_record(ctx, "bench", f"key{i}", {"password": f"changed{day}"})
+            snapshot_path = snapshot.create_snapshot(path, Path(temp_directory, "snapshot.db"))
+            with Timer() as timer:
+                result = chunkstore.backup(store, [(snapshot_path, "bench.db")], index_path, f"{day:04d}.manifest", options=chunkstore.ChunkOptions(args.chunk_size))
+            uploaded_bytes += result.uploaded_bytes
+            seconds += timer.seconds
+            snapshot_path.unlink()
+        ctx.connection.close()
+        store_size = sum(p.stat().st_size for p in store.directory.iterdir())
+        print(f"database {result.size / 1024:10.1f} KiB, {result.chunks} chunks")
+        print(f"store    {store_size / 1024:10.1f} KiB for {args.days} backups ({store_size / result.size:.2f} copies)")
+        print(f"uploaded {uploaded_bytes / 1024:10.1f} KiB, backup {seconds / args.days * 1000:.1f} ms on average")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import json
+import argparse
+import functools
+import tempfile
+import tracemalloc
+
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app.cloud import share, dropbox, yandex_disk
+from app.cloud.share import CloudError, DownloadOptions
+
+from . import Timer
+from .standin import CloudStandIn
+
+
+MIB = 1024 * 1024
+
+CLIENTS = {
+    "dropbox": (lambda standin: dropbox.Dropbox("bench", update_access_token=True, session=share.create_session(), base_url=standin.base_url), "/bench/"),
+    "yandex_disk": (lambda standin: yandex_disk.YandexDisk("bench", session=share.create_session(), base_url=standin.base_url), "app:/bench/")
+}
+
+
+def measure(standin, action) -> dict:
+    """
+    Seconds, requests, failed requests and peak python memory (client and stand-in) of action
+    """
+    requests, failures = standin.requests, standin.failures
+    tracemalloc.start()
+    try:
+        with Timer() as timer:
+            action()
+        error = None
+    except CloudError as e:
+        error = str(e)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": timer.seconds if error is None else None,
+        "requests": standin.requests - requests,
+        "failures": standin.failures - failures,
+        "peak_mib": peak / MIB,
+        "error": error
+    }
+
+
+def print_result(service, size, operation, result):
+    line = f"{service:12} {size:6} MiB {operation:12}"
+    if result["error"] is not None:
+        print(f"{line} failed: {result['error']}")
+        return
+    print(
+        f"{line} {result['seconds']:8.2f} s {size / result['seconds']:8.1f} MiB/s, "
+        f"{result['requests']:4} requests ({result['failures']} failed), peak {result['peak_mib']:7.1f} MiB"
+    )
+
+
+def bench_size(standin, service, client, size, workers_list) -> list:
+    """
+    Upload of size MiB file, then downloads of it with every worker count
+    """
+    directory = CLIENTS[service][1]
+    cloud_path = f"{directory}{size}.bin"
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_") as temp_directory:
+        path, downloaded_path = Path(temp_directory, f"{size}.bin"), Path(temp_directory, "downloaded.bin")
+        with open(path, "wb") as fd:
+            for _ in range(size):
+                fd.write(random_bytes(MIB))
+
+        def download(workers):
+            cloud_file = next(f for f in client.list_folder(directory) if f.name == f"{size}.bin")
+            client.download_file(cloud_path, downloaded_path, DownloadOptions(cloud_file.size, cloud_file.content_hash, workers=workers))
+
+        operations = [("upload", lambda: client.upload_file(cloud_path, path))]
+        operations.extend((f"download x{workers}", functools.partial(download, workers)) for workers in workers_list)
+        return run_operations(standin, service, size, operations)
+
+
+def run_operations(standin, service, size, operations) -> list:
+    """
+    Downloads are skipped if upload failed
+    """
+    results = []
+    for operation, action in operations:
+        result = measure(standin, action)
+        print_result(service, size, operation, result)
+        results.append({"service": service, "size_mib": size, "operation": operation, **result})
+        if result["error"] is not None and operation == "upload":
+            break
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload and ranged download through local stand-in of dropbox and yandex disk")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 64], help="Vault sizes in MiB (up to 1024)")
+    parser.add_argument("--services", nargs="+", choices=list(CLIENTS), default=list(CLIENTS), help="Services")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Download workers")
+    parser.add_argument("--latency", type=float, default=20, help="Milliseconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0, help="MiB/s of every connection, 0 - unlimited")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Share of requests with lost response")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of failure injection")
+    parser.add_argument("--json", type=Path, default=None, help="Write results to json file, e.g. for CI")
+    args = parser.parse_args()
+    results = []
+    for service in args.services:
+        with CloudStandIn(latency=args.latency / 1000, bandwidth=args.bandwidth * MIB or None, seed=args.seed) as standin:
+            # NOTE: failures are injected after login, token request is not retried by clients
+            client = CLIENTS[service][0](standin)
+            standin.error_rate, standin.drop_rate = args.error_rate, args.drop_rate
+            for size in args.sizes:
+                results.extend(bench_size(standin, service, client, size, args.workers))
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as fd:
+            json.dump(results, fd, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.cloud import compress
+from app.storage.sql import content, snapshot
+
+from . import create_bench_context, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compression ratio and speed of upload codecs on a vault snapshot")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows in table")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 3, 6, 9], help="Compression levels")
+    parser.add_argument("--uplink", type=float, default=1.0, help="Uplink speed in MB/s to estimate upload time")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_") as temp_directory:
+        path = Path(temp_directory, "bench.db")
+        ctx = create_bench_context(path)
+        with ctx.connection:
+            content.create_table(ctx, "bench", enable_hash_search=True)
+            for i in range(args.rows):
+                content.insert_record(ctx, "bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+        ctx.connection.close()
+        snapshot_path = snapshot.create_snapshot(path, Path(temp_directory, "snapshot.db"))
+        size = snapshot_path.stat().st_size
+        print(f"plain      {size / 2 ** 20:8.1f} MiB, upload {size / 10 ** 6 / args.uplink:7.1f} s")
+        for codec in compress.SUFFIXES:
+            for level in args.levels:
+                compressed_path = Path(temp_directory, compress.get_compressed_filename("snapshot.db", codec))
+                with Timer() as timer:
+                    result = compress.compress_file(snapshot_path, compressed_path, codec, level=level)
+                upload_seconds = result.compressed_size / 10 ** 6 / args.uplink
+                print(
+                    f"{codec} {level}     {result.compressed_size / 2 ** 20:8.1f} MiB ({size / result.compressed_size:.2f}x), "
+                    f"compress {timer.seconds:5.2f} s, upload {upload_seconds:7.1f} s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import random
+import argparse
+import tempfile
+
+from pathlib import Path
+from dataclasses import replace
+
+from app.storage.sql import changelog, content, increment, snapshot
+
+from . import create_bench_context, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size of full backup against delta of changed rows")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows in table")
+    parser.add_argument("--changes", type=int, nargs="+", default=[1, 10, 100, 1000], help="Changed rows per delta")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_") as temp_directory:
+        path = Path(temp_directory, "bench.db")
+        ctx = create_bench_context(path)
+        with ctx.connection:
+            changelog.init_changelog_table(ctx.connection)
+        ctx = replace(ctx, changelog=True)
+        with ctx.connection:
+            content.create_table(ctx, "bench", enable_hash_search=True)
+            for i in range(args.rows):
+                content.insert_record(ctx, "bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+        full_path = snapshot.create_snapshot(path, Path(temp_directory, "full.db"))
+        print(f"full      {full_path.stat().st_size / 1024:10.1f} KiB")
+        for changes in args.changes:
+            seq = changelog.get_last_seq(ctx.connection)
+            with ctx.connection:
+                for i in random.sample(range(args.rows), changes):
+                    content.update_record(ctx, "bench", f"key{i}", {"password": "changed"})
+            snapshot_path = snapshot.create_snapshot(path, Path(temp_directory, f"{changes}.db"))
+            delta_path = Path(temp_directory, f"{changes}.delta")
+            with Timer() as timer:
+                increment.create_delta(snapshot_path, delta_path, seq)
+            print(f"{changes:5} rows {delta_path.stat().st_size / 1024:10.1f} KiB, created in {timer.seconds * 1000:.1f} ms")
+        ctx.connection.close()
+
+
+if __name__ == "__main__":
+    main()
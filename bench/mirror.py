@@ -0,0 +1,59 @@
+import random
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.storage.sql import content, mirror, raw, share
+
+from . import create_bench_context, Timer
+
+
+def bench_connection(name, ctx, rows, count):
+    keys = [f"key{random.randrange(rows)}" for _ in range(count)]
+    with Timer() as read_timer:
+        for key in keys:
+            content.get_record(ctx, "bench", key)
+    with Timer() as scan_timer:
+        scanned = sum(1 for _ in content.iterate_with_decryption(ctx, "bench", columns=(content.KEY_COL,)))
+    with Timer() as write_timer:
+        for i in range(count):
+            with ctx.connection:
+                content.insert_record(ctx, "bench", f"{name}{i}", {"login": "login", "password": "password"})
+    print(
+        f"{name:9} read {read_timer.seconds * 1000 / count:6.3f} ms/get, "
+        f"scan {scanned / scan_timer.seconds:9.1f} rows/s, "
+        f"write {write_timer.seconds * 1000 / count:7.2f} ms/commit"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reads and commits of file connection against memory mirror")
+    parser.add_argument("--dir", type=Path, default=Path.cwd(), help="Directory on the measured disk, default - current directory")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows in table")
+    parser.add_argument("--count", type=int, default=200, help="Measured gets/commits")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_", dir=args.dir) as temp_directory:
+        path = Path(temp_directory, "bench.db")
+        ctx = create_bench_context(path, settings=raw.PERFORMANCE_PROFILES["durable"])
+        with ctx.connection:
+            content.create_table(ctx, "bench", enable_hash_search=True)
+            for i in range(args.rows):
+                content.insert_record(ctx, "bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+        ctx.connection.close()
+        for name, deferred in (("file", None), ("mirror", False), ("deferred", True)):
+            if deferred is None:
+                connection = raw.db_connect(path, settings=raw.PERFORMANCE_PROFILES["durable"])
+            else:
+                with Timer() as load_timer:
+                    connection = mirror.db_connect_mirror(path, settings=raw.PERFORMANCE_PROFILES["durable"], deferred=deferred)
+                print(f"{name:9} load {load_timer.seconds * 1000:.1f} ms")
+            mirror_ctx = share.ConnectionContext(connection, ctx.mixer, ctx.hs_hasher)
+            bench_connection(name, mirror_ctx, args.rows, args.count)
+            with Timer() as close_timer:
+                connection.close()
+            print(f"{name:9} close {close_timer.seconds * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
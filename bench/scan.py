@@ -0,0 +1,38 @@
+import argparse
+
+from dataclasses import replace
+
+from app.storage.sql import content, share
+
+from . import create_bench_context, Timer
+from .bloom_insert import fill_table
+
+
+def bench_scan(ctx, table, workers, batch_size):
+    ctx = replace(ctx, scan=share.ScanOptions(workers=workers, batch_size=batch_size))
+    with Timer() as first_timer:
+        rows = content.iterate_with_decryption(ctx, table)
+        count = 1 if next(rows, None) is not None else 0
+    with Timer() as timer:
+        count += sum(1 for _ in rows)
+    total = first_timer.seconds + timer.seconds
+    print(f"workers {workers:2} batch {batch_size or 'auto':>5}: {count / total:10.1f} rows/s, first row {first_timer.seconds * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full table scan throughput with pipelined decryption")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in table")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="Decryption workers to measure")
+    parser.add_argument("--batch-size", type=int, default=0, help="Rows per batch, 0 - adaptive")
+    args = parser.parse_args()
+    ctx = create_bench_context()
+    with ctx.connection:
+        content.create_table(ctx, "bench")
+    fill_table(ctx, "bench", args.rows)
+    for workers in args.workers:
+        bench_scan(ctx, "bench", workers, args.batch_size)
+    ctx.connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import argparse
+
+from app.storage.sql import content, scrub
+
+from . import create_bench_context, Timer
+from .bloom_insert import fill_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Integrity scrub throughput by worker processes count")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in table")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker processes to measure")
+    args = parser.parse_args()
+    ctx = create_bench_context()
+    with ctx.connection:
+        content.create_table(ctx, "bench")
+    fill_table(ctx, "bench", args.rows)
+    path = ctx.connection.execute("PRAGMA database_list").fetchone()["file"]
+    for workers in args.workers:
+        with Timer() as timer:
+            report = scrub.scrub(ctx, path, workers=workers)
+        print(f"workers {workers:2}: {report.rows / timer.seconds:10.1f} rows/s, issues {len(report.issues)}")
+    ctx.connection.close()
+
+
+if __name__ == "__main__":
+    main()
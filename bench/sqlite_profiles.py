@@ -0,0 +1,53 @@
+import random
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.storage.sql import content, raw
+
+from . import create_bench_context, Timer
+
+
+def bench_profile(name, directory, rows, count):
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_", dir=directory) as temp_directory:
+        ctx = create_bench_context(Path(temp_directory, "bench.db"), settings=raw.PERFORMANCE_PROFILES[name])
+        _bench_context(name, ctx, rows, count)
+
+
+def _bench_context(name, ctx, rows, count):
+    with ctx.connection:
+        content.create_table(ctx, "bench", enable_hash_search=True)
+        for i in range(rows):
+            content.insert_record(ctx, "bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+    with Timer() as write_timer:
+        for i in range(count):
+            with ctx.connection:
+                content.insert_record(ctx, "bench", f"new{i}", {"login": "login", "password": "password"})
+    keys = [f"key{random.randrange(rows)}" for _ in range(count)]
+    with Timer() as read_timer:
+        for key in keys:
+            content.get_record(ctx, "bench", key)
+    with Timer() as scan_timer:
+        scanned = sum(1 for _ in content.iterate_with_decryption(ctx, "bench", columns=(content.KEY_COL,)))
+    ctx.connection.close()
+    print(
+        f"{name:10} write {write_timer.seconds * 1000 / count:7.2f} ms/commit, "
+        f"read {read_timer.seconds * 1000 / count:6.3f} ms/get, "
+        f"scan {scanned / scan_timer.seconds:9.1f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write/read latency of sqlite performance profiles on the given disk")
+    parser.add_argument("--dir", type=Path, default=Path.cwd(), help="Directory on the measured disk, default - current directory")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows in table before measurement")
+    parser.add_argument("--count", type=int, default=200, help="Measured commits/gets")
+    parser.add_argument("--profiles", nargs="+", default=list(raw.PERFORMANCE_PROFILES), help="Profiles to measure")
+    args = parser.parse_args()
+    for name in args.profiles:
+        bench_profile(name, args.dir, args.rows, args.count)
+
+
+if __name__ == "__main__":
+    main()
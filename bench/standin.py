@@ -0,0 +1,341 @@
+import json
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import itertools
+
+from pathlib import Path
+from dataclasses import dataclass
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from app.cloud import dropbox
+
+
+IO_BLOCK = 64 * 1024
+
+ERROR = "error" # request is answered with 503 before handling
+DROP = "drop" # request is handled, connection is closed instead of response
+
+
+@dataclass
+class StoredFile:
+    path: Path
+    size: int
+    sha256: str
+    content_hash: str # dropbox content hash
+
+
+class CloudStandIn:
+    """
+    Local HTTP server with the subset of dropbox and yandex disk endpoints the clients use,
+    clients reach it by base_url, files are kept in temporary directory
+    latency - seconds added to every request, bandwidth - bytes per second of every request or response body,
+    error_rate, drop_rate - share of requests failed with ERROR, DROP,
+    faults - {request number from 1: ERROR or DROP} for reproducible failures
+    Used by benchmarks and tests, listens on loopback only
+    """
+
+    def __init__(self, *, latency=0, bandwidth=None, error_rate=0, drop_rate=0, faults=None, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.faults = dict(faults or {})
+        self.random = random.Random(seed)
+        self.directory = Path(tempfile.mkdtemp(prefix="overpass_standin_"))
+        self.files = {} # cloud path -> StoredFile
+        self.sessions = {} # dropbox upload session id -> path of received data
+        self.links = {} # yandex link id -> cloud path
+        self.ids = itertools.count()
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (_Handler,), {"standin": self}))
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_file(self, cloud_path) -> bytes:
+        return self.files[cloud_path].path.read_bytes()
+
+    def next_fault(self):
+        with self.lock:
+            self.requests += 1
+            fault = self.faults.pop(self.requests, None)
+            if fault is None:
+                value = self.random.random()
+                fault = ERROR if value < self.error_rate else DROP if value < self.error_rate + self.drop_rate else None
+            self.failures += fault is not None
+            return fault
+
+    def create_path(self) -> Path:
+        return Path(self.directory, f"{next(self.ids)}.bin")
+
+    def store(self, cloud_path, path) -> StoredFile:
+        sha256, content_hash, size = hashlib.sha256(), dropbox.DropboxContentHasher(), 0
+        with open(path, "rb") as fd:
+            while data := fd.read(IO_BLOCK):
+                sha256.update(data)
+                content_hash.update(data)
+                size += len(data)
+        stored = StoredFile(Path(path), size, sha256.hexdigest(), content_hash.hexdigest())
+        with self.lock:
+            self.files[cloud_path] = stored
+        return stored
+
+    def list_folder(self, folder):
+        """
+        Files directly in folder sorted by name, None for missing folder
+        """
+        folder = folder if folder.endswith("/") else f"{folder}/"
+        with self.lock:
+            found = sorted(
+                (cloud_path.removeprefix(folder), stored) for cloud_path, stored in self.files.items()
+                if cloud_path.startswith(folder) and "/" not in cloud_path.removeprefix(folder)
+            )
+        return found or None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    standin: CloudStandIn = None
+
+    def __init__(self, *args, **kwargs):
+        # NOTE: parent constructor handles requests, state of request is set before it
+        self.query = {}
+        self.dropped = False
+        self.link_id = None
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self._handle("GET")
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self._handle("POST")
+
+    def do_PUT(self): # pylint: disable=invalid-name
+        self._handle("PUT")
+
+    def _handle(self, method):
+        fault = self.standin.next_fault()
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+        url = urlsplit(self.path)
+        self.query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.dropped = fault == DROP
+        if fault == ERROR:
+            self._receive_body(None)
+            self._send_json(503, {"error_summary": "standin/unavailable/", "error": "StandInUnavailable"})
+            return
+        endpoint, self.link_id = url.path.strip("/").replace("/", "_"), None
+        if endpoint.startswith(("upload_", "download_")):
+            endpoint, self.link_id = endpoint.split("_", 1)
+        handler = getattr(self, f"_{method.lower()}_{endpoint}", None)
+        if handler is None:
+            self._receive_body(None)
+            self._send_json(404, {"error_summary": "standin/unknown_endpoint/", "error": "NotFound"})
+            return
+        handler()
+
+    def _receive_body(self, fd):
+        """
+        Body is streamed to fd (dropped if None) at stand-in bandwidth
+        """
+        size = int(self.headers.get("Content-Length", 0))
+        while size > 0:
+            data = self.rfile.read(min(size, IO_BLOCK))
+            if not data:
+                raise ConnectionError("Client closed connection")
+            if fd is not None:
+                fd.write(data)
+            size -= len(data)
+            self._throttle(len(data))
+
+    def _receive_json(self) -> dict:
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "null")
+
+    def _throttle(self, size):
+        if self.standin.bandwidth:
+            time.sleep(size / self.standin.bandwidth)
+
+    def _send_json(self, status, js):
+        if self.dropped:
+            self.close_connection = True
+            return
+        body = json.dumps(js).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, stored: StoredFile):
+        start, end, status = 0, stored.size - 1, 200
+        if (header := self.headers.get("Range", None)) is not None:
+            start, end = (int(value) for value in header.removeprefix("bytes=").split("-"))
+            if not 0 <= start <= end < stored.size:
+                self._send_json(416, {"error_summary": "standin/bad_range/", "error": "BadRange"})
+                return
+            status = 206
+        if self.dropped:
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{stored.size}")
+        self.end_headers()
+        with open(stored.path, "rb") as fd:
+            fd.seek(start)
+            size = end - start + 1
+            while size > 0:
+                data = fd.read(min(size, IO_BLOCK))
+                self.wfile.write(data)
+                size -= len(data)
+                self._throttle(len(data))
+
+    # NOTE: dropbox, api and content hosts share base url
+
+    def _post_oauth2_token(self):
+        self._receive_body(None)
+        self._send_json(200, {"access_token": "standin", "token_type": "bearer", "expires_in": 14400})
+
+    def _post_2_files_upload(self):
+        path = self.standin.create_path()
+        with open(path, "wb") as fd:
+            self._receive_body(fd)
+        self._commit(self._get_dropbox_arg(), path)
+
+    def _post_2_files_upload_session_start(self):
+        session_id, path = f"session{next(self.standin.ids)}", self.standin.create_path()
+        with open(path, "wb") as fd:
+            self._receive_body(fd)
+        self.standin.sessions[session_id] = path
+        self._send_json(200, {"session_id": session_id})
+
+    def _post_2_files_upload_session_append_v2(self):
+        if (error := self._append_session(self._get_dropbox_arg()["cursor"])) is not None:
+            self._send_json(409, {"error_summary": "incorrect_offset/", "error": error})
+            return
+        self._send_json(200, None)
+
+    def _post_2_files_upload_session_finish(self):
+        arg = self._get_dropbox_arg()
+        if (error := self._append_session(arg["cursor"])) is not None:
+            self._send_json(409, {"error_summary": "lookup_failed/incorrect_offset/", "error": {".tag": "lookup_failed", "lookup_failed": error}})
+            return
+        self._commit(arg["commit"], self.standin.sessions.pop(arg["cursor"]["session_id"]))
+
+    def _post_2_files_list_folder(self):
+        self._list_dropbox_folder(self._receive_json()["path"], 0)
+
+    def _post_2_files_list_folder_continue(self):
+        folder, offset = self._receive_json()["cursor"].rsplit("|", 1)
+        self._list_dropbox_folder(folder, int(offset))
+
+    def _post_2_files_download(self):
+        self._receive_body(None)
+        stored = self.standin.files.get(self._get_dropbox_arg()["path"], None)
+        if stored is None:
+            self._send_json(409, {"error_summary": "path/not_found/"})
+            return
+        self._send_file(stored)
+
+    def _get_dropbox_arg(self) -> dict:
+        return json.loads(self.headers["Dropbox-API-Arg"])
+
+    def _append_session(self, cursor):
+        path = self.standin.sessions[cursor["session_id"]]
+        if cursor["offset"] != path.stat().st_size:
+            self._receive_body(None)
+            return {".tag": "incorrect_offset", "correct_offset": path.stat().st_size}
+        with open(path, "ab") as fd:
+            self._receive_body(fd)
+        return None
+
+    def _commit(self, commit, path):
+        if commit["path"] in self.standin.files:
+            self._send_json(409, {"error_summary": "path/conflict/file/.."})
+            return
+        stored = self.standin.store(commit["path"], path)
+        if commit.get("content_hash", stored.content_hash) != stored.content_hash:
+            with self.standin.lock:
+                del self.standin.files[commit["path"]]
+            self._send_json(400, {"error_summary": "content_hash_mismatch/"})
+            return
+        self._send_json(200, {"path_display": commit["path"], "size": stored.size, "content_hash": stored.content_hash})
+
+    def _list_dropbox_folder(self, folder, offset):
+        found = self.standin.list_folder(folder)
+        if found is None and folder:
+            self._send_json(409, {"error_summary": "path/not_found/"})
+            return
+        found = (found or [])[offset:offset + dropbox.LIST_FOLDER_LIMIT]
+        entries = [{".tag": "file", "name": name, "size": stored.size, "content_hash": stored.content_hash} for name, stored in found]
+        has_more = offset + len(found) < len(self.standin.list_folder(folder) or [])
+        self._send_json(200, {"entries": entries, "cursor": f"{folder}|{offset + len(found)}", "has_more": has_more})
+
+    # NOTE: yandex disk, upload and download links point to stand-in too
+
+    def _get_v1_disk_resources(self):
+        found = self.standin.list_folder(self.query["path"])
+        if found is None:
+            self._send_json(404, {"error": "DiskNotFoundError"})
+            return
+        offset, limit = int(self.query.get("offset", 0)), int(self.query.get("limit", 20))
+        items = [{"name": name, "type": "file", "size": stored.size, "sha256": stored.sha256} for name, stored in found[offset:offset + limit]]
+        self._send_json(200, {"_embedded": {"items": items, "total": len(found)}})
+
+    def _get_v1_disk_resources_upload(self):
+        cloud_path = self.query["path"]
+        if cloud_path in self.standin.files and self.query.get("overwrite", "false") == "false":
+            self._send_json(409, {"error": "DiskResourceAlreadyExistsError"})
+            return
+        link_id = str(next(self.standin.ids))
+        self.standin.links[link_id] = cloud_path
+        self._send_json(200, {"href": f"{self.standin.base_url}/upload/{link_id}", "method": "PUT", "templated": False})
+
+    def _put_upload(self):
+        cloud_path = self.standin.links.get(self.link_id, None)
+        if cloud_path is None:
+            self._receive_body(None)
+            self._send_json(404, {"error": "NotFound"})
+            return
+        path = self.standin.create_path()
+        with open(path, "wb") as fd:
+            self._receive_body(fd)
+        self.standin.store(cloud_path, path)
+        self._send_json(201, None)
+
+    def _get_v1_disk_resources_download(self):
+        cloud_path = self.query["path"]
+        if cloud_path not in self.standin.files:
+            self._send_json(404, {"error": "DiskNotFoundError"})
+            return
+        link_id = str(next(self.standin.ids))
+        self.standin.links[link_id] = cloud_path
+        self._send_json(200, {"href": f"{self.standin.base_url}/download/{link_id}", "method": "GET", "templated": False})
+
+    def _get_download(self):
+        cloud_path = self.standin.links.get(self.link_id, None)
+        if cloud_path is None:
+            self._send_json(404, {"error": "NotFound"})
+            return
+        self._send_file(self.standin.files[cloud_path])
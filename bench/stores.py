@@ -0,0 +1,66 @@
+import random
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from app.storage.store import SqlRecordStore
+from app.storage.log.store import LogRecordStore
+
+from . import create_bench_context, create_bench_mixer, Timer
+
+
+ENGINES = {
+    "sql": lambda path: SqlRecordStore(create_bench_context(Path(path, "bench.db"))),
+    "log": lambda path: LogRecordStore.create(Path(path, "bench.log"), create_bench_mixer()),
+}
+
+
+def bench_engine(name, directory, rows, count, group):
+    with tempfile.TemporaryDirectory(prefix="overpass_bench_", dir=directory) as temp_directory:
+        with ENGINES[name](temp_directory) as store:
+            _bench_store(name, store, rows, count, group)
+
+
+def _bench_store(name, store, rows, count, group):
+    store.create_table("bench", hash_search=True)
+    with Timer() as fill_timer, store.transaction():
+        for i in range(rows):
+            store.insert("bench", f"key{i}", {"login": f"login{i}", "password": f"password{i}"})
+    with Timer() as write_timer:
+        for i in range(count):
+            store.update("bench", f"key{i % rows}", {"password": "changed"})
+    with Timer() as group_timer:
+        for i in range(0, count, group):
+            with store.transaction():
+                for j in range(i, min(i + group, count)):
+                    store.insert("bench", f"new{j}", {"login": "login", "password": "password"})
+    keys = [f"key{random.randrange(rows)}" for _ in range(count)]
+    with Timer() as read_timer:
+        for key in keys:
+            store.get("bench", key)
+    with Timer() as scan_timer:
+        scanned = sum(1 for _ in store.iterate("bench"))
+    print(
+        f"{name:4} fill {rows / fill_timer.seconds:9.1f} rows/s, "
+        f"write {write_timer.seconds * 1000 / count:7.2f} ms/commit, "
+        f"group {group_timer.seconds * 1000 / count:7.3f} ms/row, "
+        f"read {read_timer.seconds * 1000 / count:6.3f} ms/get, "
+        f"scan {scanned / scan_timer.seconds:9.1f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Same workload on every record store engine")
+    parser.add_argument("--dir", type=Path, default=Path.cwd(), help="Directory on the measured disk, default - current directory")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows in table before measurement")
+    parser.add_argument("--count", type=int, default=200, help="Measured commits/gets")
+    parser.add_argument("--group", type=int, default=50, help="Rows per commit in group commit measurement")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), help="Engines to measure")
+    args = parser.parse_args()
+    for name in args.engines:
+        bench_engine(name, args.dir, args.rows, args.count, args.group)
+
+
+if __name__ == "__main__":
+    main()
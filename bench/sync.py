@@ -0,0 +1,30 @@
+import argparse
+
+from app.storage.sql import content, sync
+
+from . import create_bench_context, Timer
+from .bloom_insert import fill_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync of two vaults differing in a few rows")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in each vault")
+    parser.add_argument("--changes", type=int, default=10, help="Changed rows in source")
+    args = parser.parse_args()
+    src, dst = create_bench_context(), create_bench_context()
+    for ctx in (src, dst):
+        with ctx.connection:
+            content.create_table(ctx, "bench")
+        fill_table(ctx, "bench", args.rows)
+    with src.connection:
+        for i in range(args.changes):
+            content.update_record(src, "bench", f"key{i * (args.rows // args.changes)}", {"password": "changed"})
+    with Timer() as timer, dst.connection:
+        result = sync.sync_table(src, dst, "bench")
+    print(f"sync: {timer.seconds:.2f} s, updated {result.updated}, buckets differ {result.diff_buckets}/{result.total_buckets}")
+    src.connection.close()
+    dst.connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
+import tempfile
 import unittest
 
 from pathlib import Path
 from typing import Union, List
 
+from app import config
+
 
 def fill_test_suite(src: Union[unittest.TestCase, unittest.TestSuite], dst: unittest.TestSuite, pattern: List[str]):
     if isinstance(src, unittest.TestSuite):
@@ -16,6 +19,19 @@ def fill_test_suite(src: Union[unittest.TestCase, unittest.TestSuite], dst: unit
 
 
 def run(args) -> int:
+    """
+    Tests write databases, snapshots and cloud state into temporary db_directory removed after run
+    """
+    db_directory = config.curconfig.db_directory
+    with tempfile.TemporaryDirectory(prefix="overpass_test_") as temp_directory:
+        config.curconfig.db_directory = Path(temp_directory)
+        try:
+            return _run(args)
+        finally:
+            config.curconfig.db_directory = db_directory
+
+
+def _run(args) -> int:
     test_loader = unittest.TestLoader()
     project_dir = Path(__file__).parent.parent
     test_package = project_dir.joinpath("test")
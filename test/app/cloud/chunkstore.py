@@ -0,0 +1,123 @@
+import time
+import shutil
+import threading
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import chunkstore
+from app.cloud.cloud import LocalCloud
+from app.cloud.share import CloudError
+
+
+class ChunkStoreTests(TestCase):
+
+    def setUp(self):
+        self.directory = Path(config.curconfig.db_directory, "__test_chunkstore")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self.store = LocalCloud(Path(self.directory, "store"))
+        self.index_path = Path(self.directory, "index", "chunk_index.json")
+        self.path = Path(self.directory, "file.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _backup(self, content, manifest_name):
+        self.path.write_bytes(content)
+        return chunkstore.backup(self.store, [(self.path, "file.bin")], self.index_path, manifest_name, options=chunkstore.ChunkOptions(16 * 4096))
+
+    def test_0(self):
+        pages = [random_bytes(4096) for _ in range(300)]
+        self.path.write_bytes(b"".join(pages))
+        chunks = list(chunkstore.iterate_chunks(self.path, chunk_size=16 * 4096))
+        self.assertEqual(b"".join(chunk.data for chunk in chunks), b"".join(pages))
+        self.assertTrue(all(4 * 4096 <= len(chunk.data) <= 64 * 4096 for chunk in chunks[:-1]))
+        # NOTE: boundaries follow content, pages inserted in the middle change only chunks around them
+        self.path.write_bytes(b"".join(pages[:150] + [random_bytes(4096) for _ in range(3)] + pages[150:]))
+        digests = {chunk.digest for chunk in chunks}
+        changed = [chunk for chunk in chunkstore.iterate_chunks(self.path, chunk_size=16 * 4096) if chunk.digest not in digests]
+        self.assertLessEqual(len(changed), 2)
+
+    def test_1(self):
+        content = bytearray(random_bytes(200 * 4096))
+        first = self._backup(bytes(content), "1.manifest")
+        self.assertEqual((first.uploaded, first.size), (first.chunks, len(content)))
+        content[100 * 4096:100 * 4096 + 10] = b"x" * 10
+        second = self._backup(bytes(content), "2.manifest")
+        # NOTE: changed page may also become or stop being chunk boundary
+        self.assertLessEqual(second.uploaded, 2)
+        self.assertLessEqual(abs(second.chunks - first.chunks), 1)
+        restored_path = Path(self.directory, "restored.bin")
+        for name, expected in (("1.manifest", first), ("2.manifest", second)):
+            manifest = chunkstore.read_manifest(Path(self.store.directory, name))
+            chunkstore.restore_file(manifest["files"][0], self.store.directory, restored_path)
+            self.assertEqual(restored_path.stat().st_size, expected.size)
+        self.assertEqual(restored_path.read_bytes(), bytes(content))
+
+    def test_2(self):
+        content = random_bytes(50 * 4096)
+        first = self._backup(content, "1.manifest")
+        # NOTE: lost index is rebuilt from store listing, nothing is uploaded again
+        self.index_path.unlink()
+        self.assertEqual(self._backup(content, "2.manifest").uploaded, 0)
+        self.assertEqual(chunkstore.read_index_file(self.index_path, "other"), None)
+        # NOTE: stale index, chunks already at store are not an error
+        chunkstore.write_index_file(self.index_path, self.store.destination, [])
+        self.assertEqual(self._backup(content, "3.manifest").uploaded, 0)
+        manifest = chunkstore.read_manifest(Path(self.store.directory, "3.manifest"))
+        digest = manifest["files"][0]["chunks"][0][0]
+        Path(self.store.directory, chunkstore.get_chunk_filename(digest)).write_bytes(b"broken")
+        restored_path = Path(self.directory, "restored.bin")
+        self.assertRaises(CloudError, chunkstore.restore_file, manifest["files"][0], self.store.directory, restored_path)
+        self.assertFalse(restored_path.exists())
+        self.assertEqual(len(list(self.store.directory.glob("*.manifest"))), 3)
+        self.assertEqual(first.uploaded, first.chunks)
+
+    def test_3(self):
+        content = b"".join(random_bytes(2048) + bytes(2048) for _ in range(64))
+        self.path.write_bytes(content)
+        chunkstore.backup(self.store, [(self.path, "file.bin")], self.index_path, "1.manifest", options=chunkstore.ChunkOptions(16 * 4096))
+        result = chunkstore.backup(self.store, [(self.path, "file.bin")], self.index_path, "2.manifest", options=chunkstore.ChunkOptions(16 * 4096, "zlib"))
+        # NOTE: plain chunks are not reused by compressed backup
+        self.assertEqual(result.uploaded, result.chunks)
+        self.assertLess(result.uploaded_bytes, 0.6 * len(content))
+        manifest = chunkstore.read_manifest(Path(self.store.directory, "2.manifest"))
+        restored_path = Path(self.directory, "restored.bin")
+        chunkstore.restore_file(manifest["files"][0], self.store.directory, restored_path, compression=manifest["compression"])
+        self.assertEqual(restored_path.read_bytes(), content)
+
+    def test_4(self):
+        content = random_bytes(100 * 4096)
+        self.path.write_bytes(content)
+        lock, active, uploads = threading.Lock(), [0, 0], []
+        upload_file = self.store.upload_file
+
+        def upload(local_path, cloud_filename):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+                uploads.append(cloud_filename)
+            if len(uploads) == 5:
+                raise CloudError("Service unavailable")
+            upload_file(local_path, cloud_filename)
+
+        # NOTE: failed chunk and chunks after it are not in index, next backup uploads them
+        with mock.patch.object(self.store, "upload_file", upload):
+            self.assertRaises(CloudError, chunkstore.backup, self.store, [(self.path, "file.bin")], self.index_path, "1.manifest", options=chunkstore.ChunkOptions(4 * 4096))
+        self.assertGreater(active[1], 1)
+        present = chunkstore.read_index_file(self.index_path, self.store.destination)
+        self.assertEqual(present, {path.name for path in self.store.directory.iterdir()})
+        self.assertEqual(list(self.directory.glob("index/tmp*")), [])
+        result = chunkstore.backup(self.store, [(self.path, "file.bin")], self.index_path, "2.manifest", options=chunkstore.ChunkOptions(4 * 4096))
+        self.assertEqual(result.uploaded, result.chunks - len(present))
+        manifest = chunkstore.read_manifest(Path(self.store.directory, "2.manifest"))
+        restored_path = Path(self.directory, "restored.bin")
+        chunkstore.restore_file(manifest["files"][0], self.store.directory, restored_path)
+        self.assertEqual(restored_path.read_bytes(), content)
@@ -0,0 +1,49 @@
+import shutil
+
+from unittest import TestCase
+from pathlib import Path
+
+from utils.common import random_bytes
+from utils.encoding import compress_bytes, decompress_bytes
+
+from app import config
+from app.cloud import compress
+from app.cloud.share import CloudError
+
+
+class CompressTests(TestCase):
+
+    def setUp(self):
+        self.directory = Path(config.curconfig.db_directory, "__test_compress")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self.path = Path(self.directory, "file.db")
+        # NOTE: more than one read block, half of content compresses
+        self.content = b"".join(random_bytes(512) + bytes(512) for _ in range(3000))
+        self.path.write_bytes(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_0(self):
+        for codec in ("lzma", "zlib"):
+            compressed_path = Path(compress.get_compressed_filename(str(self.path), codec))
+            result = compress.compress_file(self.path, compressed_path, codec, level=1)
+            self.assertEqual(result.size, len(self.content))
+            self.assertEqual(result.compressed_size, compressed_path.stat().st_size)
+            self.assertLess(result.compressed_size, 0.6 * len(self.content))
+            self.assertEqual(compress.get_codec(compressed_path), codec)
+            restored_path = Path(self.directory, "restored.db")
+            compress.decompress_file(compressed_path, restored_path)
+            self.assertEqual(restored_path.read_bytes(), self.content)
+        self.assertIsNone(compress.get_codec(self.path))
+
+    def test_1(self):
+        for codec in ("lzma", "zlib"):
+            data = compress_bytes(self.content, compress.create_compressor(codec))
+            self.assertEqual(decompress_bytes(data, compress.create_decompressor(codec)), self.content)
+            self.assertRaises(ValueError, decompress_bytes, data[:len(data) // 2], compress.create_decompressor(codec))
+            self.assertRaises(compress.CODEC_ERRORS, decompress_bytes, b"x" * 100, compress.create_decompressor(codec))
+            truncated_path = Path(self.directory, "truncated")
+            truncated_path.write_bytes(data[:-10])
+            self.assertRaises(CloudError, compress.decompress_file, truncated_path, Path(self.directory, "out"), codec)
@@ -0,0 +1,110 @@
+import time
+import random
+import hashlib
+import threading
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+import requests
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import share
+from app.cloud.share import CloudError
+
+
+class FakeRangeResponse:
+
+    def __init__(self, status_code, body=b""):
+        self.status_code = status_code
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRangeServer:
+    """
+    Serves ranges of content with random delays, script gives answers to first requests of parts by part start
+    """
+
+    def __init__(self, content, script=None, *, ignore_range=False):
+        self.content = content
+        self.script = {start: list(answers) for start, answers in (script or {}).items()}
+        self.ignore_range = ignore_range
+        self.requests = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def __call__(self, start, end):
+        with self.lock:
+            self.requests.append((start, end))
+            answers = self.script.get(start, [])
+            answer = answers.pop(0) if answers else None
+        time.sleep(random.uniform(0, 0.01))
+        if isinstance(answer, Exception):
+            raise answer
+        if self.ignore_range:
+            response = FakeRangeResponse(200, self.content)
+        elif answer == "short":
+            response = FakeRangeResponse(206, self.content[start:end])
+        else:
+            response = FakeRangeResponse(answer or 206, self.content[start:end + 1])
+        with self.lock:
+            self.responses.append(response)
+        return response
+
+
+class DownloadRangesTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_download.bin")
+        self.content = random_bytes(10 * 1000 + 5)
+
+    def tearDown(self):
+        self.path.unlink(missing_ok=True)
+
+    def _download(self, server, *, content_hash=None, part_size=1000):
+        with mock.patch.object(share.time, "sleep"):
+            options = share.DownloadOptions(
+                len(self.content), content_hash or hashlib.sha256(self.content).hexdigest(), workers=4, part_size=part_size
+            )
+            share.download_ranges(server, self.path, options, hasher=hashlib.sha256())
+
+    def test_0(self):
+        server = FakeRangeServer(self.content)
+        self._download(server)
+        self.assertEqual(self.path.read_bytes(), self.content)
+        self.assertEqual(sorted(server.requests), [(start, min(start + 1000, len(self.content)) - 1) for start in range(0, len(self.content), 1000)])
+        self.assertTrue(all(response.closed for response in server.responses))
+        share.download_ranges(server, self.path, share.DownloadOptions(0, hashlib.sha256().hexdigest()), hasher=hashlib.sha256())
+        self.assertEqual(self.path.read_bytes(), b"")
+
+    def test_1(self):
+        # NOTE: failed part is fetched again, other parts are not repeated
+        lost = CloudError("Connection lost", original_exception=requests.ConnectionError())
+        server = FakeRangeServer(self.content, {0: [503, "short"], 5000: [lost], 10000: [429]})
+        self._download(server)
+        self.assertEqual(self.path.read_bytes(), self.content)
+        self.assertEqual(len(server.requests), 11 + 4)
+        server = FakeRangeServer(self.content, {3000: [503] * share.PART_ATTEMPTS})
+        self.assertRaises(CloudError, self._download, server)
+        self.assertFalse(self.path.exists())
+
+    def test_2(self):
+        self.assertRaises(CloudError, self._download, FakeRangeServer(self.content), content_hash="0" * 64)
+        self.assertFalse(self.path.exists())
+        server = FakeRangeServer(self.content, {0: [404]})
+        self.assertRaises(CloudError, self._download, server)
+        self.assertFalse(self.path.exists())
+        # NOTE: range ignored by server is accepted only for single part download
+        self.assertRaises(CloudError, self._download, FakeRangeServer(self.content, ignore_range=True))
+        self._download(FakeRangeServer(self.content, ignore_range=True), part_size=len(self.content))
+        self.assertEqual(self.path.read_bytes(), self.content)
@@ -0,0 +1,177 @@
+import json
+import hashlib
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import share, dropbox
+from app.cloud.share import CloudError
+
+from .download import FakeRangeResponse
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, js=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(js) if js is not None else ""
+        self.headers = headers or {}
+
+
+class FakeDropbox:
+    """
+    Upload endpoints of dropbox content api, drops chosen responses after handling request
+    """
+
+    def __init__(self, lose_responses=(), busy_responses=()):
+        self.sessions = {}
+        self.files = {}
+        self.lose_responses = list(lose_responses)
+        self.busy_responses = list(busy_responses)
+        self.requests = 0
+
+    def __call__(self, method, url, *, data, headers, **_):
+        assert method == "POST"
+        self.requests += 1
+        endpoint = url.removeprefix(f"{dropbox.CONTENT_URL}/")
+        arg = json.loads(headers["Dropbox-API-Arg"])
+        if self.requests in self.busy_responses:
+            return FakeResponse(429, {"error_summary": "too_many_requests/.."}, {"Retry-After": "7"})
+        response = getattr(self, endpoint.replace("/", "_"))(arg, data)
+        if self.requests in self.lose_responses:
+            raise CloudError("Connection lost")
+        return response
+
+    def upload(self, arg, data):
+        return self._commit(arg, data)
+
+    def upload_session_start(self, _, data):
+        session_id = f"s{len(self.sessions)}"
+        self.sessions[session_id] = bytearray(data)
+        return FakeResponse(200, {"session_id": session_id})
+
+    def upload_session_append_v2(self, arg, data):
+        error = self._check_cursor(arg["cursor"])
+        if error is not None:
+            return FakeResponse(409, {"error_summary": "incorrect_offset/..", "error": error})
+        self.sessions[arg["cursor"]["session_id"]] += data
+        return FakeResponse(200, None)
+
+    def upload_session_finish(self, arg, data):
+        error = self._check_cursor(arg["cursor"])
+        if error is not None:
+            return FakeResponse(409, {"error_summary": "lookup_failed/incorrect_offset/..", "error": {".tag": "lookup_failed", "lookup_failed": error}})
+        content = self.sessions.pop(arg["cursor"]["session_id"]) + data
+        return self._commit(arg["commit"], content)
+
+    def _check_cursor(self, cursor):
+        content = self.sessions[cursor["session_id"]]
+        if cursor["offset"] != len(content):
+            return {".tag": "incorrect_offset", "correct_offset": len(content)}
+        return None
+
+    def _commit(self, commit, content):
+        if commit["content_hash"] != _reference_hash(bytes(content)):
+            return FakeResponse(400, {"error_summary": "content_hash_mismatch/"})
+        self.files[commit["path"]] = bytes(content)
+        return FakeResponse(200, {"path_display": commit["path"]})
+
+
+def _reference_hash(content: bytes) -> str:
+    blocks = [content[i:i + dropbox.BLOCK_SIZE] for i in range(0, len(content), dropbox.BLOCK_SIZE)]
+    return hashlib.sha256(b"".join(hashlib.sha256(block).digest() for block in blocks)).hexdigest()
+
+
+class DropboxUploadTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_dropbox_upload.bin")
+        self.client = dropbox.Dropbox("refresh")
+        self.client.access_token = "access"
+        self.sleeps = []
+
+    def tearDown(self):
+        self.path.unlink(missing_ok=True)
+
+    def _upload(self, content, server):
+        self.path.write_bytes(content)
+        with mock.patch.object(dropbox, "make_request", server), mock.patch.object(share.time, "sleep") as sleep:
+            self.client.upload_file("/vault.db", self.path, chunk_size=dropbox.BLOCK_SIZE)
+        self.sleeps = [call.args[0] for call in sleep.call_args_list]
+        return server.files["/vault.db"]
+
+    def test_0(self):
+        hasher = dropbox.DropboxContentHasher()
+        content = random_bytes(dropbox.BLOCK_SIZE + 100)
+        for i in range(0, len(content), 1000003):
+            hasher.update(content[i:i + 1000003])
+        self.assertEqual(hasher.hexdigest(), _reference_hash(content))
+        self.assertEqual(dropbox.Dropbox.calculate_dropbox_hash(b""), _reference_hash(b""))
+
+    def test_1(self):
+        content = random_bytes(1000)
+        server = FakeDropbox()
+        self.assertEqual(self._upload(content, server), content)
+        self.assertEqual(server.requests, 1)
+        content = random_bytes(2 * dropbox.BLOCK_SIZE + 5)
+        server = FakeDropbox()
+        self.assertEqual(self._upload(content, server), content)
+        self.assertEqual(server.requests, 3)
+
+    def test_2(self):
+        content = random_bytes(3 * dropbox.BLOCK_SIZE)
+        # NOTE: appended chunk response is lost, next attempt learns acknowledged offset from dropbox
+        server = FakeDropbox(lose_responses=(2, 3))
+        self.assertEqual(self._upload(content, server), content)
+        server = FakeDropbox(lose_responses=(2, 3, 4))
+        self.assertRaises(CloudError, self._upload, content, server)
+        # NOTE: throttled requests are repeated after delay from Retry-After
+        server = FakeDropbox(busy_responses=(1, 3))
+        self.assertEqual(self._upload(content, server), content)
+        self.assertEqual(server.requests, 3 + 2)
+        self.assertEqual(self.sleeps, [7, 7])
+
+    def test_3(self):
+        pages = {None: (["a", "b"], "c1"), "c1": (["c"], None)}
+        calls = []
+
+        def server(method, url, *, json, headers, **_):
+            calls.append((method, url, json))
+            if url.endswith("/list_folder") and json["path"] == "/missing":
+                return FakeResponse(409, {"error_summary": "path/not_found/.."})
+            names, cursor = pages[json.get("cursor", None)]
+            entries = [{".tag": "file", "name": name} for name in names] + [{".tag": "folder", "name": "sub"}]
+            return FakeResponse(200, {"entries": entries, "cursor": cursor, "has_more": cursor is not None})
+
+        with mock.patch.object(share, "make_request", server):
+            self.assertEqual([cloud_file.name for cloud_file in self.client.list_folder("/backup/")], ["a", "b", "c"])
+            self.assertEqual(self.client.list_folder("/missing"), [])
+        self.assertEqual(calls[0], ("POST", f"{dropbox.API_URL}/list_folder", {"path": "/backup", "limit": dropbox.LIST_FOLDER_LIMIT}))
+        self.assertEqual(calls[1][1:], (f"{dropbox.API_URL}/list_folder/continue", {"cursor": "c1"}))
+        server = FakeDropbox()
+        server.files["/vault.db"] = b""
+        server.upload = lambda arg, data: FakeResponse(409, {"error_summary": "path/conflict/file/.."})
+        self.assertRaises(dropbox.CloudConflictError, self._upload, b"content", server)
+
+    def test_4(self):
+        content = random_bytes(2 * dropbox.BLOCK_SIZE + 5)
+
+        def server(method, url, *, headers, stream, **_):
+            assert (method, url, stream) == ("POST", f"{dropbox.CONTENT_URL}/download", True)
+            assert json.loads(headers["Dropbox-API-Arg"]) == {"path": "/vault.db"}
+            start, end = map(int, headers["Range"].removeprefix("bytes=").split("-"))
+            return FakeRangeResponse(206, content[start:end + 1])
+
+        with mock.patch.object(dropbox, "make_request", server):
+            self.client.download_file(
+                "/vault.db", self.path, share.DownloadOptions(len(content), _reference_hash(content), part_size=dropbox.BLOCK_SIZE)
+            )
+            self.assertEqual(self.path.read_bytes(), content)
+            self.assertRaises(
+                CloudError, self.client.download_file, "/vault.db", self.path,
+                share.DownloadOptions(len(content), _reference_hash(b""), part_size=dropbox.BLOCK_SIZE)
+            )
+        self.assertFalse(self.path.exists())
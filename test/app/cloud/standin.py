@@ -0,0 +1,105 @@
+import time
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import cloud, share, dropbox, yandex_disk
+from app.cloud.share import CloudError
+
+from bench.standin import CloudStandIn, ERROR, DROP
+
+
+class CloudStandInTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_standin.bin")
+        self.downloaded_path = Path(config.curconfig.db_directory, "__test_standin_downloaded.bin")
+
+    def tearDown(self):
+        self.path.unlink(missing_ok=True)
+        self.downloaded_path.unlink(missing_ok=True)
+
+    def _create_dropbox(self, standin):
+        return dropbox.Dropbox("refresh", update_access_token=True, session=share.create_session(), base_url=standin.base_url)
+
+    def _create_yandex_disk(self, standin):
+        return yandex_disk.YandexDisk("token", session=share.create_session(), base_url=standin.base_url)
+
+    def _check_download(self, client, cloud_path, content, **kwargs):
+        cloud_file, = client.list_folder("/backup/" if cloud_path.startswith("/") else "app:/backup/")
+        self.assertEqual((cloud_file.name, cloud_file.size), (Path(cloud_path).name, len(content)))
+        client.download_file(cloud_path, self.downloaded_path, share.DownloadOptions(cloud_file.size, cloud_file.content_hash, **kwargs))
+        self.assertEqual(self.downloaded_path.read_bytes(), content)
+
+    def test_0(self):
+        content = random_bytes(2 * dropbox.BLOCK_SIZE + 5)
+        self.path.write_bytes(content)
+        with CloudStandIn() as standin:
+            client = self._create_dropbox(standin)
+            self.assertEqual(client.access_token, "standin")
+            self.assertEqual(client.list_folder("/backup/"), [])
+            client.upload_file("/backup/vault.db", self.path, chunk_size=dropbox.BLOCK_SIZE)
+            self.assertEqual(standin.requests, 1 + 1 + 3)
+            self.assertEqual(standin.read_file("/backup/vault.db"), content)
+            self.assertRaises(dropbox.CloudConflictError, client.upload_file, "/backup/vault.db", self.path)
+            self._check_download(client, "/backup/vault.db", content, part_size=dropbox.BLOCK_SIZE)
+
+    def test_1(self):
+        content = random_bytes(100000)
+        self.path.write_bytes(content)
+        with CloudStandIn() as standin:
+            client = self._create_yandex_disk(standin)
+            self.assertEqual(client.list_folder("app:/backup/"), [])
+            client.upload_file("app:/backup/vault.db", self.path)
+            self.assertEqual(standin.read_file("app:/backup/vault.db"), content)
+            self.assertRaises(yandex_disk.CloudConflictError, client.upload_file, "app:/backup/vault.db", self.path)
+            self._check_download(client, "app:/backup/vault.db", content, part_size=30000)
+
+    def test_2(self):
+        content = random_bytes(3 * dropbox.BLOCK_SIZE)
+        self.path.write_bytes(content)
+        # NOTE: lost append response is recovered from offset reported by dropbox, failed download part is fetched again
+        with mock.patch.object(share.time, "sleep"), CloudStandIn(faults={3: DROP, 4: ERROR, 8: DROP}) as standin:
+            client = self._create_dropbox(standin)
+            client.upload_file("/backup/vault.db", self.path, chunk_size=dropbox.BLOCK_SIZE)
+            self.assertEqual(standin.read_file("/backup/vault.db"), content)
+            self._check_download(client, "/backup/vault.db", content, part_size=dropbox.BLOCK_SIZE)
+            self.assertEqual(standin.failures, 3)
+        with mock.patch.object(share.time, "sleep"), CloudStandIn(faults={2: DROP, 3: ERROR}) as standin:
+            client = self._create_yandex_disk(standin)
+            client.upload_file("app:/backup/vault.db", self.path)
+            self.assertEqual(standin.read_file("app:/backup/vault.db"), content)
+        with mock.patch.object(share.time, "sleep"), CloudStandIn(error_rate=1) as standin:
+            self.assertRaises(CloudError, self._create_dropbox, standin)
+
+    def test_3(self):
+        content = random_bytes(200000)
+        self.path.write_bytes(content)
+        with CloudStandIn(latency=0.05, bandwidth=10 ** 6) as standin:
+            client = self._create_yandex_disk(standin)
+            begin = time.monotonic()
+            client.upload_file("app:/backup/vault.db", self.path)
+            self.assertGreaterEqual(time.monotonic() - begin, 2 * 0.05 + 0.2)
+
+    def test_4(self):
+        content = random_bytes(1000)
+        self.path.write_bytes(content)
+        token_path = Path(config.curconfig.db_directory, "__test_standin_token.txt")
+        token_path.write_text("refresh", encoding="utf-8")
+        cfg = config.create_minimal_config(config.curconfig.db_directory)
+        cfg.set_entry("/backup/", "cloud.dropbox.upload_directory")
+        cfg.set_entry(str(token_path), "cloud.dropbox.refresh_token_path")
+        cfg.set_entry("standin", "cloud.dropbox.base_url")
+        self.assertRaises(config.ConfigError, cfg.cloud.dropbox.check)
+        with CloudStandIn() as standin, mock.patch.object(config, "curconfig", cfg):
+            cfg.set_entry(standin.base_url, "cloud.dropbox.base_url")
+            cfg.cloud.dropbox.check()
+            instance = cloud.DropboxCloud()
+            instance.upload_file(self.path, "vault.db")
+            cloud_file, = instance.list_files()
+            instance.download_file(cloud_file, self.downloaded_path)
+        token_path.unlink()
+        self.assertEqual(self.downloaded_path.read_bytes(), content)
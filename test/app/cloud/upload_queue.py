@@ -0,0 +1,110 @@
+import time
+import threading
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+from app import config
+from app.cloud import upload_queue
+from app.cloud.share import CloudError
+
+
+class FakeUploader:
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.uploads = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, path, service):
+        self.release.wait()
+        if (path, service) in self.fail:
+            raise CloudError("Service unavailable")
+        self.uploads.append((path, service))
+
+
+class UploadQueueTests(TestCase):
+
+    def setUp(self):
+        self.queue_path = Path(config.curconfig.db_directory, "__test_upload_queue.json")
+        self.queue_path.unlink(missing_ok=True)
+        self.results = []
+
+    def tearDown(self):
+        self.queue_path.unlink(missing_ok=True)
+
+    def _create_queue(self, uploader, delay):
+
+        def notify(job, error):
+            self.results.append((job.key, error))
+
+        return upload_queue.UploadQueue(uploader, self.queue_path, delay=delay, notify=notify)
+
+    def test_0(self):
+        uploader = FakeUploader()
+        queue = self._create_queue(uploader, 0.3)
+        for _ in range(3):
+            queue.enqueue("a.db", "dropbox")
+            time.sleep(0.1)
+        queue.enqueue("a.db", "yandex_disk")
+        self.assertEqual(queue.pending(), 2)
+        time.sleep(0.6)
+        self.assertEqual(sorted(uploader.uploads), [(Path("a.db"), "dropbox"), (Path("a.db"), "yandex_disk")])
+        # NOTE: close starts delayed jobs at once
+        queue.enqueue("b.db", "dropbox", delay=3600)
+        self.assertEqual(queue.close(5), 0)
+        self.assertEqual(uploader.uploads[-1], (Path("b.db"), "dropbox"))
+        self.assertFalse(self.queue_path.exists())
+
+    def test_1(self):
+        uploader = FakeUploader(fail=[(Path("a.db"), "dropbox")])
+        queue = self._create_queue(uploader, 0)
+        queue.enqueue("a.db", "dropbox")
+        queue.enqueue("b.db", "dropbox")
+        self.assertEqual(queue.close(5), 0)
+        self.assertIsInstance(dict(self.results)[(Path("a.db"), "dropbox")], CloudError)
+        self.assertEqual(upload_queue.read_queue_file(self.queue_path), [(Path("a.db"), "dropbox")])
+        uploader.fail.clear()
+        queue = self._create_queue(uploader, 3600)
+        self.assertEqual(queue.resume(), 1)
+        self.assertEqual(queue.close(5), 0)
+        self.assertEqual(uploader.uploads[-1], (Path("a.db"), "dropbox"))
+        self.assertFalse(self.queue_path.exists())
+
+    def test_2(self):
+        uploader = FakeUploader()
+        uploader.release.clear()
+        queue = self._create_queue(uploader, 0)
+        queue.enqueue("a.db", "dropbox")
+        queue.enqueue("b.db", "dropbox")
+        self.assertEqual(queue.close(0.2), 2)
+        self.assertEqual(sorted(upload_queue.read_queue_file(self.queue_path)), [(Path("a.db"), "dropbox"), (Path("b.db"), "dropbox")])
+        uploader.release.set()
+
+    def test_3(self):
+        uploader = FakeUploader()
+        broken = {(Path("a.db"), "dropbox")}
+
+        def upload(path, service):
+            if (path, service) in broken:
+                raise KeyError("bug")
+            uploader(path, service)
+
+        # NOTE: unexpected error is reported as failed upload, queue keeps working
+        queue = self._create_queue(upload, 0)
+        queue.enqueue("a.db", "dropbox")
+        queue.enqueue("b.db", "dropbox")
+        self.assertEqual(queue.close(5), 0)
+        self.assertIsInstance(dict(self.results)[(Path("a.db"), "dropbox")], KeyError)
+        self.assertEqual(uploader.uploads, [(Path("b.db"), "dropbox")])
+        self.assertEqual(upload_queue.read_queue_file(self.queue_path), [(Path("a.db"), "dropbox")])
+        # NOTE: thread broken by notify is replaced for jobs left in queue
+        queue = upload_queue.UploadQueue(uploader, self.queue_path, delay=0, notify=lambda job, error: 1 / 0)
+        with mock.patch.object(threading, "excepthook"):
+            queue.enqueue("c.db", "dropbox")
+            queue.enqueue("d.db", "dropbox")
+            self.assertEqual(queue.close(5), 0)
+        self.assertIsNone(queue.thread)
+        self.assertEqual(queue.pending(), 0)
+        self.assertEqual(uploader.uploads[1:], [(Path("c.db"), "dropbox"), (Path("d.db"), "dropbox")])
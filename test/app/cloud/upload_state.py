@@ -0,0 +1,45 @@
+import shutil
+import hashlib
+
+from unittest import TestCase
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import dropbox, upload_state
+
+
+class UploadStateTests(TestCase):
+
+    def setUp(self):
+        self.directory = Path(config.curconfig.db_directory, "__test_upload_state")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.path = upload_state.get_state_path(self.directory, "dbid", "dropbox")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_0(self):
+        state = upload_state.read_state(self.path, "dropbox:/a/")
+        self.assertFalse(state.is_uploaded(10, "hash"))
+        for i in range(upload_state.HISTORY_LIMIT + 5):
+            record = upload_state.UploadRecord(upload_state.get_time_str(), 10, 0, f"hash{i}", 5, 0.5)
+            upload_state.record_upload(self.path, state, record)
+        state = upload_state.read_state(self.path, "dropbox:/a/")
+        self.assertEqual(len(state.history), upload_state.HISTORY_LIMIT)
+        self.assertEqual(state.history[-1].throughput, 10)
+        self.assertTrue(state.is_uploaded(10, f"hash{upload_state.HISTORY_LIMIT + 4}"))
+        self.assertFalse(state.is_uploaded(11, f"hash{upload_state.HISTORY_LIMIT + 4}"))
+        self.assertEqual(upload_state.read_state(self.path, "dropbox:/b/").history, [])
+        self.assertEqual(len(upload_state.read_state(self.path).history), upload_state.HISTORY_LIMIT)
+        self.assertEqual([upload_state.get_state_key(path) for path in upload_state.iterate_state_paths(self.directory, "dbid")], ["dropbox"])
+
+    def test_1(self):
+        self.directory.mkdir(parents=True)
+        paths = [Path(self.directory, "a"), Path(self.directory, "b")]
+        content = random_bytes(dropbox.BLOCK_SIZE + 10)
+        paths[0].write_bytes(content[:100])
+        paths[1].write_bytes(content[100:])
+        self.assertEqual(upload_state.calculate_hash(paths, hashlib.sha256()), hashlib.sha256(content).hexdigest())
+        self.assertEqual(upload_state.calculate_hash(paths, dropbox.DropboxContentHasher()), dropbox.Dropbox.calculate_dropbox_hash(content))
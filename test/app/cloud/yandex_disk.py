@@ -0,0 +1,144 @@
+import json
+import hashlib
+
+from unittest import TestCase, mock
+from pathlib import Path
+
+import requests
+
+from utils.common import random_bytes
+
+from app import config
+from app.cloud import share, yandex_disk
+from app.cloud.share import CloudError
+
+from .download import FakeRangeResponse
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, js=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(js) if js is not None else ""
+        self.headers = headers or {}
+
+
+class FakeYandexDisk:
+    """
+    Upload link and upload endpoints, PUT answers are taken from script while it lasts
+    """
+
+    def __init__(self, put_script=()):
+        self.put_script = list(put_script)
+        self.files = {}
+        self.paths = {} # upload link -> cloud path
+        self.links = 0
+        self.puts = 0
+        self.sessions = set()
+
+    def __call__(self, method, url, **kwargs):
+        self.sessions.add(kwargs.get("session", None))
+        if method == "GET":
+            self.links += 1
+            href = f"https://upload.test/{self.links}"
+            self.paths[href] = kwargs["params"]["path"]
+            return FakeResponse(200, {"href": href, "method": "PUT", "templated": False})
+        assert method == "PUT"
+        self.puts += 1
+        data = kwargs["data"]
+        assert hasattr(data, "read"), "Body should be streamed from file"
+        content = data.read()
+        answer = self.put_script.pop(0) if self.put_script else 201
+        if isinstance(answer, Exception):
+            raise answer
+        if answer == 201:
+            self.files[self.paths.get(url, url)] = content
+        return FakeResponse(answer, {"error": "test"} if answer != 201 else None)
+
+
+class YandexDiskUploadTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_yandex_upload.bin")
+        self.content = random_bytes(100000)
+        self.path.write_bytes(self.content)
+        self.client = yandex_disk.YandexDisk("token")
+
+    def tearDown(self):
+        self.path.unlink(missing_ok=True)
+
+    def _upload(self, server):
+        with mock.patch.object(share, "make_request", server), mock.patch.object(share.time, "sleep"):
+            self.client.upload_file("app:/vault.db", self.path)
+
+    def test_0(self):
+        connection_error = CloudError(original_exception=requests.ConnectionError())
+        server = FakeYandexDisk([connection_error, 503])
+        self._upload(server)
+        self.assertEqual(server.files["app:/vault.db"], self.content)
+        self.assertEqual((server.links, server.puts), (1, 3))
+        server = FakeYandexDisk([500] * share.RETRY_ATTEMPTS)
+        self.assertRaises(CloudError, self._upload, server)
+        server = FakeYandexDisk([CloudError(original_exception=requests.exceptions.InvalidURL())])
+        self.assertRaises(CloudError, self._upload, server)
+        self.assertEqual(server.puts, 1)
+
+    def test_1(self):
+        server = FakeYandexDisk([410])
+        self._upload(server)
+        self.assertEqual((server.links, server.puts), (2, 2))
+        server = FakeYandexDisk([400])
+        self.assertRaises(CloudError, self._upload, server)
+        self.assertEqual(server.links, 1)
+        server = FakeYandexDisk([413])
+        self.assertRaisesRegex(CloudError, "too large", self._upload, server)
+        self.assertEqual(server.puts, 1)
+
+    def test_2(self):
+        session = share.create_session()
+        self.assertEqual(session.get_adapter(yandex_disk.API_URL)._pool_maxsize, share.SESSION_POOL_SIZE) # pylint: disable=protected-access
+        self.client = yandex_disk.YandexDisk("token", session=session)
+        server = FakeYandexDisk()
+        self._upload(server)
+        self.assertEqual(server.sessions, {session})
+        with mock.patch.object(session, "request", return_value=FakeResponse(200)) as request:
+            share.make_request("GET", yandex_disk.API_URL, session=session)
+        request.assert_called_once()
+
+    def test_3(self):
+        items = [{"name": f"f{i}", "type": "file"} for i in range(5)] + [{"name": "dir", "type": "dir"}]
+
+        def server(method, url, *, params, **_):
+            assert (method, url) == ("GET", f"{yandex_disk.API_URL}/resources")
+            if params["path"] == "app:/missing/":
+                return FakeResponse(404, {"error": "DiskNotFoundError"})
+            page = items[params["offset"]:params["offset"] + 4]
+            return FakeResponse(200, {"_embedded": {"items": page, "total": len(items)}})
+
+        with mock.patch.object(share, "make_request", server):
+            self.assertEqual([cloud_file.name for cloud_file in self.client.list_folder("app:/backup/")], [f"f{i}" for i in range(5)])
+            self.assertEqual(self.client.list_folder("app:/missing/"), [])
+        with mock.patch.object(share, "make_request", return_value=FakeResponse(409, {"error": "DiskResourceAlreadyExistsError"})):
+            self.assertRaises(yandex_disk.CloudConflictError, self.client.upload_file, "app:/vault.db", self.path)
+
+    def test_4(self):
+        self.client = yandex_disk.YandexDisk("token")
+        content = random_bytes(3 * 1000 + 1)
+
+        def server(method, url, *, headers, params=None, stream=False, **_):
+            assert method == "GET"
+            if url == f"{yandex_disk.API_URL}/resources/download":
+                assert params == {"path": "app:/vault.db"} and headers["Authorization"] == "OAuth token"
+                return FakeResponse(200, {"href": "https://download.test/vault.db", "method": "GET"})
+            assert (url, stream) == ("https://download.test/vault.db", True) and "Authorization" not in headers
+            start, end = map(int, headers["Range"].removeprefix("bytes=").split("-"))
+            return FakeRangeResponse(206, content[start:end + 1])
+
+        with mock.patch.object(share, "make_request", server):
+            self.client.download_file(
+                "app:/vault.db", self.path, share.DownloadOptions(len(content), hashlib.sha256(content).hexdigest(), part_size=1000)
+            )
+            self.assertEqual(self.path.read_bytes(), content)
+        self.path.unlink()
+        with mock.patch.object(share, "make_request", return_value=FakeResponse(404, {"error": "DiskNotFoundError"})):
+            self.assertRaises(CloudError, self.client.download_file, "app:/vault.db", self.path, share.DownloadOptions(len(content)))
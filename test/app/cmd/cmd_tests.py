@@ -1,8 +1,19 @@
-from unittest import TestCase
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+from unittest import TestCase, mock
 from pathlib import Path
 
+from app import config
+from app.cloud import cloud
+from app.cloud.share import CloudError
+from app.storage.sql import shard
 from app.storage.sql.share import StorageError
-from app.ui.console.app import AppState
+from app.ui.console import app
+from app.ui.console.app import AppState, AppError
 from app.config import curconfig
 
 
@@ -11,6 +22,39 @@ DUMP_PATH = Path(curconfig.db_directory, "__test_dump.dump")
 IMP_DB_PATH = Path("__test_from_dump.db")
 
 
+class FakeCloud:
+
+    def __init__(self, *, fail=False, directory=None):
+        self.fail = fail
+        self.directory = directory
+        self.destination = f"fake:{directory}"
+        self.uploaded = []
+        self.threads = set()
+
+    def upload_database(self, path, *, filename=None):
+        assert Path(path).exists()
+        self.threads.add(threading.get_ident())
+        if self.fail:
+            raise CloudError("Service unavailable")
+        self.uploaded.append(filename)
+
+    def upload_file(self, local_path, cloud_filename):
+        self.uploaded.append(cloud_filename)
+        shutil.copyfile(local_path, Path(self.directory, cloud_filename))
+
+    @staticmethod
+    def create_hasher():
+        return hashlib.sha256()
+
+
+def patch_config_entries(**entries):
+    get_entry = config.curconfig.get_entry
+    entries = {name.replace("__", "."): value for name, value in entries.items()}
+    return mock.patch.object(
+        config.curconfig, "get_entry", lambda entry_path: entries[entry_path] if entry_path in entries else get_entry(entry_path)
+    )
+
+
 class AppCmdTests(TestCase):
 
     def setUp(self):
@@ -30,7 +74,7 @@ class AppCmdTests(TestCase):
     def test_1(self):
         self.app_state.cmd_newtable_backend("passwords")
         self.app_state.cmd_newtable_backend("sometable")
-        tables = [desc.name for desc in self.app_state.cmd_tables_backend()]
+        tables = self.app_state.cmd_tables_backend()
         self.assertEqual(len(tables), 2)
         self.assertIn("passwords", tables)
         self.assertIn("sometable", tables)
@@ -111,15 +155,293 @@ class AppCmdTests(TestCase):
         data = self.app_state.cmd_get_backend("passwords", "yandex")
         self.assertEqual(data, None)
 
+    def test_11(self):
+        self.app_state.cmd_newtable_backend("t")
+        for i in range(7):
+            self.app_state.cmd_ins_backend("t", f"key{i}", "login:test")
+        self.app_state.cmd_del_backend("t", "key2")
+        page = list(self.app_state.cmd_keys_backend("t", limit=3))
+        self.assertEqual([item.key for item in page], ["key0", "key1", "key3"])
+        page = list(self.app_state.cmd_keys_backend("t", limit=3, after=page[-1].cursor))
+        self.assertEqual([item.key for item in page], ["key4", "key5", "key6"])
+        self.assertEqual(list(self.app_state.cmd_keys_backend("t", after=page[-1].cursor)), [])
+        page = list(self.app_state.cmd_find_backend("t", "key", limit=2, after=page[0].cursor))
+        self.assertEqual([item.key for item in page], ["key5", "key6"])
+        self.assertRaises(AppError, self.app_state.cmd_keys_backend, "t", after="xyz")
+        self.assertRaises(AppError, self.app_state.cmd_keys_backend, "t", after="-1")
+        self.assertRaises(AppError, self.app_state.cmd_keys_backend, "t", limit=-1)
+        self.assertRaises(AppError, self.app_state.cmd_find_backend, "t", "key", limit=-1)
+
+    def test_12(self):
+        self.app_state.cmd_newtable_backend("t")
+        for i in range(100):
+            self.app_state.cmd_ins_backend("t", f"key{i}", f"data:{'x' * 100}")
+        for i in range(90):
+            self.app_state.cmd_del_backend("t", f"key{i}")
+        before, after = self.app_state.cmd_maintain_backend(report=True)
+        self.assertGreater(before.freelist_count, 0)
+        self.assertIsNone(after)
+        before, after = self.app_state.cmd_maintain_backend()
+        self.assertEqual(after.freelist_count, 0)
+        self.assertLess(after.page_count, before.page_count)
+        self.assertEqual(len(list(self.app_state.cmd_keys_backend("t"))), 10)
+
+    def test_13(self):
+        self.app_state.cmd_newtable_backend("t")
+        self.app_state.cmd_ins_backend("t", "key", "login:test")
+        path = self.app_state.cmd_snapshot_backend()
+        self.assertTrue(path.is_relative_to(Path(curconfig.db_directory, ".snapshots")))
+        self.app_state.cmd_ins_backend("t", "key2", "login:test")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key")["login"], "test")
+        self.app_state.cmd_discon_backend()
+        self.assertRaises(AppError, self.app_state.cmd_snapshot_backend)
+        self.app_state.cmd_con_backend(path, password="hello")
+        self.assertEqual([item.key for item in self.app_state.cmd_keys_backend("t")], ["key"])
+
+    def test_14(self):
+        self.app_state.cmd_newtable_backend("t", hash_search=True)
+        self.app_state.cmd_ins_backend("t", "key", "login:test")
+        report_path = Path(curconfig.db_directory, "__test_scrub.json")
+        result = self.app_state.cmd_scrub_backend(workers=1, report=report_path)
+        self.assertTrue(result.is_ok())
+        with open(report_path, "r", encoding="utf-8") as fd:
+            self.assertEqual(json.load(fd), {"tables": 1, "rows": 1, "ok": True, "issues": []})
+
+    def test_15(self):
+        other_path = Path("__test_sync.db")
+        self.app_state.cmd_newdb_backend(other_path, password="other", rewrite=True)
+        self.app_state.cmd_newtable_backend("t")
+        self.app_state.cmd_ins_backend("t", "key", "login:test")
+        results = self.app_state.cmd_sync_backend(other_path, password="other")
+        self.assertEqual((results[0].created, results[0].inserted), (True, 1))
+        self.app_state.cmd_upd_backend("t", "key", "login:changed")
+        self.app_state.cmd_sync_backend(other_path, password="other")
+        self.app_state.cmd_del_backend("t", "key")
+        results = self.app_state.cmd_sync_backend(other_path, password="other", pull=True)
+        self.assertEqual(results[0].inserted, 1)
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key")["login"], "changed")
+        self.assertRaises(StorageError, self.app_state.cmd_sync_backend, other_path, password="wrong")
+
+    def test_16(self):
+        path = Path(curconfig.db_directory, "__test_shards.db")
+        self.app_state.cmd_newdb_backend(path, password="other", rewrite=True, connect=True, shards=2)
+        for name in ("a", "b"):
+            self.app_state.cmd_newtable_backend(name)
+            self.app_state.cmd_ins_backend(name, "key", f"login:{name}")
+        snapshot_path = self.app_state.cmd_snapshot_backend()
+        self.app_state.cmd_discon_backend()
+        self.app_state.cmd_con_backend(snapshot_path, password="other")
+        self.assertEqual(self.app_state.cmd_get_backend("b", "key")["login"], "b")
+        self.app_state.cmd_discon_backend()
+        self.app_state.cmd_deldb_backend(path)
+        self.assertFalse(any(p.exists() for p in shard.get_shard_paths(path, 2)))
+
+    def test_17(self):
+        self.app_state.cmd_newtable_backend("t")
+        self.app_state.cmd_con_backend(DB_PATH, password="hello", deferred=True)
+        self.app_state.cmd_ins_backend("t", "key", "login:test")
+        self.assertRaises(AppError, self.app_state.cmd_maintain_backend)
+        snapshot_path = self.app_state.cmd_snapshot_backend()
+        self.app_state.cmd_ins_backend("t", "key2", "login:test")
+        self.app_state.cmd_con_backend(snapshot_path, password="hello", mirror=True)
+        self.assertEqual([item.key for item in self.app_state.cmd_keys_backend("t")], ["key"])
+        self.app_state.cmd_con_backend(DB_PATH, password="hello")
+        self.assertEqual([item.key for item in self.app_state.cmd_keys_backend("t")], ["key", "key2"])
+
+    def test_18(self):
+        other_path = Path(curconfig.db_directory, "__test_cloudup.db")
+        self.app_state.cmd_newdb_backend(other_path, password="other", rewrite=True)
+        self.app_state.cloud = {"a": FakeCloud(), "b": FakeCloud(fail=True)}
+        with patch_config_entries(cloud__enabled=True), mock.patch.object(cloud, "get_configured_services", return_value=["a", "b"]):
+            progress = []
+            results = self.app_state.cmd_cloudup_backend(
+                DB_PATH, other_path, all_services=True, progress=lambda result, done, total: progress.append((done, total))
+            )
+            self.assertEqual(sorted(self.app_state.cloud["a"].uploaded), ["__test.db", "__test_cloudup.db"])
+            self.assertEqual(sorted((r.path.name, r.service) for r in results if r.error is not None), [("__test.db", "b"), ("__test_cloudup.db", "b")])
+            self.assertEqual(progress, [(i, 4) for i in range(1, 5)])
+            self.assertNotIn(threading.get_ident(), self.app_state.cloud["a"].threads)
+            self.assertEqual(len(self.app_state.cmd_cloudup_backend(service="a")), 1)
+            self.assertRaises(AppError, self.app_state.cmd_cloudup_backend, DB_PATH, service="b")
+            self.assertRaises(AppError, self.app_state.cmd_cloudup_backend, DB_PATH, service="a", workers=-1)
+            patch_pool_size = mock.patch.object(app.cloud_share, "SESSION_POOL_SIZE", 2)
+            with patch_pool_size, mock.patch.object(app, "ThreadPoolExecutor", wraps=app.ThreadPoolExecutor) as executor:
+                self.app_state.cmd_cloudup_backend(DB_PATH, other_path, all_services=True, workers=100)
+            self.assertEqual(executor.call_args.kwargs["max_workers"], 2)
+        databases = app._list_app_databases() # pylint: disable=protected-access
+        self.assertIn(other_path, databases)
+        self.assertFalse(any(app.get_snapshots_directory() in path.parents for path in databases))
+        self.app_state.cmd_deldb_backend(other_path)
+
+    def test_19(self):
+        self.app_state.cmd_newtable_backend("t")
+        self.app_state.cloud = {"a": FakeCloud()}
+        self.app_state.upload_queue.notify = None
+        db_path = app.get_database_absolute_path(DB_PATH)
+        self.app_state.upload_queue.enqueue(db_path, "a", delay=0)
+        self.app_state.upload_queue.enqueue(db_path, "a", delay=0)
+        self.assertEqual(self.app_state.upload_queue.close(10), 0)
+        self.assertIn(self.app_state.cloud["a"].uploaded, (["__test.db"], ["__test.db", "__test.db"]))
+
+    def test_20(self):
+        directory = Path(curconfig.db_directory, "__test_cloud_chain")
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir()
+        self.app_state.cloud = {"a": FakeCloud(directory=directory)}
+        with patch_config_entries(cloud__enabled=True, cloud__incremental=True, cloud__full_every=5):
+            self.app_state.cmd_con_backend(DB_PATH, password="hello")
+            self.app_state.cmd_newtable_backend("t")
+            self.app_state.cmd_ins_backend("t", "key", "login:1")
+            self.app_state.cmd_cloudup_backend(service="a")
+            self.app_state.cmd_cloudup_backend(service="a")
+            self.app_state.cmd_ins_backend("t", "key2", "login:2")
+            self.app_state.cmd_cloudup_backend(service="a")
+        numbers = [name.split("_")[7] for name in self.app_state.cloud["a"].uploaded]
+        self.assertEqual(numbers, ["0000", "0001"])
+        self.app_state.cmd_discon_backend()
+        self.assertRaises(AppError, self.app_state.cmd_restore_backend, DB_PATH, str(Path(directory, "*")))
+        self.app_state.cmd_restore_backend(IMP_DB_PATH, str(Path(directory, "*")), rewrite=True)
+        self.app_state.cmd_con_backend(IMP_DB_PATH, password="hello")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key2")["login"], "2")
+        shutil.rmtree(directory)
+
+    def test_21(self):
+        directory = Path(curconfig.db_directory, "__test_cloud_dedup")
+        shutil.rmtree(directory, ignore_errors=True)
+        self.app_state.cloud = {"local": cloud.LocalCloud(directory)}
+        with patch_config_entries(cloud__enabled=True, cloud__dedup=True, cloud__chunk_size=4096):
+            self.app_state.cmd_newtable_backend("t")
+            for i in range(200):
+                self.app_state.cmd_ins_backend("t", f"key{i}", f"login:{i}")
+            self.app_state.cmd_cloudup_backend(service="local")
+            chunks = len(list(directory.glob("chunk_*")))
+            self.app_state.cmd_ins_backend("t", "key", "login:new")
+            time.sleep(1) # NOTE: manifest names have second precision
+            self.app_state.cmd_cloudup_backend(service="local")
+        self.assertLess(len(list(directory.glob("chunk_*"))), 2 * chunks)
+        manifests = sorted(directory.glob("*.manifest"))
+        self.assertEqual(len(manifests), 2)
+        self.assertRaises(AppError, self.app_state.cmd_restore_backend, IMP_DB_PATH, *map(str, manifests), rewrite=True)
+        self.app_state.cmd_restore_backend(IMP_DB_PATH, str(manifests[-1]), rewrite=True)
+        self.app_state.cmd_con_backend(IMP_DB_PATH, password="hello")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key")["login"], "new")
+        shutil.rmtree(directory)
+
+    def test_22(self):
+        directory = Path(curconfig.db_directory, "__test_cloud_compressed")
+        shutil.rmtree(directory, ignore_errors=True)
+        self.app_state.cloud = {"local": cloud.LocalCloud(directory)}
+        with patch_config_entries(cloud__enabled=True, cloud__incremental=True, cloud__compression="lzma", cloud__compression_level=1):
+            self.app_state.cmd_con_backend(DB_PATH, password="hello")
+            self.app_state.cmd_newtable_backend("t")
+            self.app_state.cmd_ins_backend("t", "key", "login:1")
+            self.app_state.cmd_cloudup_backend(service="local")
+            self.app_state.cmd_ins_backend("t", "key2", "login:2")
+            self.app_state.cmd_cloudup_backend(service="local")
+        uploaded = sorted(directory.iterdir())
+        self.assertEqual([path.suffix for path in uploaded], [".xz", ".xz"])
+        self.assertLess(uploaded[0].stat().st_size, Path(curconfig.db_directory, DB_PATH).stat().st_size / 2)
+        self.app_state.cmd_discon_backend()
+        self.app_state.cmd_restore_backend(IMP_DB_PATH, str(Path(directory, "*")), rewrite=True)
+        self.app_state.cmd_con_backend(IMP_DB_PATH, password="hello")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key2")["login"], "2")
+        shutil.rmtree(directory)
+
+    def test_23(self):
+        directory = Path(curconfig.db_directory, "__test_cloud_state")
+        shutil.rmtree(directory, ignore_errors=True)
+        self.app_state.cloud = {"local": cloud.LocalCloud(directory)}
+        with patch_config_entries(cloud__enabled=True):
+            self.app_state.cmd_newtable_backend("t")
+            self.assertFalse(self.app_state.cmd_cloudup_backend(service="local")[0].skipped)
+            self.assertTrue(self.app_state.cmd_cloudup_backend(service="local")[0].skipped)
+            self.app_state.cmd_ins_backend("t", "key", "login:1")
+            time.sleep(1) # NOTE: uploaded file names have second precision
+            self.assertFalse(self.app_state.cmd_cloudup_backend(service="local")[0].skipped)
+            self.assertEqual(len(list(directory.iterdir())), 2)
+            (key, state), = self.app_state.cmd_cloudhist_backend()
+            self.assertEqual((key, len(state.history)), ("local", 2))
+            self.assertEqual(state.history[-1].uploaded, state.history[-1].size)
+            self.assertEqual(len(self.app_state.cmd_cloudhist_backend(limit=1)[0][1].history), 1)
+            self.assertEqual(self.app_state.cmd_cloudhist_backend(service="dropbox"), [])
+            # NOTE: other upload directory has nothing yet
+            self.app_state.cloud = {"local": cloud.LocalCloud(Path(directory, "other"))}
+            self.assertFalse(self.app_state.cmd_cloudup_backend(service="local")[0].skipped)
+        shutil.rmtree(directory)
+
+    def test_24(self):
+        directory = Path(curconfig.db_directory, "__test_cloud_restore")
+        shutil.rmtree(directory, ignore_errors=True)
+        self.app_state.cloud = {"local": cloud.LocalCloud(directory)}
+        self.app_state.cmd_newtable_backend("t")
+        for i, entries in enumerate(({}, {"cloud__incremental": True}, {"cloud__dedup": True, "cloud__chunk_size": 4096})):
+            time.sleep(1) # NOTE: uploaded file names have second precision
+            with patch_config_entries(cloud__enabled=True, **entries):
+                # NOTE: change log for chain is created on connect
+                self.app_state.cmd_con_backend(DB_PATH, password="hello")
+                self.app_state.cmd_ins_backend("t", f"key{i}", f"login:{i}")
+                self.app_state.cmd_cloudup_backend(service="local")
+        with patch_config_entries(cloud__enabled=True):
+            backups = self.app_state.cmd_cloudls_backend(service="local")
+            self.assertEqual([backup.kind for backup in backups], ["full", "chain", "dedup"])
+            self.assertEqual({backup.name for backup in backups}, {DB_PATH.name})
+            self.assertEqual(self.app_state.cmd_cloudls_backend(dbid="000000", service="local"), [])
+            self.assertRaises(AppError, self.app_state.cmd_cloudrestore_backend, backups[0].dbid, service="local")
+            self.assertRaises(AppError, self.app_state.cmd_cloudrestore_backend, "000000", service="local")
+            for i, backup in enumerate(backups):
+                restored_backup, restored_path = self.app_state.cmd_cloudrestore_backend(
+                    backup.id, path=IMP_DB_PATH, service="local", workers=2, rewrite=True
+                )
+                self.assertEqual((restored_backup, restored_path), (backup, Path(curconfig.db_directory, IMP_DB_PATH)))
+                self.assertRaises(AppError, self.app_state.cmd_cloudrestore_backend, backup.id, path=IMP_DB_PATH, service="local")
+                self.app_state.cmd_con_backend(IMP_DB_PATH, password="hello")
+                self.assertEqual(self.app_state.cmd_get_backend("t", f"key{i}")["login"], str(i))
+                self.assertIsNone(self.app_state.cmd_get_backend("t", f"key{i + 1}"))
+                self.app_state.cmd_con_backend(DB_PATH, password="hello")
+        self.assertEqual([path.name for path in Path(curconfig.db_directory).glob(".cloudrestore_*")], [])
+        # NOTE: missing directories of restored path are created
+        nested_directory = Path(curconfig.db_directory, "__test_cloud_restore_nested")
+        shutil.rmtree(nested_directory, ignore_errors=True)
+        with patch_config_entries(cloud__enabled=True):
+            _, restored_path = self.app_state.cmd_cloudrestore_backend(backups[0].id, path=Path(nested_directory, "sub", "x.db"), service="local")
+        self.assertTrue(restored_path.exists())
+        shutil.rmtree(nested_directory)
+        shutil.rmtree(directory)
+
+    def test_25(self):
+        log_path = Path("__test_log.db")
+        with patch_config_entries(storage__engine="log"):
+            self.app_state.cmd_newdb_backend(log_path, password="hello", rewrite=True, connect=True)
+        self.app_state.cmd_newtable_backend("t")
+        for i in range(5):
+            self.app_state.cmd_ins_backend("t", f"key{i}", f"login:{i}")
+        self.app_state.cmd_upd_backend("t", "key1", "password:1")
+        self.app_state.cmd_del_backend("t", "key0")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key1"), {"login": "1", "password": "1"})
+        self.assertEqual(self.app_state.cmd_count_backend("t"), 4)
+        self.assertEqual(self.app_state.cmd_tables_backend(), ["t"])
+        first = list(self.app_state.cmd_keys_backend("t", limit=2))
+        rest = list(self.app_state.cmd_keys_backend("t", after=first[-1].cursor))
+        self.assertCountEqual([item.key for item in first + rest], ["key1", "key2", "key3", "key4"])
+        self.assertEqual([item.key for item in self.app_state.cmd_find_backend("t", "3")], ["key3"])
+        self.assertRaises(AppError, self.app_state.cmd_dbid)
+        self.assertRaises(AppError, self.app_state.cmd_con_backend, log_path, password="hello", mirror=True)
+        # NOTE: engine of existing file is detected on connect, config selects engine of new databases only
+        self.app_state.cmd_con_backend(log_path, password="hello")
+        self.assertEqual(self.app_state.cmd_get_backend("t", "key4"), {"login": "4"})
+        self.app_state.cmd_discon_backend()
+        self.app_state.cmd_deldb_backend(log_path)
+        self.assertEqual(list(Path(curconfig.db_directory).glob(f"{log_path}*")), [])
+
     def test_100(self):
         tname = "passwords"
         self.app_state.cmd_newtable_backend(tname, hash_search=True)
         self.app_state.cmd_ins_backend(tname, "yandex", "login:test")
         self.app_state.cmd_ins_backend(tname, "google", "password:123", "login:test")
         self.app_state.cmd_ins_backend(tname, "github", "login:test2")
-        klist = self.app_state.cmd_find_backend(tname, "goo")
+        klist = [item.key for item in self.app_state.cmd_find_backend(tname, "goo")]
         self.assertIn("google", klist)
-        klist = self.app_state.cmd_keys_backend(tname)
+        klist = list(self.app_state.cmd_keys_backend(tname))
         self.assertEqual(len(klist), 3)
         val = self.app_state.cmd_get_backend(tname, "github")
         self.assertEqual(val["login"], "test2")
@@ -130,12 +452,12 @@ class AppCmdTests(TestCase):
         self.assertEqual(len(tlist), 1)
         self.app_state.cmd_export_backend(DUMP_PATH, rewrite=True, all=True)
         self.app_state.cmd_del_backend(tname, "google")
-        klist = self.app_state.cmd_keys_backend(tname)
+        klist = list(self.app_state.cmd_keys_backend(tname))
         self.assertEqual(len(klist), 2)
         self.app_state.cmd_del_backend(tname, "google")
         self.app_state.cmd_del_backend(tname, "yandex")
         self.app_state.cmd_del_backend(tname, "github")
-        klist = self.app_state.cmd_keys_backend(tname)
+        klist = list(self.app_state.cmd_keys_backend(tname))
         self.assertEqual(len(klist), 0)
         self.app_state.cmd_deltable_backend(tname)
         tlist = self.app_state.cmd_tables_backend()
@@ -143,7 +465,7 @@ class AppCmdTests(TestCase):
         self.app_state.cmd_newdb_backend(IMP_DB_PATH, password="hello2", connect=True, rewrite=True)
         self.app_state.cmd_newtable_backend(tname, hash_search=False)
         self.app_state.cmd_import(DUMP_PATH, all=True)
-        klist = self.app_state.cmd_keys_backend(tname)
+        klist = list(self.app_state.cmd_keys_backend(tname))
         self.assertEqual(len(klist), 3)
         val = self.app_state.cmd_get_backend(tname, "github")
         self.assertEqual(val["login"], "test2")
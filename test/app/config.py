@@ -3,6 +3,7 @@ from unittest import TestCase
 from dataclasses import dataclass
 from pathlib import Path
 
+from app import config
 from app.config import ConfigEntry, ConfigError
 
 
@@ -60,3 +61,9 @@ class ConfigEntryTests(TestCase):
     def test_8(self):
         e1 = TestEntry1()
         self.assertRaises(ConfigError, e1.set_entry, 1, "e2.s")
+
+    def test_9(self):
+        for base_url in ("https://api.example.com", "http://127.0.0.1:8080", "http://localhost/", "http://[::1]:80"):
+            config._check_base_url(base_url) # pylint: disable=protected-access
+        for base_url in ("http://api.example.com", "http://10.0.0.1", "ftp://127.0.0.1", "standin", "https://"):
+            self.assertRaises(ConfigError, config._check_base_url, base_url) # pylint: disable=protected-access
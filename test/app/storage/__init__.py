@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from utils.common import random_bytes
+
+from app import config
+from app.storage import sql
+# pylint: disable=unused-import
+import app.storage.sql.content
+import app.storage.sql.share
+# pylint: enable=unused-import
+from app.ui.console.app import create_default_mixer, create_default_key_hasher, create_default_hash_search_hasher
+
+
+def create_test_mixer():
+    """
+    Mixer with random keys, skips slow password hashing
+    """
+    mixer = create_default_mixer()
+    mixer.set_keys(*(random_bytes(size) for size in mixer.key_sizes))
+    mixer.opposite_instance(set_attribute=True)
+    return mixer
+
+
+def create_test_context(name) -> sql.share.ConnectionContext:
+    """
+    Fresh database with random keys
+    """
+    mixer = create_test_mixer()
+    hs_hasher = create_default_hash_search_hasher()
+    path = Path(config.curconfig.db_directory, name)
+    connection = sql.raw.db_create_new(path, rewrite=True, connect=True)
+    sql.content.init_empty_database(connection, mixer, hs_hasher, create_default_key_hasher())
+    return sql.share.ConnectionContext(connection, mixer, hs_hasher)
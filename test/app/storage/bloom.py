@@ -0,0 +1,90 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.storage.sql import bloom, content, description
+
+from . import create_test_context
+
+
+class BloomFilterTests(TestCase):
+
+    def test_0(self):
+        bloom_filter = bloom.BloomFilter(100)
+        for i in range(bloom.MIN_CAPACITY):
+            bloom_filter.add(str(i))
+        self.assertTrue(all(str(i) in bloom_filter for i in range(bloom.MIN_CAPACITY)))
+        false_positives = sum(f"x{i}" in bloom_filter for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_1(self):
+        bloom_filter = bloom.BloomFilter(10, count=0)
+        bloom_filter.add("key")
+        restored = bloom.BloomFilter.from_bytes(bloom_filter.to_bytes())
+        self.assertIn("key", restored)
+        self.assertEqual(restored.count, 1)
+
+
+class BloomTableTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_bloom.db")
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t")
+            for i in range(20):
+                content.insert_record(self.ctx, "t", f"key{i}", {"v": str(i)})
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def test_0(self):
+        with patch.object(content, "decrypt_row", wraps=content.decrypt_row) as decrypt_row:
+            missing = sum(content.get_record(self.ctx, "t", f"missing{i}") is None for i in range(50))
+            self.assertEqual(missing, 50)
+            self.assertLess(decrypt_row.call_count, 5 * 20)
+
+    def test_1(self):
+        self.ctx.bloom.clear()
+        self.assertEqual(content.get_record(self.ctx, "t", "key7"), {"v": "7"})
+        self.assertIsNone(content.get_record(self.ctx, "t", "missing"))
+
+    def test_2(self):
+        with self.ctx.connection:
+            content.update_record(self.ctx, "t", "key3", {}, new_key="renamed")
+            content.del_record(self.ctx, "t", "key4")
+        self.ctx.bloom.clear()
+        self.assertEqual(content.get_record(self.ctx, "t", "renamed"), {"v": "3"})
+        self.assertIsNone(content.get_record(self.ctx, "t", "key4"))
+        self.assertRaises(content.StorageError, content.insert_record, self.ctx, "t", "key5", {})
+
+    def test_3(self):
+        desc = description.get(self.ctx, "t")
+        with self.ctx.connection:
+            for i in range(20):
+                content.del_record(self.ctx, "t", f"key{i}")
+            for _ in range(bloom.MIN_CAPACITY // 4):
+                bloom.on_delete(self.ctx, desc)
+        bloom_filter = self.ctx.bloom[desc.raw_name]
+        self.assertEqual(bloom_filter.count, 0)
+        self.assertNotIn("key0", bloom_filter)
+
+    def test_4(self):
+        # NOTE: filter is stored once per transaction, cached filter of rolled back transaction is dropped
+        with patch.object(bloom, "_store", wraps=bloom._store) as store: # pylint: disable=protected-access
+            with self.ctx.connection:
+                for i in range(20, 40):
+                    content.insert_record(self.ctx, "t", f"key{i}", {})
+            self.assertEqual(store.call_count, 1)
+        with self.assertRaises(ValueError), self.ctx.connection:
+            content.insert_record(self.ctx, "t", "rolled_back", {})
+            raise ValueError()
+        self.assertIsNone(content.get_record(self.ctx, "t", "rolled_back"))
+        self.assertNotIn("rolled_back", self.ctx.bloom[description.get(self.ctx, "t").raw_name])
+        self.ctx.bloom.clear()
+        self.assertEqual(content.get_record(self.ctx, "t", "key39"), {})
+
+    def test_5(self):
+        # NOTE: filter built on first insert already has inserted key, it is not added twice
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t2")
+            content.insert_record(self.ctx, "t2", "key", {})
+        self.assertEqual(self.ctx.bloom[description.get(self.ctx, "t2").raw_name].count, 1)
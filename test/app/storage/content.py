@@ -0,0 +1,88 @@
+from unittest import TestCase
+from dataclasses import replace
+
+from app.storage.sql import content, description, manifest
+from app.storage.sql.share import ScanOptions
+
+from . import create_test_context
+
+
+class TableAllocatorTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_content.db")
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def _raw_name(self, table):
+        return description.get(self.ctx, table).raw_name
+
+    def test_0(self):
+        with self.ctx.connection:
+            for i in range(3):
+                content.create_table(self.ctx, f"t{i}")
+            content.delete_table(self.ctx, "t1")
+            content.create_table(self.ctx, "t3")
+            content.create_table(self.ctx, "t4")
+        self.assertEqual(self._raw_name("t3"), "table_001")
+        self.assertEqual(self._raw_name("t4"), "table_003")
+        self.assertEqual(manifest.get_table_allocator(self.ctx.connection), (4, []))
+
+    def test_1(self):
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t0", tables_limit=2)
+            content.create_table(self.ctx, "t1", tables_limit=2)
+            self.assertRaises(content.StorageError, content.create_table, self.ctx, "t2", tables_limit=2)
+            content.delete_table(self.ctx, "t0")
+            content.create_table(self.ctx, "t2", tables_limit=2)
+
+    def test_2(self):
+        with self.ctx.connection:
+            for i in range(4):
+                content.create_table(self.ctx, f"t{i}")
+            content.delete_table(self.ctx, "t2")
+            self.ctx.connection.execute("DELETE FROM manifest WHERE key IN ('table_counter', 'table_free_list')")
+            content.create_table(self.ctx, "t4")
+            content.create_table(self.ctx, "t5")
+        self.assertEqual(self._raw_name("t4"), "table_002")
+        self.assertEqual(self._raw_name("t5"), "table_004")
+
+    def test_3(self):
+        with self.ctx.connection:
+            for i in range(1001):
+                content.create_table(self.ctx, f"t{i}", tables_limit=2000)
+        self.assertEqual(self._raw_name("t1000"), "table_1000")
+
+
+class PipelinedScanTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_content.db")
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t")
+            for i in range(300):
+                content.insert_record(self.ctx, "t", f"key{i}", {"value": str(i)})
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def _scan(self, **kwargs):
+        ctx = replace(self.ctx, scan=ScanOptions(**kwargs))
+        return [(row[content.KEY_COL], row[content.DATA_COL]) for row in content.iterate_with_decryption(ctx, "t")]
+
+    def test_0(self):
+        expected = [(f"key{i}", {"value": str(i)}) for i in range(300)]
+        self.assertEqual(self._scan(), expected)
+        self.assertEqual(self._scan(workers=2), expected)
+        self.assertEqual(self._scan(workers=3, batch_size=7, queue_size=1), expected)
+
+    def test_1(self):
+        ctx = replace(self.ctx, scan=ScanOptions(workers=2, batch_size=16))
+        rows = content.iterate_with_decryption(ctx, "t")
+        self.assertEqual(next(rows)[content.KEY_COL], "key0")
+        rows.close()
+        with self.ctx.connection:
+            content.insert_record(self.ctx, "t", "key300", {"value": "300"})
+        self.assertEqual(len(self._scan(workers=2)), 301)
+        self.assertEqual(len(list(description.iterate_with_decryption(ctx))), 1)
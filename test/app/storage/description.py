@@ -0,0 +1,77 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.storage.sql import content, description
+from app.storage.sql.share import ConnectionContext
+
+from . import create_test_context
+
+
+class DescriptionCatalogTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_description.db")
+        with self.ctx.connection:
+            for i in range(20):
+                content.create_table(self.ctx, f"t{i}", enable_hash_search=bool(i % 2))
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def test_0(self):
+        self.ctx.catalog.invalidate()
+        with patch.object(description, "_decrypt_desc", wraps=description._decrypt_desc) as decrypt_desc: # pylint: disable=protected-access
+            self.assertEqual(description.get(self.ctx, "t7").name, "t7")
+            self.assertEqual(description.get(self.ctx, "t7").name, "t7")
+            self.assertFalse(description.is_table_exist(self.ctx, "missing"))
+            self.assertEqual(decrypt_desc.call_count, 1)
+            self.assertEqual(len(list(description.iterate(self.ctx))), 20)
+            for i in range(20):
+                self.assertEqual(description.get(self.ctx, f"t{i}").name, f"t{i}")
+            with self.ctx.connection:
+                content.create_table(self.ctx, "new")
+                content.delete_table(self.ctx, "t3")
+            self.assertEqual(decrypt_desc.call_count, 21)
+
+    def test_1(self):
+        with self.ctx.connection:
+            content.delete_table(self.ctx, "t5")
+        self.assertRaises(description.TableNotExist, description.get, self.ctx, "t5")
+        self.ctx.catalog.invalidate()
+        names = {desc.name for desc in description.iterate(self.ctx)}
+        self.assertEqual(len(names), 19)
+        self.assertNotIn("t5", names)
+
+    def test_2(self):
+        def failing_insert(*_, **__):
+            raise content.StorageError("insert failed")
+        with patch.object(description, "insert_record_raw", side_effect=failing_insert):
+            with self.assertRaises(content.StorageError), self.ctx.connection:
+                content.create_table(self.ctx, "new")
+        self.assertFalse(description.is_table_exist(self.ctx, "new"))
+        self.assertEqual(len(list(description.iterate(self.ctx))), 20)
+
+    def test_3(self):
+        with self.ctx.connection:
+            sql_texts = [
+                f"DROP INDEX index_{description.DESCRIPTION_TABLE}_{description.NAME_HASH_COL}",
+                f"ALTER TABLE {description.DESCRIPTION_TABLE} DROP COLUMN {description.NAME_HASH_COL}",
+                "DELETE FROM manifest WHERE key IN ('desc_hash_key', 'iv_desc_hash_key')"
+            ]
+            for sql_text in sql_texts:
+                self.ctx.connection.execute(sql_text)
+        ctx = ConnectionContext(self.ctx.connection, self.ctx.mixer, self.ctx.hs_hasher)
+        with ctx.connection:
+            description.upgrade_description_table(ctx)
+        self.assertEqual(description.get(ctx, "t11").name, "t11")
+        self.assertFalse(description.is_table_exist(ctx, "t20"))
+
+    def test_4(self):
+        # NOTE: catalog changed inside transaction of caller is reloaded on its rollback
+        with self.assertRaises(ValueError), self.ctx.connection:
+            content.create_table(self.ctx, "new")
+            content.delete_table(self.ctx, "t4")
+            raise ValueError()
+        self.assertFalse(description.is_table_exist(self.ctx, "new"))
+        self.assertEqual(description.get(self.ctx, "t4").name, "t4")
+        self.assertEqual(len(list(description.iterate(self.ctx))), 20)
@@ -0,0 +1,126 @@
+import shutil
+
+from unittest import TestCase
+from pathlib import Path
+from contextlib import closing
+from dataclasses import replace
+
+from app import config
+from app.storage.sql import changelog, content, increment, raw, snapshot
+
+from . import create_test_context
+
+
+def read_tables(path):
+    with closing(raw.db_connect(path, read_only=True)) as connection:
+        tables = sorted(name for name in raw.get_db_tables_raw(connection) if not name.startswith("sqlite_"))
+        return {name: sorted(tuple(row) for row in raw.iterate_table_raw(connection, name)) for name in tables}
+
+
+class IncrementTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_increment.db")
+        self.directory = Path(config.curconfig.db_directory, "__test_increment")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.ctx = create_test_context(self.path.name)
+        with self.ctx.connection:
+            changelog.init_changelog_table(self.ctx.connection)
+        self.ctx = replace(self.ctx, changelog=True)
+        with self.ctx.connection:
+            for name in ("a", "b", "c"):
+                content.create_table(self.ctx, name, enable_hash_search=name == "a")
+                for i in range(300):
+                    content.insert_record(self.ctx, name, f"key{i}", {"value": "x" * 100})
+        self.files = []
+
+    def tearDown(self):
+        self.ctx.connection.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _snapshot(self):
+        path = snapshot.create_snapshot(self.path, Path(self.directory, f"{len(self.files)}.db"))
+        self.files.append(path)
+        return path
+
+    def test_0(self):
+        seq = changelog.get_last_seq(self.ctx.connection)
+        self.assertEqual(seq, 903)
+        with self.ctx.connection:
+            content.update_record(self.ctx, "a", "key0", {"value": "y"})
+            content.del_record(self.ctx, "a", "key1")
+        changes = list(changelog.iterate_changes(self.ctx.connection, seq))
+        self.assertEqual([(row[changelog.ROW_COL], row[changelog.SEQ_COL]) for row in changes], [(1, seq + 1), (2, seq + 2)])
+        with self.ctx.connection:
+            changelog.prune(self.ctx.connection, seq + 10)
+        self.assertEqual(changelog.get_last_seq(self.ctx.connection), seq + 2)
+        self.assertEqual(raw.count_star_raw(self.ctx.connection, changelog.CHANGELOG_TABLE), 1)
+
+    def test_1(self):
+        full_path = self._snapshot()
+        base_seq = changelog.get_last_seq(self.ctx.connection)
+        with self.ctx.connection:
+            content.update_record(self.ctx, "a", "key0", {"value": "y"}, new_key="key0new")
+            content.del_record(self.ctx, "a", "key1")
+            content.insert_record(self.ctx, "b", "new", {"value": "z"})
+            content.delete_table(self.ctx, "c")
+            # NOTE: raw name of deleted table is reused, its old rows must not survive
+            content.create_table(self.ctx, "d")
+            content.insert_record(self.ctx, "d", "key", {"value": "d"})
+        delta_path = Path(self.directory, "1.delta")
+        info = increment.create_delta(self._snapshot(), delta_path, base_seq)
+        self.assertEqual((info.from_seq, info.to_seq), (base_seq, changelog.get_last_seq(self.ctx.connection)))
+        self.assertLess(delta_path.stat().st_size * 5, full_path.stat().st_size)
+        with self.ctx.connection:
+            content.insert_record(self.ctx, "d", "key2", {"value": "d"})
+            content.create_table(self.ctx, "e", enable_hash_search=True)
+            content.insert_record(self.ctx, "e", "key", {"value": "e"})
+        delta2_path = Path(self.directory, "2.delta")
+        increment.create_delta(self._snapshot(), delta2_path, info.to_seq)
+        restored_path = Path(self.directory, "restored.db")
+        self.assertRaises(increment.StorageError, increment.restore_chain, [full_path, delta2_path], restored_path)
+        self.assertFalse(restored_path.exists())
+        seq = increment.restore_chain([delta2_path, full_path, delta_path], restored_path)
+        self.assertEqual(seq, changelog.get_last_seq(self.ctx.connection))
+        self.assertEqual(read_tables(restored_path), read_tables(self.path))
+
+    def test_2(self):
+        full = increment.prepare_backup(self._snapshot(), self.directory, "svc", name="vault.db", full_every=2)
+        self.assertEqual((full.number, full.temporary), (0, False))
+        increment.commit_backup(self.directory, "svc", full)
+        self.assertIsNone(increment.prepare_backup(self._snapshot(), self.directory, "svc", name="vault.db"))
+        numbers = []
+        for i in range(3):
+            with self.ctx.connection:
+                content.insert_record(self.ctx, "a", f"new{i}", {"value": "n"})
+            chain_file = increment.prepare_backup(self._snapshot(), self.directory, "svc", name="vault.db", full_every=2)
+            numbers.append(chain_file.number)
+            if chain_file.temporary:
+                uploaded = Path(self.directory, chain_file.filename)
+                shutil.move(chain_file.path, uploaded)
+                self.files.append(uploaded)
+            increment.commit_backup(self.directory, "svc", chain_file)
+        self.assertEqual(numbers, [1, 2, 0])
+        self.assertTrue(full.filename.endswith("_0000_vault.db"))
+        dbid = full.dbid
+        self.assertEqual(increment.get_chain_base_seq(self.directory, dbid), chain_file.seq)
+        shutil.copyfile(full.path, Path(self.directory, full.filename))
+        chain = list(self.directory.glob(full.filename.replace("0000", "*")))
+        self.assertEqual(len(chain), 3)
+        restored_path = Path(self.directory, "restored.db")
+        increment.restore_chain(chain, restored_path)
+        with closing(raw.db_connect(restored_path)) as connection:
+            self.assertEqual(changelog.get_last_seq(connection), changelog.get_last_seq(self.ctx.connection) - 1)
+
+    def test_3(self):
+        # NOTE: columns added by upgrade after the full backup are added on replay
+        full_path = self._snapshot()
+        base_seq = changelog.get_last_seq(self.ctx.connection)
+        with self.ctx.connection:
+            self.ctx.connection.execute("ALTER TABLE iv_table_001 ADD COLUMN extra TEXT")
+            content.update_record(self.ctx, "b", "key0", {"value": "y"})
+        delta_path = Path(self.directory, "1.delta")
+        increment.create_delta(self._snapshot(), delta_path, base_seq)
+        restored_path = Path(self.directory, "restored.db")
+        increment.restore_chain([full_path, delta_path], restored_path)
+        self.assertEqual(read_tables(restored_path), read_tables(self.path))
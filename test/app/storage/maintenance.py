@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from app.storage.sql import content, maintenance
+
+from . import create_test_context
+
+
+class MaintenanceTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_maintenance.db")
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t")
+            for i in range(500):
+                content.insert_record(self.ctx, "t", f"key{i}", {"value": "x" * 200})
+            for i in range(450):
+                content.del_record(self.ctx, "t", f"key{i}")
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def test_0(self):
+        report = maintenance.get_report(self.ctx)
+        self.assertEqual(report.auto_vacuum, "INCREMENTAL")
+        self.assertGreater(report.free_ratio, 0.3)
+        self.assertIn("t", [usage.name for usage in report.tables])
+        self.assertEqual(maintenance.incremental_vacuum(self.ctx, max_pages=5, step_pages=2), 5)
+        maintenance.incremental_vacuum(self.ctx)
+        after = maintenance.get_report(self.ctx)
+        self.assertEqual(after.freelist_count, 0)
+        self.assertEqual(after.page_count, report.page_count - report.freelist_count)
+        self.assertEqual(len(list(content.iterate_with_decryption(self.ctx, "t"))), 50)
+
+    def test_1(self):
+        self.ctx.connection.execute("PRAGMA auto_vacuum = NONE")
+        self.ctx.connection.execute("VACUUM")
+        with self.ctx.connection:
+            content.del_record(self.ctx, "t", "key499")
+        self.assertEqual(maintenance.get_report(self.ctx).auto_vacuum, "NONE")
+        self.assertEqual(maintenance.incremental_vacuum(self.ctx), 0)
+        maintenance.convert_to_incremental(self.ctx)
+        maintenance.compact_bloom_filters(self.ctx)
+        maintenance.optimize(self.ctx)
+        report = maintenance.get_report(self.ctx)
+        self.assertEqual(report.auto_vacuum, "INCREMENTAL")
+        self.assertEqual(report.freelist_count, 0)
+        self.assertIsNotNone(content.get_record(self.ctx, "t", "key498"))
+        self.assertIsNone(content.get_record(self.ctx, "t", "key0"))
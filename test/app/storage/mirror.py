@@ -0,0 +1,73 @@
+from unittest import TestCase
+from pathlib import Path
+from contextlib import closing
+from dataclasses import replace
+
+from app import config
+from app.storage.sql import content, mirror, raw, search, share
+
+from . import create_test_context
+
+
+class MirrorTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_mirror.db")
+        ctx = create_test_context(self.path.name)
+        with ctx.connection:
+            content.create_table(ctx, "t", enable_hash_search=True)
+            content.insert_record(ctx, "t", "key", {"value": "1"})
+        ctx.connection.close()
+        self.mixer, self.hs_hasher = ctx.mixer, ctx.hs_hasher
+        self.ctx = None
+
+    def tearDown(self):
+        if self.ctx is not None:
+            self.ctx.connection.close()
+
+    def _connect(self, **kwargs):
+        self.ctx = share.ConnectionContext(mirror.db_connect_mirror(self.path, **kwargs), self.mixer, self.hs_hasher)
+
+    def _disk_count(self):
+        with closing(raw.db_connect(self.path, read_only=True)) as connection:
+            return raw.count_star_raw(connection, "table_000")
+
+    def test_0(self):
+        self._connect()
+        self.assertEqual(content.get_record(self.ctx, "t", "key"), {"value": "1"})
+        with self.ctx.connection:
+            content.insert_record(self.ctx, "t", "key2", {"value": "2"})
+        self.assertEqual(self._disk_count(), 2)
+        with self.assertRaises(ValueError), self.ctx.connection:
+            content.insert_record(self.ctx, "t", "key3", {"value": "3"})
+            raise ValueError()
+        self.assertEqual(self._disk_count(), 2)
+        self.assertIsNone(content.get_record(self.ctx, "t", "key3"))
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t2")
+            content.insert_record(self.ctx, "t2", "key", {"value": "3"})
+        self.ctx = replace(self.ctx, search=search.create_search_index(self.ctx.connection))
+        search.index_tables(self.ctx, "t", "t2")
+        self.ctx.connection.close()
+        self._connect()
+        self.assertEqual(content.get_record(self.ctx, "t2", "key"), {"value": "3"})
+        self.assertEqual(content.count_records(self.ctx, "t"), 2)
+
+    def test_1(self):
+        self._connect(deferred=True, flush_interval=3600)
+        with self.ctx.connection:
+            content.insert_record(self.ctx, "t", "key2", {"value": "2"})
+        self.assertEqual(self._disk_count(), 1)
+        self.ctx.connection.flush()
+        self.assertEqual(self._disk_count(), 2)
+        with self.ctx.connection:
+            content.del_record(self.ctx, "t", "key")
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t2")
+            content.insert_record(self.ctx, "t2", "key", {"value": "3"})
+        self.ctx.connection.close()
+        self._connect()
+        self.assertEqual(content.get_record(self.ctx, "t", "key2"), {"value": "2"})
+        self.assertIsNone(content.get_record(self.ctx, "t", "key"))
+        self.assertEqual(content.get_record(self.ctx, "t2", "key"), {"value": "3"})
+
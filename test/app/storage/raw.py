@@ -0,0 +1,36 @@
+from unittest import TestCase
+from pathlib import Path
+
+from app import config
+from app.storage.sql import raw
+from app.storage.sql.share import StorageError
+
+
+class SqliteSettingsTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_raw.db")
+
+    def _pragma(self, connection, name):
+        return raw.execute_sql(connection, f"PRAGMA {name}", fetch_one=True)[0]
+
+    def test_0(self):
+        settings = raw.SqliteSettings(journal_mode="WAL", synchronous="NORMAL", cache_size=-4096, page_size=8192, temp_store="MEMORY")
+        connection = raw.db_create_new(self.path, rewrite=True, connect=True, settings=settings)
+        with connection:
+            raw.execute_sql(connection, "CREATE TABLE t (id INTEGER PRIMARY KEY)", close_cursor=True)
+        self.assertEqual(self._pragma(connection, "journal_mode"), "wal")
+        self.assertEqual(self._pragma(connection, "synchronous"), 1)
+        self.assertEqual(self._pragma(connection, "cache_size"), -4096)
+        self.assertEqual(self._pragma(connection, "page_size"), 8192)
+        self.assertEqual(self._pragma(connection, "temp_store"), 2)
+        connection.close()
+        connection = raw.db_connect(self.path, settings=raw.PERFORMANCE_PROFILES["durable"])
+        self.assertEqual(self._pragma(connection, "journal_mode"), "delete")
+        self.assertEqual(self._pragma(connection, "synchronous"), 2)
+        self.assertEqual(self._pragma(connection, "page_size"), 8192)
+        connection.close()
+
+    def test_1(self):
+        raw.db_create_new(self.path, rewrite=True)
+        self.assertRaises(StorageError, raw.db_connect, self.path, settings=raw.SqliteSettings(journal_mode="WAL; DROP"))
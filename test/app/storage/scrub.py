@@ -0,0 +1,50 @@
+from unittest import TestCase
+from pathlib import Path
+
+from app import config
+from app.storage.sql import content, description, scrub
+
+from . import create_test_context
+
+
+class ScrubTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_scrub.db")
+        self.path = Path(config.curconfig.db_directory, "__test_scrub.db")
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t")
+            content.create_table(self.ctx, "hs", enable_hash_search=True)
+            for i in range(100):
+                content.insert_record(self.ctx, "t", f"key{i}", {"value": str(i)})
+                content.insert_record(self.ctx, "hs", f"key{i}", {"value": str(i)})
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def _corrupt(self):
+        t, hs = description.get(self.ctx, "t").raw_name, description.get(self.ctx, "hs").raw_name
+        with self.ctx.connection:
+            self.ctx.connection.execute(f"UPDATE {t} SET data = 'AAAAAAAAAAAAAAAA' WHERE id = 5")
+            self.ctx.connection.execute(f"DELETE FROM iv_{t} WHERE id = 7")
+            self.ctx.connection.execute(f"UPDATE hs_{hs} SET hs_hash = 'x' WHERE id = 11")
+            self.ctx.connection.execute(f"UPDATE iv_{hs} SET iv_key = 'AAAA' WHERE id = 12")
+
+    def test_0(self):
+        report = scrub.scrub(self.ctx, self.path, workers=1, chunk_rows=16)
+        self.assertTrue(report.is_ok())
+        self.assertEqual((report.tables, report.rows), (2, 200))
+
+    def test_1(self):
+        self._corrupt()
+        progress = []
+        for workers in (1, 2):
+            report = scrub.scrub(self.ctx, self.path, workers=workers, chunk_rows=16, progress=lambda done, total: progress.append((done, total)))
+            self.assertEqual(report.rows, 200)
+            self.assertEqual(progress[-1], (200, 200))
+            issues = {(issue.table, issue.id, issue.check) for issue in report.issues}
+            self.assertEqual(issues, {
+                ("t", 5, scrub.CHECK_DATA), ("t", 7, scrub.CHECK_MISSING_IV),
+                ("hs", 11, scrub.CHECK_HS_MISMATCH), ("hs", 12, scrub.CHECK_KEY)
+            })
+            self.assertFalse(report.to_dict()["ok"])
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from dataclasses import replace
+
+from app.storage.sql import content, description, raw, search
+
+from . import create_test_context
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        ctx = create_test_context("__test_search.db")
+        with ctx.connection:
+            content.create_table(ctx, "t1")
+            content.create_table(ctx, "t2", enable_hash_search=True)
+            content.insert_record(ctx, "t1", "google.com", {"login": "alice", "note": "work mail"})
+            content.insert_record(ctx, "t1", "github.com", {"login": "bob"})
+            content.insert_record(ctx, "t2", "bank", {"pin": "1234", "note": "mail box"})
+        self.ctx = replace(ctx, search=search.create_search_index(ctx.connection))
+        with self.ctx.connection:
+            search.index_tables(self.ctx, "t1", "t2")
+
+    def tearDown(self):
+        search.drop_search_index(self.ctx)
+        self.ctx.connection.close()
+
+    def test_0(self):
+        keys = {result.key for result in search.search(self.ctx, "mail")}
+        self.assertEqual(keys, {"google.com", "bank"})
+
+    def test_1(self):
+        results = search.search(self.ctx, "mail", table="t2")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].table, "t2")
+        self.assertIn("[mail]", results[0].snippet)
+
+    def test_2(self):
+        with self.ctx.connection:
+            content.insert_record(self.ctx, "t1", "mail.com", {"login": "carol"})
+            content.update_record(self.ctx, "t1", "github.com", {"login": "dave"})
+            content.del_record(self.ctx, "t2", "bank")
+        self.assertEqual({r.key for r in search.search(self.ctx, "carol")}, {"mail.com"})
+        self.assertEqual(search.search(self.ctx, "bob"), [])
+        self.assertEqual({r.key for r in search.search(self.ctx, "dave")}, {"github.com"})
+        self.assertEqual({r.key for r in search.search(self.ctx, "mail")}, {"google.com", "mail.com"})
+
+    def test_3(self):
+        with self.ctx.connection:
+            content.delete_table(self.ctx, "t1")
+        self.assertEqual({r.key for r in search.search(self.ctx, "mail")}, {"bank"})
+
+    def test_4(self):
+        self.assertRaises(search.SearchIndexError, search.search, self.ctx, "\"unterminated")
+
+    def test_5(self):
+        # NOTE: index writes are not vault changes, otherwise indexing would trigger autoupload on disconnect
+        changes = raw.get_content_changes_count(self.ctx)
+        self.assertGreater(raw.get_changed_rows_count(self.ctx.connection), changes)
+        search.drop_search_index(self.ctx)
+        self.ctx = replace(self.ctx, search=search.create_search_index(self.ctx.connection))
+        with self.ctx.connection:
+            search.index_tables(self.ctx, "t1", "t2")
+            content.delete_table(self.ctx, "t2")
+        self.assertGreater(raw.get_content_changes_count(self.ctx), changes)
+        changes = raw.get_content_changes_count(self.ctx)
+        with self.ctx.connection:
+            search.index_tables(self.ctx, "t1")
+            search.on_delete_table(self.ctx, description.get(self.ctx, "t1"))
+        self.assertEqual(raw.get_content_changes_count(self.ctx), changes)
@@ -0,0 +1,81 @@
+from unittest import TestCase
+from pathlib import Path
+from contextlib import closing
+from dataclasses import replace
+
+from app import config
+from app.storage.sql import content, description, raw, scrub, shard, snapshot
+from app.storage.sql.catalog import DescriptionCatalog
+
+from . import create_test_context
+
+
+class ShardTests(TestCase):
+
+    def setUp(self):
+        self.path = Path(config.curconfig.db_directory, "__test_shard.db")
+        ctx = create_test_context(self.path.name)
+        shard.create_shards(ctx.connection, self.path, 3)
+        self.ctx = replace(ctx, shards=shard.attach_shards(ctx.connection, self.path))
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def _schema_tables(self, connection, schema):
+        return {row[0] for row in connection.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+
+    def test_0(self):
+        self.assertEqual(self.ctx.shards, 3)
+        with self.ctx.connection:
+            for i in range(4):
+                content.create_table(self.ctx, f"t{i}", enable_hash_search=bool(i % 2))
+                for j in range(20):
+                    content.insert_record(self.ctx, f"t{i}", f"key{j}", {"value": str(j)})
+            content.update_record(self.ctx, "t1", "key1", {"value": "changed"})
+            content.del_record(self.ctx, "t2", "key2")
+        raw_name = description.get(self.ctx, "t1").raw_name
+        self.assertEqual(self._schema_tables(self.ctx.connection, "shard_1"), {raw_name, f"iv_{raw_name}", f"hs_{raw_name}"})
+        self.assertEqual(self._schema_tables(self.ctx.connection, "shard_0"), {"table_000", "iv_table_000", "table_003", "iv_table_003", "hs_table_003"})
+        self.assertFalse(any(name.startswith("table_") for name in self._schema_tables(self.ctx.connection, "main")))
+        self.assertEqual(content.get_record(self.ctx, "t1", "key1"), {"value": "changed"})
+        self.assertIsNone(content.get_record(self.ctx, "t2", "key2"))
+        self.assertTrue(scrub.scrub(self.ctx, self.path, workers=2).is_ok())
+        with self.ctx.connection:
+            content.delete_table(self.ctx, "t3")
+        self.assertEqual(self._schema_tables(self.ctx.connection, "shard_0"), {"table_000", "iv_table_000"})
+
+    def test_1(self):
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t", enable_hash_search=True)
+            content.insert_record(self.ctx, "t", "key", {"value": "1"})
+        with closing(raw.db_connect(self.path, read_only=True)) as connection:
+            ctx = replace(self.ctx, connection=connection, catalog=DescriptionCatalog(), bloom={}, shards=shard.attach_shards(connection, self.path, read_only=True))
+            self.assertEqual(content.get_record(ctx, "t", "key"), {"value": "1"})
+        self.assertEqual(shard.get_existing_shard_paths(self.ctx.connection, self.path), shard.get_shard_paths(self.path, 3))
+        self.assertRaises(shard.StorageError, shard.create_shards, self.ctx.connection, self.path, 2)
+
+    def test_2(self):
+        # NOTE: changes committed while snapshot is copied are in none of its files
+        for schema in ("main", "shard_0", "shard_1", "shard_2"):
+            self.ctx.connection.execute(f"PRAGMA {schema}.journal_mode = WAL")
+        with self.ctx.connection:
+            for i in range(2):
+                content.create_table(self.ctx, f"t{i}")
+                for j in range(100):
+                    content.insert_record(self.ctx, f"t{i}", f"key{j}", {"value": "x" * 100})
+
+        def progress(_status, remaining, _total):
+            if not calls:
+                with self.ctx.connection:
+                    content.update_record(self.ctx, "t0", "key0", {"value": "changed"})
+                    content.update_record(self.ctx, "t1", "key0", {"value": "changed"})
+            calls.append(remaining)
+
+        calls = []
+        snapshot_path = Path(config.curconfig.db_directory, "__test_shard_snapshot.db")
+        snapshot.create_snapshot(self.path, snapshot_path, step_pages=1, progress=progress)
+        self.assertGreater(len(calls), 1)
+        with closing(raw.db_connect(snapshot_path, read_only=True)) as connection:
+            ctx = replace(self.ctx, connection=connection, catalog=DescriptionCatalog(), bloom={}, shards=shard.attach_shards(connection, snapshot_path, read_only=True))
+            self.assertEqual([content.get_record(ctx, f"t{i}", "key0") for i in range(2)], [{"value": "x" * 100}] * 2)
+        self.assertEqual([content.get_record(self.ctx, f"t{i}", "key0") for i in range(2)], [{"value": "changed"}] * 2)
@@ -0,0 +1,57 @@
+from unittest import TestCase
+from pathlib import Path
+from contextlib import closing
+from dataclasses import replace
+
+from app import config
+from app.storage.sql import content, raw, snapshot
+from app.storage.sql.catalog import DescriptionCatalog
+
+from . import create_test_context
+
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        self.ctx = create_test_context("__test_snapshot.db")
+        self.src_path = Path(config.curconfig.db_directory, "__test_snapshot.db")
+        self.directory = Path(config.curconfig.db_directory, "__test_snapshots")
+        for path in snapshot.list_snapshots(self.directory, "dbid"):
+            path.unlink()
+        with self.ctx.connection:
+            content.create_table(self.ctx, "t")
+            for i in range(200):
+                content.insert_record(self.ctx, "t", f"key{i}", {"value": "x" * 100})
+
+    def tearDown(self):
+        self.ctx.connection.close()
+
+    def _read_keys(self, path):
+        with closing(raw.db_connect(path)) as connection:
+            ctx = replace(self.ctx, connection=connection, catalog=DescriptionCatalog(), bloom={})
+            return [row[content.KEY_COL] for row in content.iterate_with_decryption(ctx, "t", columns=(content.KEY_COL,))]
+
+    def test_0(self):
+        calls = []
+
+        def progress(_status, remaining, total):
+            if not calls:
+                with self.ctx.connection:
+                    content.insert_record(self.ctx, "t", "late", {})
+            calls.append((remaining, total))
+
+        path = snapshot.create_snapshot(self.src_path, snapshot.gen_snapshot_path(self.directory, "dbid"), step_pages=1, progress=progress)
+        self.assertGreater(len(calls), 1)
+        self.assertFalse(path.with_name(path.name + snapshot.PARTIAL_SUFFIX).exists())
+        keys = self._read_keys(path)
+        self.assertEqual(len(keys), 201)
+        self.assertEqual(keys[-1], "late")
+
+    def test_1(self):
+        for _ in range(4):
+            snapshot.create_snapshot(self.src_path, snapshot.gen_snapshot_path(self.directory, "dbid"))
+        snapshots = snapshot.list_snapshots(self.directory, "dbid")
+        removed = snapshot.rotate_snapshots(self.directory, "dbid", 2)
+        self.assertEqual(removed, snapshots[:2])
+        self.assertEqual(snapshot.list_snapshots(self.directory, "dbid"), snapshots[2:])
+        self.assertRaises(snapshot.StorageError, snapshot.create_snapshot, Path(self.directory, "missing.db"), Path(self.directory, "x.db"))
@@ -0,0 +1,138 @@
+from unittest import TestCase
+from pathlib import Path
+
+from app import config
+from app.storage.store import RecordStore, SqlRecordStore
+from app.storage.log import store as log_store
+from app.storage.log.share import LogStoreError
+from app.storage.sql.share import StorageError
+from app.storage.sql.description import TableNotExist
+
+from . import create_test_context, create_test_mixer
+
+
+class RecordStoreTestsMixin:
+    """
+    Same behaviour is expected from every engine
+    """
+
+    def create_store(self) -> RecordStore:
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.store = self.create_store()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_0(self):
+        self.store.create_table("t")
+        self.store.create_table("hs", hash_search=True)
+        self.assertRaises(StorageError, self.store.create_table, "t")
+        self.assertEqual(self.store.iterate_tables(), ["hs", "t"])
+        for table in ("t", "hs"):
+            self.store.insert(table, "key", {"login": "a"})
+            self.assertRaises(StorageError, self.store.insert, table, "key", {})
+            self.store.update(table, "key", {"password": "b"})
+            self.assertEqual(self.store.get(table, "key"), {"login": "a", "password": "b"})
+            self.store.update(table, "key", {"login": "c"}, new_key="key2", replace=True)
+            self.assertIsNone(self.store.get(table, "key"))
+            self.assertEqual(self.store.get(table, "key2"), {"login": "c"})
+            self.assertRaises(StorageError, self.store.update, table, "key", {})
+            self.store.insert(table, "key3", {})
+            self.assertEqual(self.store.count(table), 2)
+            self.store.delete(table, "key2")
+            self.store.delete(table, "missing")
+            self.assertEqual(list(self.store.iterate(table)), [("key3", {})])
+            self.assertEqual(list(self.store.iterate_keys(table)), ["key3"])
+        self.store.delete_table("t")
+        self.assertFalse(self.store.is_table_exist("t"))
+        self.assertRaises(TableNotExist, self.store.get, "t", "key3")
+        self.assertRaises(TableNotExist, self.store.delete_table, "t")
+
+    def test_1(self):
+        self.store.create_table("t")
+        with self.store.transaction():
+            for i in range(50):
+                self.store.insert("t", f"key{i}", {"value": str(i)})
+        try:
+            with self.store.transaction():
+                self.store.delete("t", "key0")
+                self.store.insert("t", "new", {})
+                self.store.create_table("t2")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.store.count("t"), 50)
+        self.assertEqual(self.store.get("t", "key0"), {"value": "0"})
+        self.assertIsNone(self.store.get("t", "new"))
+        self.assertFalse(self.store.is_table_exist("t2"))
+        self.assertEqual(sorted(key for key, _ in self.store.iterate("t")), sorted(f"key{i}" for i in range(50)))
+
+
+class SqlRecordStoreTests(RecordStoreTestsMixin, TestCase):
+
+    def create_store(self):
+        return SqlRecordStore(create_test_context("__test_store.db"))
+
+
+class LogRecordStoreTests(RecordStoreTestsMixin, TestCase):
+
+    def create_store(self):
+        self.path = Path(config.curconfig.db_directory, "__test_store.log")
+        self.mixer = create_test_mixer()
+        return log_store.LogRecordStore.create(self.path, self.mixer, rewrite=True)
+
+    def _reopen(self):
+        self.store.close()
+        self.store = log_store.LogRecordStore.open(self.path, self.mixer)
+
+    def test_100(self):
+        self.store.create_table("t")
+        for i in range(20):
+            self.store.insert("t", f"key{i}", {"value": str(i)})
+        self._reopen()
+        self.assertEqual(self.store.get("t", "key5"), {"value": "5"})
+        self.store.update("t", "key5", {"value": "changed"})
+        # NOTE: tail written after saved index is replayed from log
+        self.store.segment.close()
+        self.store = log_store.LogRecordStore.open(self.path, self.mixer)
+        self.assertEqual(self.store.get("t", "key5"), {"value": "changed"})
+        log_store.get_index_path(self.path).unlink()
+        self._reopen()
+        self.assertEqual(self.store.count("t"), 20)
+
+    def test_101(self):
+        self.store.create_table("t")
+        self.store.insert("t", "key", {"value": "1"})
+        self.store.insert("t", "key2", {"value": "2"})
+        self.store.segment.close()
+        with open(self.path, "r+b") as fd:
+            fd.truncate(self.path.stat().st_size - 3)
+        self.store = log_store.LogRecordStore.open(self.path, self.mixer)
+        self.assertEqual(self.store.get("t", "key"), {"value": "1"})
+        self.assertIsNone(self.store.get("t", "key2"))
+        self.store.insert("t", "key2", {"value": "3"})
+        self._reopen()
+        self.assertEqual(self.store.get("t", "key2"), {"value": "3"})
+        self.store.close()
+        self.assertRaises(LogStoreError, log_store.LogRecordStore.open, self.path, create_test_mixer())
+
+    def test_102(self):
+        self.store.create_table("t")
+        self.store.create_table("t2")
+        with self.store.transaction():
+            for i in range(100):
+                self.store.insert("t", f"key{i}", {"value": "x" * 100})
+                self.store.insert("t2", f"key{i}", {"value": "y"})
+        for i in range(90):
+            self.store.update("t", f"key{i}", {"value": "z"})
+        self.store.delete_table("t2")
+        size = self.path.stat().st_size
+        self.store.compact()
+        self.assertLess(self.path.stat().st_size, size / 2)
+        self.assertEqual(self.store.dead_bytes, 0)
+        self._reopen()
+        self.assertEqual(self.store.get("t", "key0"), {"value": "z"})
+        self.assertEqual(self.store.get("t", "key99"), {"value": "x" * 100})
+        self.assertEqual(self.store.iterate_tables(), ["t"])
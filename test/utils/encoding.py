@@ -1,3 +1,5 @@
+import zlib
+
 from unittest import TestCase
 
 from utils.encoding import *
@@ -21,4 +23,11 @@ class EncodingTests(TestCase):
     def test_5(self):
         data = "eyJhIjogMSwgImIiOiBbMSwgMiwgM119"
         expected = {"a": 1, "b": [1, 2, 3]}
-        self.assertEqual(decode_json_base64(data), expected)
\ No newline at end of file
+        self.assertEqual(decode_json_base64(data), expected)
+
+    def test_6(self):
+        data = b"hello" * 100
+        self.assertEqual(decompress_bytes(compress_bytes(data)), data)
+        compressed = compress_bytes(data, zlib.compressobj())
+        self.assertEqual(decompress_bytes(compressed, zlib.decompressobj()), data)
+        self.assertRaises(ValueError, decompress_bytes, compressed[:-4], zlib.decompressobj())
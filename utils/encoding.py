@@ -71,11 +71,24 @@ _LZMA_FILTERS = \
 ]
 
 
-def compress_bytes(data: bytes) -> bytes:
+def compress_bytes(data: bytes, compressor=None) -> bytes:
+    """
+    Raw LZMA2 by default, compressor object (compress() and flush()) writes its own format
+    """
+    if compressor is not None:
+        return compressor.compress(data) + compressor.flush()
     data = lzma.compress(data, lzma.FORMAT_RAW, lzma.CHECK_NONE, None, _LZMA_FILTERS)
     return data
 
 
-def decompress_bytes(data: bytes) -> bytes:
+def decompress_bytes(data: bytes, decompressor=None) -> bytes:
+    """
+    Raw LZMA2 by default, data of decompressor object should end its stream, ValueError otherwise
+    """
+    if decompressor is not None:
+        data = decompressor.decompress(data)
+        if not decompressor.eof:
+            raise ValueError("Compressed data is truncated")
+        return data
     data = lzma.decompress(data, lzma.FORMAT_RAW, None, _LZMA_FILTERS)
     return data